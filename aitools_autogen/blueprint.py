@@ -2,6 +2,44 @@ from typing import Optional
 
 from autogen import ConversableAgent
 
+from services.conversation import count_message_tokens, count_tokens
+from services.scheduler import BLUEPRINT, get_scheduler
+from services.telemetry import get_telemetry
+
+
+def _text(content) -> str:
+    if isinstance(content, dict):
+        content = content.get("content")
+    return content if isinstance(content, str) else ""
+
+
+def schedule_llm_calls(agent: ConversableAgent, priority: str = BLUEPRINT) -> ConversableAgent:
+    """
+    Send each of the agent's LLM calls through the shared scheduler, one slot per call, and account
+    for its tokens. autogen calls the endpoint with its own client, so without this its requests
+    bypass the rate limits. Agents without an LLM are left as they are.
+    """
+    if not agent.llm_config:
+        return agent
+
+    def scheduled_reply(recipient: ConversableAgent, messages=None, sender=None, config=None):
+        history = messages if messages is not None else recipient._oai_messages[sender]
+        prompt = [{"role": "user", "content": _text(message)} for message in recipient._oai_system_message + history]
+        # autogen tries its config_list in order; the first entry is the one that normally answers
+        endpoint = (recipient.llm_config.get("config_list") or [{}])[0]
+        model = endpoint.get("model") or "gpt-3.5-turbo"
+        prompt_tokens = count_message_tokens(prompt, model)
+        with get_scheduler().slot(priority, prompt_tokens) as lease, \
+                get_telemetry().measure('chat', 'auto_code', model, endpoint.get("base_url"), priority=priority,
+                                        prompt_tokens=prompt_tokens, usage='estimate') as sample:
+            final, reply = recipient.generate_oai_reply(messages, sender, config)
+            sample['completion_tokens'] = count_tokens(_text(reply), model)
+            lease.used(prompt_tokens + sample['completion_tokens'])
+        return final, reply
+
+    agent.replace_reply_func(ConversableAgent.generate_oai_reply, scheduled_reply)
+    return agent
+
 
 class Blueprint:
 
@@ -9,7 +47,7 @@ class Blueprint:
                  agents: Optional[list[ConversableAgent]] = None,
                  config_list: Optional[list[dict]] = None,
                  llm_config: Optional[dict] = None):
-        self._agents = agents or None
+        self._agents = [schedule_llm_calls(agent) for agent in agents] if agents else None
         self._config_list = config_list or None
         self._llm_config = llm_config or None
 
@@ -4,7 +4,7 @@ from autogen import ConversableAgent
 
 import aitools_autogen.utils
 from aitools_autogen.agents import WebPageScraperAgent
-from aitools_autogen.blueprint import Blueprint
+from aitools_autogen.blueprint import Blueprint, schedule_llm_calls
 from aitools_autogen.config import llm_config_openai as llm_config, config_list_openai as config_list, WORKING_DIR
 
 
@@ -79,6 +79,10 @@ class CoreClientTestBlueprint(Blueprint):
         Feel free to include multiple code blocks in one response. Do not ask users to copy and paste the result.
         """)
 
+        # Each LLM call of the agents waits for its own scheduler slot
+        schedule_llm_calls(summary_agent)
+        schedule_llm_calls(aiohttp_client_agent)
+
         agent0.initiate_chat(scraper_agent, True, True, message=message)
 
         message = agent0.last_message(scraper_agent)["content"]
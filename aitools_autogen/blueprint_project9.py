@@ -5,7 +5,7 @@ from typing import Optional
 from autogen import ConversableAgent
 
 import aitools_autogen.utils
-from aitools_autogen.blueprint import Blueprint
+from aitools_autogen.blueprint import Blueprint, schedule_llm_calls
 from aitools_autogen.config import llm_config_openai as llm_config, config_list_openai as config_list, WORKING_DIR
 
 
@@ -70,6 +70,10 @@ class CodeQualityAnalyzerBlueprint(Blueprint):
             Implement all necessary files to create a working solution."""
         )
 
+        # Each LLM call of the agents waits for its own scheduler slot
+        schedule_llm_calls(architect)
+        schedule_llm_calls(developer)
+
         # Initial request to architect
         prompt = f"""Create a code quality analyzer tool with these requirements:
         1. Analyze Python code for common issues like:
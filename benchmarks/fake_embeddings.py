@@ -0,0 +1,42 @@
+import functools
+import hashlib
+from typing import List, Sequence
+
+import numpy as np
+
+from services.lexical_index import tokenize
+
+
+class FakeEmbeddings:
+    """
+    Deterministic, local stand-in for an embeddings endpoint.
+
+    A text embeds to the normalized sum of per-term random vectors, each seeded by a hash of the term,
+    so texts that share terms are close and the same text always gets the same vector, in any process.
+    Terms are the BM25 tokens, which keeps lexical and vector retrieval comparable in benchmarks.
+    """
+
+    def __init__(self, dimension: int = 1536, seed: int = 0):
+        self.dimension = dimension
+        self.seed = seed
+        self.model = f"fake-embedding-{dimension}-{seed}"
+
+    @functools.lru_cache(maxsize=65536)
+    def term_vector(self, term: str) -> np.ndarray:
+        digest = hashlib.blake2b(f"{self.seed}:{term}".encode('utf-8'), digest_size=8).digest()
+        vector = np.random.default_rng(int.from_bytes(digest, 'little')).standard_normal(self.dimension)
+        vector = vector.astype(np.float32)
+        vector.flags.writeable = False
+        return vector
+
+    def embed(self, text: str) -> np.ndarray:
+        terms = tokenize(text) or [text]
+        vector = np.sum([self.term_vector(term) for term in terms], axis=0)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def __call__(self, texts: Sequence[str]) -> List[np.ndarray]:
+        return [self.embed(text) for text in texts]
+
+    def term_matrix(self, terms: Sequence[str]) -> np.ndarray:
+        """Stack the vectors of many terms, for building synthetic corpora without embedding each text."""
+        return np.stack([self.term_vector(term) for term in terms])
@@ -0,0 +1,318 @@
+"""
+Load test of Ducky's services against the local mock OpenAI server, with no network access.
+
+Starts benchmarks.mock_openai in this process (or uses --base-url), points the app at it and runs --users
+virtual users for --duration seconds. Each user is a thread that, like a Streamlit session, runs one
+`asyncio.run` per action: a Quick Chat question (`services.llm.converse`), a library question
+(`helpers.util.ask_book`), an image (`services.images.generate_image`) or an Auto Code blueprint run,
+picked by the weights in --scenarios, with exponential think time between actions. The app's own
+scheduler, routing and any configured rate limits stay in effect (--unlimited lifts the rate limits).
+
+Reports throughput, errors and latency percentiles per scenario (time to first token for chat), plus the
+app's telemetry, scheduler and connection statistics and the requests the mock served, as JSON. Caches,
+generated files and telemetry go to a temporary directory, so the real ones in data/ are left alone.
+
+    python -m benchmarks.load --users 20 --duration 60
+    python -m benchmarks.load --users 50 --scenarios chat=1 --ttft lognormal:0.8,0.6 --error-rate 0.02 --unlimited
+    python -m benchmarks.load --base-url http://127.0.0.1:8000/v1 --users 10 --output load.json
+
+Outside `streamlit run`, Streamlit's session state is shared by the whole process, so library questions
+are always the opening question of a fresh conversation. Blueprints need autogen and are skipped without it.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.mock_openai import MockOpenAIServer, add_server_arguments, server_options
+from benchmarks.retrieval import percentiles
+
+QUESTIONS = [
+    "What is the DRY principle and how do I apply it?",
+    "How should I name boolean variables?",
+    "Why are broken windows dangerous in a codebase?",
+    "What is the difference between a unit test and an integration test?",
+    "How do I decide when to refactor?",
+    "What are tracer bullets in software development?",
+    "How can I make my functions easier to test?",
+    "Why should configuration be kept out of code?",
+    "What is orthogonality in software design?",
+    "How do I estimate how long a task will take?",
+]
+IMAGE_PROMPTS = [
+    "A rubber duck debugging a program on a laptop",
+    "A tidy workshop full of programming tools",
+    "A lighthouse guiding ships made of code",
+]
+BLUEPRINT_TASK = "I want to retrieve the Open API specification from {base}/openapi.json"
+
+
+def configure(base_url: str, work_dir: str, cache: bool, unlimited: bool) -> None:
+    """
+    Point the app at `base_url` and keep its caches, library store, images and telemetry in `work_dir`.
+    Must run before the services are used: several of them read the environment on import.
+    """
+    os.environ.update({
+        'OPENAI_API_BASE_URL': base_url,
+        'OPENAI_API_KEY': 'mock',
+        'DUCKY_LLM_CACHE': '1' if cache else '0',
+        'DUCKY_TELEMETRY_DIR': os.path.join(work_dir, 'telemetry'),
+    })
+    os.environ.setdefault('OPENAI_API_MODEL', 'gpt-3.5-turbo')
+    if unlimited:
+        os.environ.update({'DUCKY_LLM_REQUESTS_PER_MINUTE': '0', 'DUCKY_LLM_TOKENS_PER_MINUTE': '0'})
+
+    # The pages' st calls run without a script context here and would warn on every one
+    # (a filter, since streamlit resets its loggers' levels when it reads its config)
+    logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').addFilter(
+        lambda record: 'missing ScriptRunContext' not in record.getMessage())
+
+    from aitools_autogen.config import config_list_openai, llm_config_openai
+    for entry in config_list_openai:
+        entry.update(base_url=base_url, api_key='mock')
+    # autogen would otherwise replay its cached answers from .cache
+    llm_config_openai['cache_seed'] = None
+
+    import helpers.util
+    import services.embedding_cache
+    import services.images
+    import services.llm_cache
+    import services.page_images
+    import services.semantic_cache
+    from services.retrieval import get_retrieval_service
+
+    helpers.util.LIBRARY_STORE_PATH = os.path.join(work_dir, 'library.embeddings')
+    services.llm_cache._default_cache.replace(services.llm_cache.LLMResponseCache(os.path.join(work_dir, 'llm')))
+    services.embedding_cache._default_cache.replace(services.embedding_cache.EmbeddingCache(
+        os.path.join(work_dir, 'query_embeddings.sqlite')))
+    services.page_images._default_cache.replace(
+        services.page_images.PageImageCache(os.path.join(work_dir, 'pages')))
+    from services.clients import get_client
+    searcher = get_retrieval_service(helpers.util.LIBRARY_DIR, helpers.util.LIBRARY_STORE_PATH).searcher
+    # The searcher has its own endpoint rather than OPENAI_API_BASE_URL
+    searcher.base_url, searcher.api_key = base_url, 'mock'
+    searcher.client = get_client(base_url, 'mock')
+    services.semantic_cache._default_cache.replace(services.semantic_cache.SemanticResponseCache(
+        lambda text: searcher.get_embedding(text, timeout=2.0), os.path.join(work_dir, 'semantic_responses.sqlite')))
+    setattr(services.images, '__IMAGES_BASE_FOLDER', os.path.join(work_dir, 'images'))
+
+
+async def chat(rng: random.Random) -> Optional[float]:
+    """A Quick Chat opening question; returns the seconds to its first chunk."""
+    import services.llm
+    from services import prompts
+
+    messages = [{"role": "system", "content": prompts.quick_chat_system_prompt()},
+                {"role": "user", "content": rng.choice(QUESTIONS)}]
+    started = time.monotonic()
+    first_token = None
+    async for chunk in services.llm.converse(messages, hints={"page": "quick_chat"}):
+        if chunk.startswith(("EXCEPTION", "oaiEXCEPTION")):
+            raise RuntimeError(chunk)
+        if first_token is None:
+            first_token = time.monotonic() - started
+    return first_token
+
+
+async def ask_book(rng: random.Random) -> None:
+    import helpers.util
+    from services import prompts
+
+    question = rng.choice(QUESTIONS)
+    messages = [{"role": "system", "content": prompts.quick_chat_system_prompt()},
+                {"role": "user", "content": question}]
+    await helpers.util.ask_book(messages, question)
+    if messages[-1]['content'] == helpers.util.ADVICE_ERROR:
+        raise RuntimeError("The answer failed")
+
+
+async def image(rng: random.Random) -> None:
+    from services.images import generate_image
+
+    await generate_image(rng.choice(IMAGE_PROMPTS))
+
+
+def blueprint(base_url: str, work_dir: str) -> Callable[[random.Random], object]:
+    from aitools_autogen.blueprint_project9 import CodeQualityAnalyzerBlueprint
+
+    async def run(rng: random.Random) -> None:
+        # As on the Auto Code page, each of the agents' LLM calls goes through the scheduler
+        await CodeQualityAnalyzerBlueprint(tempfile.mkdtemp(dir=work_dir)).initiate_work(
+            message=BLUEPRINT_TASK.format(base=base_url.rsplit('/v1', 1)[0]))
+
+    return run
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.first_tokens: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def add(self, scenario: str, seconds: float, first_token: Optional[float] = None,
+            error: Optional[Exception] = None) -> None:
+        with self._lock:
+            if error is not None:
+                self.errors.setdefault(scenario, Counter())[type(error).__name__] += 1
+                return
+            self.latencies.setdefault(scenario, []).append(seconds * 1000)
+            if first_token is not None:
+                self.first_tokens.setdefault(scenario, []).append(first_token * 1000)
+
+    def report(self, elapsed: float) -> List[Dict]:
+        rows = []
+        with self._lock:
+            for scenario in sorted(set(self.latencies) | set(self.errors)):
+                completed = len(self.latencies.get(scenario, []))
+                errors = sum(self.errors.get(scenario, Counter()).values())
+                row = {
+                    'scenario': scenario,
+                    'completed': completed,
+                    'errors': errors,
+                    'error_rate': round(errors / (completed + errors), 4) if completed + errors else 0.0,
+                    'error_types': dict(self.errors.get(scenario, {})),
+                    'throughput_per_s': round(completed / elapsed, 3) if elapsed else 0.0,
+                    **percentiles(self.latencies.get(scenario, [])),
+                }
+                if scenario in self.first_tokens:
+                    first_tokens = percentiles(self.first_tokens[scenario])
+                    row.update({f"ttft_{key}": value for key, value in first_tokens.items()})
+                rows.append(row)
+        return rows
+
+
+def virtual_user(index: int, scenarios: Dict[str, Callable], weights: List[float], deadline: float,
+                 think_time: float, results: Results, seed: int) -> None:
+    rng = random.Random(seed * 100003 + index)
+    names = list(scenarios)
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        started = time.monotonic()
+        try:
+            # One event loop per action, as each Streamlit rerun makes its own
+            first_token = asyncio.run(scenarios[name](rng))
+            results.add(name, time.monotonic() - started, first_token)
+        except Exception as e:
+            print(f"[user {index}] {name} failed: {type(e).__name__}: {e}", file=sys.stderr)
+            results.add(name, time.monotonic() - started, error=e)
+        if think_time:
+            time.sleep(min(rng.expovariate(1 / think_time), max(0.0, deadline - time.monotonic())))
+
+
+def parse_scenarios(specs: List[str]) -> Dict[str, float]:
+    """`chat=6 ask_book=3 image` -> {'chat': 6.0, 'ask_book': 3.0, 'image': 1.0}"""
+    weights = {}
+    for spec in specs:
+        name, _, weight = spec.partition('=')
+        if name not in ('chat', 'ask_book', 'image', 'blueprint'):
+            raise ValueError(f"Unknown scenario: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=60.0, help="seconds of load after the ramp-up starts")
+    parser.add_argument('--ramp-up', type=float, default=5.0, help="seconds over which the users start")
+    parser.add_argument('--think-time', type=float, default=1.0, help="mean seconds between a user's actions")
+    parser.add_argument('--scenarios', nargs='+', default=['chat=6', 'ask_book=3', 'image=1', 'blueprint=1'],
+                        help="scenario=weight, from chat, ask_book, image and blueprint")
+    parser.add_argument('--cache', action='store_true', help="keep the LLM response cache on")
+    parser.add_argument('--unlimited', action='store_true', help="ignore DUCKY_LLM_REQUESTS/TOKENS_PER_MINUTE")
+    parser.add_argument('--base-url', help="use an already running mock server instead of starting one")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    weights = parse_scenarios(args.scenarios)
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = MockOpenAIServer(**server_options(args))
+        base_url = server.start()
+    work_dir = tempfile.mkdtemp(prefix='ducky-load-')
+    try:
+        configure(base_url, work_dir, args.cache, args.unlimited)
+        scenarios = {'chat': chat, 'ask_book': ask_book, 'image': image}
+        if weights.get('blueprint'):
+            try:
+                scenarios['blueprint'] = blueprint(base_url, work_dir)
+            except ImportError as e:
+                print(f"Skipping blueprints: {e}", file=sys.stderr)
+        scenarios = {name: scenarios[name] for name in weights if name in scenarios and weights[name] > 0}
+        if not scenarios:
+            parser.error("no scenario left to run")
+
+        setup = {}
+        if 'ask_book' in scenarios:
+            import helpers.util
+            started = time.perf_counter()
+            service = helpers.util.retrieval_service().warm()
+            setup['library_warm_s'] = round(time.perf_counter() - started, 3)
+            setup['library'] = service.health()
+            print(f"Library ready in {setup['library_warm_s']}s", file=sys.stderr)
+
+        results = Results()
+        started = time.monotonic()
+        deadline = started + args.duration
+        threads = []
+        for index in range(args.users):
+            thread = threading.Thread(target=virtual_user, name=f"virtual-user-{index}", daemon=True, args=(
+                index, scenarios, [weights[name] for name in scenarios], deadline, args.think_time, results, args.seed))
+            thread.start()
+            threads.append(thread)
+            time.sleep(args.ramp_up / args.users if args.users else 0)
+        print(f"{args.users} users running on {base_url}", file=sys.stderr)
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        from services.clients import get_registry
+        from services.scheduler import get_scheduler
+        from services.telemetry import get_telemetry
+        report = {
+            'benchmark': 'load',
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'users': args.users,
+            'elapsed_s': round(elapsed, 3),
+            'think_time_s': args.think_time,
+            'scenarios': {name: weights[name] for name in scenarios},
+            'server': server_options(args) if server is not None else {'base_url': base_url},
+            'setup': setup,
+            'results': results.report(elapsed),
+            'telemetry': get_telemetry().summary(('kind', 'page', 'model')),
+            'scheduler': get_scheduler().stats(),
+            'clients': get_registry().stats(),
+            'served': server.stats() if server is not None else None,
+        }
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""
+Local stand-in for the parts of the OpenAI API Ducky uses, for load tests and offline runs.
+
+Serves streaming and non-streaming chat completions (with `stream_options` usage), embeddings (float or
+base64, from FakeEmbeddings), image generation (returning a URL on this server) and audio transcription.
+Outputs are deterministic: the same request always gets the same text, vectors or image. Latencies are
+drawn from configurable distributions, chat completions stream at a set tokens per second, and errors
+(429 with Retry-After, 5xx), stalls before the first token and mid-stream disconnects can be injected.
+GET /stats reports the requests served.
+
+    python -m benchmarks.mock_openai --port 8000 --ttft lognormal:0.4,0.5 --tokens-per-second 60
+    OPENAI_API_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=mock streamlit run 🏠_Ducky.py
+
+Latency distributions are written as `fixed:SECONDS`, `uniform:LOW,HIGH`, `lognormal:MEDIAN,SIGMA` or
+`exponential:MEAN`.
+"""
+import argparse
+import base64
+import functools
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.fake_embeddings import FakeEmbeddings
+
+WORDS = ("the", "function", "returns", "a", "value", "when", "code", "is", "tested", "and", "each", "module",
+         "should", "handle", "errors", "clearly", "so", "that", "refactoring", "stays", "safe", "with", "small",
+         "steps", "you", "can", "review", "design", "before", "writing", "tests", "for", "every", "change",
+         "pragmatic", "programmers", "automate", "repetitive", "tasks", "keep", "knowledge", "in", "plain",
+         "text", "use", "version", "control", "always", "prototype", "to", "learn", "fix", "broken", "windows")
+
+OPENAPI_SPEC = {
+    "openapi": "3.0.2",
+    "info": {"title": "Mock Pet Store", "version": "1.0.0"},
+    "paths": {
+        "/pet/{petId}": {"get": {"summary": "Find pet by ID", "parameters": [
+            {"name": "petId", "in": "path", "required": True, "schema": {"type": "integer"}}],
+            "responses": {"200": {"description": "successful operation"}, "404": {"description": "Pet not found"}}}},
+        "/pet": {"post": {"summary": "Add a new pet to the store",
+                          "responses": {"200": {"description": "Successful operation"},
+                                        "405": {"description": "Invalid input"}}}},
+    },
+}
+
+
+def latency_distribution(spec: str) -> Callable[[random.Random], float]:
+    """Parse a latency spec such as `lognormal:0.4,0.5` into a sampler of seconds."""
+    name, _, args = spec.partition(':')
+    values = [float(value) for value in args.split(',')] if args else []
+    if name == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if name == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if name == 'lognormal' and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if name == 'exponential' and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec!r}")
+
+
+def _digest(*parts) -> bytes:
+    return hashlib.blake2b(json.dumps(parts, sort_keys=True, default=str).encode('utf-8'), digest_size=16).digest()
+
+
+def _words(digest: bytes, count: int) -> List[str]:
+    """`count` deterministic words for a request, as stream deltas (each but the first has a leading space)."""
+    rng = random.Random(digest)
+    words = []
+    for index in range(count):
+        word = rng.choice(WORDS)
+        if index == 0 or words[-1].endswith('.'):
+            word = word.capitalize()
+        if index == count - 1 or rng.random() < 0.08:
+            word += '.'
+        words.append(word if index == 0 else ' ' + word)
+    return words
+
+
+@functools.lru_cache(maxsize=256)
+def _png(digest: str, size: int = 256) -> bytes:
+    color = tuple(bytes.fromhex(digest)[:3])
+    buffer = io.BytesIO()
+    Image.new('RGB', (size, size), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class MockOpenAIServer:
+    """
+    A threaded HTTP server that answers like the OpenAI API. `start` serves in the background and returns
+    the base URL to give an OpenAI client; `stop` shuts it down. Safe to use from several client threads.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, ttft: str = 'lognormal:0.4,0.5',
+                 tokens_per_second: float = 60.0, max_tokens: int = 400,
+                 embedding_latency: str = 'lognormal:0.05,0.3', image_latency: str = 'lognormal:3,0.3',
+                 transcription_latency: str = 'lognormal:0.8,0.3', error_rate: float = 0.0,
+                 error_codes: Sequence[int] = (429, 500, 503), stall_rate: float = 0.0, stall_seconds: float = 15.0,
+                 disconnect_rate: float = 0.0, dimension: int = 1536, seed: int = 0):
+        self.ttft = latency_distribution(ttft)
+        self.tokens_per_second = tokens_per_second
+        self.max_tokens = max_tokens
+        self.embedding_latency = latency_distribution(embedding_latency)
+        self.image_latency = latency_distribution(image_latency)
+        self.transcription_latency = latency_distribution(transcription_latency)
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.disconnect_rate = disconnect_rate
+        self.embeddings = FakeEmbeddings(dimension, seed)
+        self.requests: Counter = Counter()  # (path, status) -> count
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.tokens_streamed = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True).start()
+        return self.base_url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def chance(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def sample(self, distribution: Callable[[random.Random], float]) -> float:
+        with self._lock:
+            return max(0.0, distribution(self._rng))
+
+    def fault(self) -> Optional[int]:
+        """The status code of an injected error for this request, or None."""
+        with self._lock:
+            if self.error_codes and self._rng.random() < self.error_rate:
+                return self._rng.choice(self.error_codes)
+        return None
+
+    def count(self, path: str, status: int) -> None:
+        with self._lock:
+            self.requests[(path, status)] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': {f"{path} {status}": count for (path, status), count in sorted(self.requests.items())},
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'tokens_streamed': self.tokens_streamed,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockOpenAI/1.0'
+
+    @property
+    def mock(self) -> MockOpenAIServer:
+        return self.server.mock
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, status: int, body, content_type: str = 'application/json', headers: Optional[Dict] = None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.mock.count(self.path.split('?')[0], status)
+
+    def _error(self, status: int) -> None:
+        messages = {429: "Rate limit reached (injected)", 500: "Internal server error (injected)",
+                    503: "Service unavailable (injected)"}
+        error = {'message': messages.get(status, f"Error {status} (injected)"),
+                 'type': 'rate_limit_exceeded' if status == 429 else 'server_error', 'code': None}
+        self._send(status, {'error': error}, headers={'Retry-After': '1'} if status == 429 else None)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/v1/models':
+            models = ['gpt-4-turbo-preview', 'gpt-3.5-turbo', 'text-embedding-3-small', 'dall-e-3', 'whisper-1']
+            self._send(200, {'object': 'list', 'data': [{'id': model, 'object': 'model', 'owned_by': 'mock'}
+                                                        for model in models]})
+        elif path.startswith('/files/images/') and path.endswith('.png'):
+            self._send(200, _png(path[len('/files/images/'):-len('.png')]), 'image/png')
+        elif path == '/openapi.json':
+            self._send(200, OPENAPI_SPEC)
+        elif path == '/stats':
+            self._send(200, self.mock.stats())
+        else:
+            self._send(404, {'error': {'message': f"Unknown path {path}", 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length)
+        path = self.path.split('?')[0]
+        handlers = {
+            '/v1/chat/completions': self._chat,
+            '/v1/embeddings': self._embeddings,
+            '/v1/images/generations': self._images,
+            '/v1/audio/transcriptions': self._transcription,
+        }
+        if path not in handlers:
+            self._send(404, {'error': {'message': f"Unknown path {path}", 'type': 'invalid_request_error'}})
+            return
+        with self.mock._lock:
+            self.mock.in_flight += 1
+            self.mock.max_in_flight = max(self.mock.max_in_flight, self.mock.in_flight)
+        try:
+            status = self.mock.fault()
+            if status is not None:
+                self._error(status)
+            else:
+                handlers[path](raw)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, e.g. a cancelled hedge
+            self.close_connection = True
+        finally:
+            with self.mock._lock:
+                self.mock.in_flight -= 1
+
+    def _chat(self, raw: bytes) -> None:
+        body = json.loads(raw)
+        messages = body.get('messages', [])
+        digest = _digest(body.get('model'), messages)
+        limit = min(body.get('max_tokens') or self.mock.max_tokens, self.mock.max_tokens)
+        words = _words(digest, max(1, min(limit, 20 + int.from_bytes(digest[:4], 'little') % self.mock.max_tokens)))
+        prompt = ' '.join(str(message.get('content', '')) for message in messages)
+        if 'code' in prompt.lower():
+            words = ['Here is an example:\n\n```python\n', 'def example():\n', '    return 42\n', '```\n\n'] + words
+        usage = {'prompt_tokens': len(prompt.split()) + 4 * len(messages), 'completion_tokens': len(words)}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+        first_token = self.mock.sample(self.mock.ttft)
+        if self.mock.chance() < self.mock.stall_rate:
+            first_token += self.mock.stall_seconds
+        completion_id = f"chatcmpl-{digest.hex()[:24]}"
+        if not body.get('stream'):
+            time.sleep(first_token + len(words) / self.mock.tokens_per_second)
+            self._send(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': ''.join(words)}}],
+                'usage': usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.mock.count('/v1/chat/completions', 200)
+
+        def event(choices: List[Dict], **extra) -> None:
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': body['model'], 'choices': choices, **extra}
+            data = f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        time.sleep(first_token)
+        started = time.monotonic()
+        disconnect_at = len(words) // 2 if self.mock.chance() < self.mock.disconnect_rate else None
+        event([{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}])
+        for index, word in enumerate(words):
+            if index == disconnect_at:
+                # Drop the connection mid-stream, as a failing upstream would
+                self.close_connection = True
+                return
+            delay = started + index / self.mock.tokens_per_second - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            event([{'index': 0, 'delta': {'content': word}, 'finish_reason': None}])
+        event([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if (body.get('stream_options') or {}).get('include_usage'):
+            event([], usage=usage)
+        data = b"data: [DONE]\n\n"
+        self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(data), data))
+        self.wfile.flush()
+        with self.mock._lock:
+            self.mock.tokens_streamed += len(words)
+
+    def _embeddings(self, raw: bytes) -> None:
+        body = json.loads(raw)
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        texts = [text if isinstance(text, str) else json.dumps(text) for text in inputs]
+        time.sleep(self.mock.sample(self.mock.embedding_latency))
+        data = []
+        for index, vector in enumerate(self.mock.embeddings(texts)):
+            if body.get('encoding_format') == 'base64':
+                embedding = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode('ascii')
+            else:
+                embedding = [float(value) for value in vector]
+            data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+        tokens = sum(len(text.split()) for text in texts)
+        self._send(200, {'object': 'list', 'data': data, 'model': body.get('model'),
+                         'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}})
+
+    def _images(self, raw: bytes) -> None:
+        body = json.loads(raw)
+        digest = _digest(body.get('model'), body.get('prompt'), body.get('size'), body.get('style')).hex()
+        time.sleep(self.mock.sample(self.mock.image_latency))
+        if body.get('response_format') == 'b64_json':
+            image = {'b64_json': base64.b64encode(_png(digest)).decode('ascii')}
+        else:
+            host, port = self.server.server_address[:2]
+            image = {'url': f"http://{host}:{port}/files/images/{digest}.png"}
+        self._send(200, {'created': int(time.time()), 'data': [{**image, 'revised_prompt': body.get('prompt')}]})
+
+    def _transcription(self, raw: bytes) -> None:
+        # The multipart body is not parsed: the same upload always gets the same transcript
+        time.sleep(self.mock.sample(self.mock.transcription_latency))
+        self._send(200, {'text': ''.join(_words(_digest(raw.hex()), 12))})
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    server = MockOpenAIServer(args.host, args.port, **server_options(args))
+    print(f"Mock OpenAI API at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """The mock's latency and fault options, shared with the load driver."""
+    parser.add_argument('--ttft', default='lognormal:0.4,0.5', help="time to first token distribution")
+    parser.add_argument('--tokens-per-second', type=float, default=60.0)
+    parser.add_argument('--max-tokens', type=int, default=400, help="longest chat completion")
+    parser.add_argument('--embedding-latency', default='lognormal:0.05,0.3')
+    parser.add_argument('--image-latency', default='lognormal:3,0.3')
+    parser.add_argument('--transcription-latency', default='lognormal:0.8,0.3')
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument('--error-codes', type=int, nargs='+', default=[429, 500, 503])
+    parser.add_argument('--stall-rate', type=float, default=0.0, help="share of completions that stall")
+    parser.add_argument('--stall-seconds', type=float, default=15.0)
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help="share of streams cut halfway")
+    parser.add_argument('--dimension', type=int, default=1536, help="embedding dimension")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def server_options(args: argparse.Namespace) -> Dict:
+    return {name: getattr(args, name) for name in (
+        'ttft', 'tokens_per_second', 'max_tokens', 'embedding_latency', 'image_latency', 'transcription_latency',
+        'error_rate', 'error_codes', 'stall_rate', 'stall_seconds', 'disconnect_rate', 'dimension', 'seed')}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Retrieval benchmark for PDFSemanticSearch's indexes, with no network access.
+
+Generates synthetic corpora with a deterministic fake embedding backend, writes them as embedding stores
+and measures, per corpus size and index strategy: store load time, index build time, index memory,
+process RSS, query latency percentiles, recall@k against the exact vector index and hit rate@k
+(the chunk a query was drawn from is in the top k). Results are printed as JSON.
+
+    python -m benchmarks.retrieval --sizes 1000 10000 100000 --output bench.json
+    python -m benchmarks.retrieval --sizes 1000000 --dimension 256
+    python -m benchmarks.retrieval --sizes 1000 --pdf data/ThePragmaticProgrammer.pdf
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.fake_embeddings import FakeEmbeddings
+from services.embedding_cache import EmbeddingCache
+from services.embedding_store import EmbeddingStore
+from services.lexical_index import BM25Index
+from services.vector_index import VectorIndex, recall_at_k
+
+VOCABULARY_SIZE = 4096
+TERMS_PER_TOPIC = 24
+TERMS_PER_CHUNK = 16
+TERMS_PER_QUERY = 5
+
+STRATEGIES: Dict[str, Dict] = {
+    'vector-float32': {'storage': 'float32'},
+    'vector-float16': {'storage': 'float16'},
+    'vector-int8': {'storage': 'int8'},
+    'vector-int8-d256': {'storage': 'int8', 'dimensions': 256},
+    'bm25': {},
+}
+
+
+def rss_mb() -> float:
+    """Current resident set size; falls back to the peak where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99]) if samples_ms else (0, 0, 0)
+    return {'p50_ms': round(float(p50), 4), 'p95_ms': round(float(p95), 4), 'p99_ms': round(float(p99), 4)}
+
+
+def synthetic_corpus(size: int, embeddings: FakeEmbeddings, seed: int = 0,
+                     block_rows: int = 8192) -> Tuple[List[Dict], np.ndarray, np.ndarray]:
+    """
+    Generate `size` chunks drawn from topics over a fixed vocabulary, with their fake embeddings.
+
+    Returns the chunk dictionaries, the float32 vectors and the term ids of every chunk. Vectors are built
+    from the vocabulary's term vectors directly, which matches embedding each chunk text but is much faster.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"k{i:05d}" for i in range(VOCABULARY_SIZE)]
+    term_vectors = embeddings.term_matrix(vocabulary)
+
+    topics = max(8, size // 200)
+    topic_terms = rng.integers(0, VOCABULARY_SIZE, size=(topics, TERMS_PER_TOPIC))
+    chunk_topics = rng.integers(0, topics, size=size)
+    # Three quarters of each chunk's terms come from its topic, the rest from the whole vocabulary
+    on_topic = TERMS_PER_CHUNK * 3 // 4
+    term_ids = np.concatenate([
+        topic_terms[chunk_topics[:, None], rng.integers(0, TERMS_PER_TOPIC, size=(size, on_topic))],
+        rng.integers(0, VOCABULARY_SIZE, size=(size, TERMS_PER_CHUNK - on_topic)),
+    ], axis=1)
+
+    vectors = np.empty((size, embeddings.dimension), dtype=np.float32)
+    for start in range(0, size, block_rows):
+        ids = term_ids[start:start + block_rows]
+        block = np.zeros((len(ids), embeddings.dimension), dtype=np.float32)
+        for column in range(ids.shape[1]):
+            block += term_vectors[ids[:, column]]
+        vectors[start:start + len(ids)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+
+    documents = [{
+        'document_name': f"synthetic-{i // 1000:04d}.pdf",
+        'page_number': i % 1000 // 4 + 1,
+        'context': ' '.join(vocabulary[t] for t in term_ids[i]),
+        'position': i % 1000,
+    } for i in range(size)]
+    return documents, vectors, term_ids
+
+
+def synthetic_queries(term_ids: np.ndarray, count: int, seed: int = 1) -> Tuple[List[str], np.ndarray]:
+    """Queries made of a few terms of a random source chunk; returns query texts and source rows."""
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, len(term_ids), size=count)
+    texts = [' '.join(f"k{t:05d}" for t in rng.choice(term_ids[row], TERMS_PER_QUERY, replace=False))
+             for row in sources]
+    return texts, sources
+
+
+def hit_rate(sources: np.ndarray, found: List[np.ndarray], k: int) -> float:
+    return float(np.mean([source in result[:k] for source, result in zip(sources, found)])) if len(sources) else 0.0
+
+
+def benchmark_size(size: int, embeddings: FakeEmbeddings, work_dir: str, queries: int, k: int) -> List[Dict]:
+    started = time.perf_counter()
+    documents, vectors, term_ids = synthetic_corpus(size, embeddings)
+    generate_s = time.perf_counter() - started
+
+    store_path = os.path.join(work_dir, f"synthetic-{size}.embeddings")
+    started = time.perf_counter()
+    EmbeddingStore.write(store_path, documents, vectors, embeddings.model)
+    write_s = time.perf_counter() - started
+    del documents, vectors
+
+    rss_before_open = rss_mb()
+    started = time.perf_counter()
+    store = EmbeddingStore.open(store_path)
+    open_ms = (time.perf_counter() - started) * 1000
+
+    query_texts, sources = synthetic_queries(term_ids, queries)
+    query_vectors = np.stack(embeddings(query_texts))
+    print(f"[{size}] generated in {generate_s:.2f}s, store written in {write_s:.2f}s, opened in {open_ms:.2f}ms",
+          file=sys.stderr)
+
+    shared = {
+        'size': size,
+        'dimension': embeddings.dimension,
+        'generate_s': round(generate_s, 3),
+        'store_write_s': round(write_s, 3),
+        'store_open_ms': round(open_ms, 3),
+        'store_mb': round(sum(os.path.getsize(os.path.join(store_path, name))
+                              for name in os.listdir(store_path)) / 2 ** 20, 2),
+    }
+
+    exact_results: Optional[List[np.ndarray]] = None
+    results = []
+    for name, options in STRATEGIES.items():
+        rss_before = rss_mb()
+        started = time.perf_counter()
+        if name == 'bm25':
+            index = BM25Index.build(store.text(i) for i in range(len(store)))
+            index_mb = sum(a.nbytes for a in (index.offsets, index.doc_ids, index.weights, index.idf)) / 2 ** 20
+            search = lambda i: index.search(query_texts[i], k)[0]
+        else:
+            index = VectorIndex(store.vectors, **options)
+            index_mb = index.nbytes / 2 ** 20
+            search = lambda i: index.search(query_vectors[i], k)[0]
+        build_s = time.perf_counter() - started
+
+        latencies = []
+        found = []
+        for i in range(len(query_texts)):
+            started = time.perf_counter()
+            found.append(search(i))
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        if name == 'vector-float32':
+            exact_results = found
+        results.append({
+            **shared,
+            'strategy': name,
+            'build_s': round(build_s, 3),
+            'index_mb': round(index_mb, 2),
+            'rss_mb': round(rss_mb(), 1),
+            'rss_delta_mb': round(rss_mb() - rss_before, 1),
+            'rss_since_open_mb': round(rss_mb() - rss_before_open, 1),
+            **percentiles(latencies),
+            f'recall@{k}': None if name == 'bm25' or exact_results is None
+            else round(recall_at_k(exact_results, found, k), 4),
+            f'hit_rate@{k}': round(hit_rate(sources, found, k), 4),
+        })
+        print(f"[{size}] {name}: built in {build_s:.2f}s, p50 {results[-1]['p50_ms']}ms", file=sys.stderr)
+        del index, search
+    return results
+
+
+def benchmark_pdf(pdf_path: str, embeddings: FakeEmbeddings, work_dir: str, queries: int, k: int) -> List[Dict]:
+    """End-to-end ingestion and find_relevant_chunks latency on a real PDF, with fake embeddings."""
+    from services.embedding import PDFSemanticSearch
+
+    searcher = PDFSemanticSearch(embedding_cache=EmbeddingCache(os.path.join(work_dir, 'cache.sqlite')),
+                                 embedding_function=embeddings)
+    searcher.embedding_model = embeddings.model
+    store_path = os.path.join(work_dir, 'pdf.embeddings')
+
+    started = time.perf_counter()
+    store = searcher.process_embeddings(pdf_path, store_path)
+    ingest_s = time.perf_counter() - started
+
+    rng = np.random.default_rng(2)
+    query_texts = []
+    for row in rng.integers(0, len(store), size=queries):
+        words = store.text(int(row)).split()
+        start = int(rng.integers(0, max(1, len(words) - 8)))
+        query_texts.append(' '.join(words[start:start + 8]))
+
+    results = []
+    for mode in ('vector', 'lexical', 'hybrid'):
+        latencies = []
+        for text in query_texts:
+            started = time.perf_counter()
+            searcher.find_relevant_chunks(text, store, top_k=k, mode=mode)
+            latencies.append((time.perf_counter() - started) * 1000)
+        results.append({
+            'pdf': os.path.basename(pdf_path),
+            'chunks': len(store),
+            'ingest_s': round(ingest_s, 3),
+            'strategy': f"find_relevant_chunks-{mode}",
+            **percentiles(latencies),
+        })
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--dimension', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--pdf', help="also benchmark ingestion and search of this PDF end to end")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    embeddings = FakeEmbeddings(args.dimension)
+    work_dir = tempfile.mkdtemp(prefix='ducky-bench-')
+    try:
+        results = []
+        for size in args.sizes:
+            results.extend(benchmark_size(size, embeddings, work_dir, args.queries, args.k))
+        if args.pdf:
+            results.extend(benchmark_pdf(args.pdf, embeddings, work_dir, args.queries, args.k))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'retrieval',
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'queries': args.queries,
+        'k': args.k,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
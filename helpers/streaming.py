@@ -0,0 +1,73 @@
+import time
+from typing import Dict, List, Optional
+
+from streamlit.delta_generator import DeltaGenerator
+
+CURSOR = "▌"
+
+
+class StreamRenderer:
+    """
+    Renders a streamed response into a placeholder without redrawing it on every delta.
+
+    Deltas are collected in an append buffer and the placeholder is redrawn at most every `interval`
+    seconds, or sooner once `flush_deltas` deltas are waiting. Streamlit replaces the whole element on
+    each redraw, so a redraw costs the full text so far; the interval grows with the text to keep a
+    stream under `max_bytes_per_second`, which keeps long answers from going quadratic.
+    """
+
+    def __init__(self, placeholder: Optional[DeltaGenerator], interval: float = 0.05, flush_deltas: int = 32,
+                 max_bytes_per_second: int = 256 * 1024, render: str = "code"):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.flush_deltas = flush_deltas
+        self.max_bytes_per_second = max_bytes_per_second
+        self.render = render
+        self._text = ""
+        self._pending: List[str] = []
+        self._started = time.monotonic()
+        self._last_flush = self._started
+        self.deltas = 0
+        self.flushes = 0
+        self.bytes_sent = 0
+
+    @property
+    def text(self) -> str:
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending.clear()
+        return self._text
+
+    def _draw(self, text: str) -> None:
+        if self.placeholder is None:
+            return
+        getattr(self.placeholder, self.render)(text)
+        self.flushes += 1
+        self.bytes_sent += len(text.encode('utf-8'))
+        self._last_flush = time.monotonic()
+
+    def write(self, delta: str) -> None:
+        """Add a delta, redrawing if the cadence calls for it."""
+        self._pending.append(delta)
+        self.deltas += 1
+        elapsed = time.monotonic() - self._last_flush
+        throttle = len(self._text) / self.max_bytes_per_second
+        if elapsed >= max(self.interval, throttle) or (len(self._pending) >= self.flush_deltas and elapsed >= throttle):
+            self._draw(self.text + CURSOR)
+
+    def finish(self, text: Optional[str] = None) -> str:
+        """Draw the final text (or a replacement, e.g. an error message) without the cursor."""
+        if text is not None:
+            self._pending.clear()
+            self._text = text
+        self._draw(self.text)
+        return self._text
+
+    def stats(self) -> Dict:
+        return {
+            'deltas': self.deltas,
+            'chars': len(self.text),
+            'flushes': self.flushes,
+            'bytes_sent': self.bytes_sent,
+            'seconds': round(time.monotonic() - self._started, 3),
+        }
@@ -1,46 +1,171 @@
-from typing import List, Dict, Union, Tuple
+import asyncio
+import os
+from typing import List, Dict, Union, Tuple, Optional, Callable
 
 import streamlit as st
 from streamlit.delta_generator import DeltaGenerator
 
 import services.llm
+from helpers.streaming import StreamRenderer
+from services.conversation import ConversationMemory, count_message_tokens
+from services.code_context import CodeContext
+from services.semantic_cache import SemanticResponseCache, get_semantic_cache, replay_stream
+from services.prefetch import VariantPrefetcher, get_variant_prefetcher
+from services.scheduler import BACKGROUND
 
 
-async def run_conversation(messages: List[Dict[str, str]], message_placeholder: Union[DeltaGenerator, None] = None) \
-        -> Tuple[List[Dict[str, str]], str]:
-    full_response = ""
+# Prompt tokens of conversation history sent per turn; older turns are summarized
+HISTORY_TOKENS = int(os.getenv('DUCKY_HISTORY_TOKENS', '3000'))
+
+# Shown in place of an answer when the LLM service fails
+ADVICE_ERROR = ":red[We are having trouble generating advice.  Please wait a minute and try again.]"
+
+
+def conversation_memory() -> ConversationMemory:
+    """This session's conversation window and running summary."""
+    if "conversation_memory" not in st.session_state:
+        st.session_state.conversation_memory = ConversationMemory(
+            services.llm.summarize_conversation, HISTORY_TOKENS, os.getenv('OPENAI_API_MODEL') or "gpt-3.5-turbo")
+    return st.session_state.conversation_memory
+
+
+def code_context() -> CodeContext:
+    """This session's record of the code version the model has already seen."""
+    if "code_context" not in st.session_state:
+        st.session_state.code_context = CodeContext()
+    return st.session_state.code_context
+
+
+def add_code_prompt(messages: List[Dict[str, str]], code: str, prompt: Callable[[str], str]) -> None:
+    """Append the system prompt for a code action, showing the code as a diff if the model has seen a version."""
+    memory = conversation_memory()
+    context = code_context()
+    section = context.section(code, messages, lambda index: memory.sends(messages, index))
+    messages.append({"role": "system", "content": prompt(section)})
+    context.seen(code, messages, len(messages) - 1)
+
+
+def semantic_cache() -> SemanticResponseCache:
+    """The shared cache of answers to self-contained questions, embedded with the library's embedding client."""
+    service = get_retrieval_service(LIBRARY_DIR, LIBRARY_STORE_PATH)
+    return get_semantic_cache(lambda text: service.searcher.get_embedding(text, timeout=2.0))
+
+
+# Learning Topics variants prepared per answer when speculative mode is on, and their token budget
+PREFETCH_VARIANTS = int(os.getenv('DUCKY_PREFETCH_VARIANTS', '3'))
+PREFETCH_TOKENS_PER_HOUR = int(os.getenv('DUCKY_PREFETCH_TOKENS_PER_HOUR', '50000'))
+
 
-    chunks = services.llm.converse(messages)
+def learning_messages(learner_level: str, response_format: str, topic: str) -> List[Dict[str, str]]:
+    messages = services.llm.create_conversation_starter(prompts.system_learning_prompt())
+    messages.append({"role": "user", "content": prompts.learning_prompt(learner_level, response_format, topic)})
+    return messages
+
+
+def learning_tokens(messages: List[Dict[str, str]], response: str) -> int:
+    """Approximate tokens of a learning request and its answer."""
+    return count_message_tokens(messages + [{"role": "assistant", "content": response}],
+                                services.llm.openai_model or "gpt-3.5-turbo")
+
+
+async def _generate_learning_variant(learner_level: str, response_format: str, topic: str) -> Tuple[str, int]:
+    messages = learning_messages(learner_level, response_format, topic)
+    chunks = []
+    hints = {"page": "learning_topics", "level": learner_level, "format": response_format}
+    async for chunk in services.llm.converse(messages, priority=BACKGROUND, hints=hints):
+        if chunk.startswith(("EXCEPTION", "oaiEXCEPTION")):
+            raise RuntimeError(chunk)
+        chunks.append(chunk)
+    response = "".join(chunks)
+    return response, learning_tokens(messages, response)
+
+
+def learning_prefetcher(levels: List[str], formats: List[str]) -> VariantPrefetcher:
+    """The shared prefetcher of Learning Topics answers at neighbouring levels and formats."""
+    return get_variant_prefetcher(levels, formats, _generate_learning_variant,
+                                  variants=PREFETCH_VARIANTS, tokens_per_hour=PREFETCH_TOKENS_PER_HOUR)
+
+
+async def run_conversation(messages: List[Dict[str, str]], message_placeholder: Union[DeltaGenerator, None] = None,
+                           request_messages: Optional[List[Dict[str, str]]] = None,
+                           memory: Optional[ConversationMemory] = None,
+                           cache_fields: Optional[Dict[str, str]] = None,
+                           hints: Optional[Dict[str, str]] = None) \
+        -> Tuple[List[Dict[str, str]], str]:
+    """
+    Stream a response to `messages`, or to `request_messages` if the model should see something else.
+    With a `memory`, only the recent part of the conversation is sent, after a summary of the rest.
+    With `cache_fields` (exact-match fields plus the free-text `question`), a stored answer to a
+    similar question is replayed instead of calling the model, and new answers are stored.
+    `hints` (page, level, format; taken from `cache_fields` if not given) help pick the model.
+    """
+    renderer = StreamRenderer(message_placeholder)
+
+    request_messages = request_messages or messages
+    if memory is not None:
+        request_messages = memory.request_messages(request_messages)
+
+    if hints is None and cache_fields is not None:
+        hints = {key: cache_fields[key] for key in ('page', 'level', 'format') if key in cache_fields}
+
+    # Routed once, so the cache lookup and the request agree on the model
+    candidates = services.llm.route(request_messages, hints)
+    cached = None
+    if cache_fields is not None:
+        fields = {key: value for key, value in cache_fields.items() if key != 'question'}
+        # Answers are stored under the model that gave them, and looked up under the one this request goes to
+        fields['model'] = candidates[0]['model']
+        # Embedding the question blocks, so it runs off the event loop
+        cached = await asyncio.to_thread(semantic_cache().lookup, fields, cache_fields['question'])
+    answered = {}
+    if cached is not None:
+        print(f"Semantic cache hit ({cached['similarity']:.3f}): {cached['question']!r}")
+        chunks = replay_stream(cached['response'])
+    else:
+        chunks = services.llm.converse(request_messages, hints=hints, answered=answered, candidates=candidates)
     chunk = await anext(chunks, "END OF CHAT")
+    error = None
     while chunk != "END OF CHAT":
-        print(f"Received chunk from LLM service: {chunk}")
-        if chunk.startswith("EXCEPTION"):
-            full_response = ":red[We are having trouble generating advice.  Please wait a minute and try again.]"
+        if chunk.startswith(("EXCEPTION", "oaiEXCEPTION")):
+            print(f"Received error from LLM service: {chunk}")
+            error = ADVICE_ERROR
             break
-        full_response = full_response + chunk
-
-        if message_placeholder is not None:
-            message_placeholder.code(full_response + "▌")
+        renderer.write(chunk)
 
         chunk = await anext(chunks, "END OF CHAT")
 
-    if message_placeholder is not None:
-        message_placeholder.code(full_response)
+    full_response = renderer.finish(error)
+    print(f"Streamed response: {renderer.stats()}")
+    # An answer cut short by an error is never stored, or similar questions would replay it
+    if cache_fields is not None and cached is None and error is None and full_response and answered.get('model'):
+        await asyncio.to_thread(semantic_cache().store, {**fields, 'model': answered['model']},
+                                cache_fields['question'], full_response)
 
     messages.append({"role": "assistant", "content": full_response})
+    if memory is not None:
+        memory.update(messages)
     return messages, full_response
 
 
 # Chat with the LLM, and update the messages list with the response.
 # Handles the chat UI and partial responses along the way.
-async def chat(messages, prompt):
+async def chat(messages, prompt, request_messages=None):
     with st.chat_message("user"):
         st.markdown(prompt)
 
+    # Only an opening question stands on its own; later answers depend on the conversation so far
+    cache_fields = None
+    conversation = [m for m in messages if m["role"] != "system"]
+    if request_messages is None and len(conversation) == 1:
+        cache_fields = {"page": "quick_chat",
+                        "system": "\n".join(m["content"] for m in messages if m["role"] == "system"),
+                        "question": prompt}
+
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
 
-        messages, response = await run_conversation(messages, message_placeholder)
+        messages, response = await run_conversation(messages, message_placeholder, request_messages,
+                                                    conversation_memory(), cache_fields, {"page": "quick_chat"})
         st.session_state.messages = messages
     return messages
 
@@ -48,7 +173,8 @@ async def chat(messages, prompt):
 async def generate_code(messages):
     # Generate the assistant's response
     message_placeholder = st.empty()
-    messages, response = await run_conversation(messages, message_placeholder)
+    messages, response = await run_conversation(messages, message_placeholder, memory=conversation_memory(),
+                                                hints={"page": "generate_code"})
     st.session_state.messages = messages
     # Split the response into code and explanation
     import re
@@ -59,6 +185,8 @@ async def generate_code(messages):
         explanation = re.sub(r'```.*?```', '', response, flags=re.DOTALL).strip()
         # Store the code_content in session_state so it can be used in the main code
         st.session_state["code"] = code_content
+        # The model wrote this version, so the next action only needs to send the user's edits to it
+        code_context().seen(code_content, messages, len(messages) - 1)
         # Increment key counter and rerun to update st_ace editor
         st.session_state.ace_key_counter += 1
         st.session_state.code_updated = True
@@ -73,7 +201,8 @@ async def generate_code(messages):
 async def review_code(messages):
     # Generate the assistant's response
     message_placeholder = st.empty()
-    messages, response = await run_conversation(messages, message_placeholder)
+    messages, response = await run_conversation(messages, message_placeholder, memory=conversation_memory(),
+                                                hints={"page": "generate_code"})
     st.session_state.messages = messages
 
     # Display the messages as markdown
@@ -85,84 +214,112 @@ import PyPDF2
 import base64
 import io
 
-from services.embedding import PDFSemanticSearch
+from services.retrieval import RetrievalService, get_retrieval_service
+from services.page_images import PageImageCache, get_page_image_cache
+from services.rag_context import ContextAssembler
+from services import prompts
 
-async def ask_book(messages: List[Dict], prompt: str):
-    """Chat with RAG using The Pragmatic Programmer book"""
-    # Initialize the semantic search system
-    searcher = PDFSemanticSearch()
+# Every PDF in this directory is part of the searchable library
+LIBRARY_DIR = "data"
+LIBRARY_STORE_PATH = "data/library.embeddings"
 
-    # Define paths
-    pdf_path = "data/ThePragmaticProgrammer.pdf"
-    embedding_csv_path = "data/ThePragmaticProgrammer.embeddings.csv"
 
-    # Process or load embeddings
-    df = searcher.process_embeddings(pdf_path, embedding_csv_path)
+def library_documents() -> List[str]:
+    """Names of the PDFs in the library, for per-document filtering."""
+    return sorted(name for name in os.listdir(LIBRARY_DIR) if name.endswith('.pdf'))
 
-    relevant_chunks = searcher.find_relevant_chunks(prompt, df)
 
-    if not relevant_chunks:
-        await chat(messages, prompt)
-        return messages
-    
-    # Construct RAG prompt
-    context = "\n\n".join([
-        f"From page {chunk['page_number']}:\n{chunk['context']}" 
-        for chunk in relevant_chunks
-    ])
-    
-    rag_prompt = f"""Based on the following excerpts from The Pragmatic Programmer, answer the user's question:
+def retrieval_service() -> RetrievalService:
+    """
+    The library's shared retrieval service, for sessions that use the library: starts warming it in the
+    background and queues the library pages for rendering on first use.
+    """
+    service = get_retrieval_service(LIBRARY_DIR, LIBRARY_STORE_PATH)
+    service.warm_in_background()
+    page_image_cache()
+    return service
+
+
+@st.cache_resource(show_spinner=False)
+def warm_library() -> RetrievalService:
+    """Start loading the library and its indexes, once per server process, ahead of the first library question."""
+    service = get_retrieval_service(LIBRARY_DIR, LIBRARY_STORE_PATH)
+    service.warm_in_background()
+    return service
+
+
+_library_prerendered = False
+
+
+def page_image_cache() -> PageImageCache:
+    """The shared page image cache; queues every library page for background rendering on first use."""
+    global _library_prerendered
+    cache = get_page_image_cache()
+    if not _library_prerendered:
+        _library_prerendered = True
+        for name in library_documents():
+            cache.prerender(os.path.join(LIBRARY_DIR, name))
+    return cache
 
-    Context from the book:
-    {context}
 
-    User's question: {prompt}
+# Retrieved text sent with a library question; override with DUCKY_RAG_CONTEXT_TOKENS
+RAG_CONTEXT_TOKENS = int(os.getenv('DUCKY_RAG_CONTEXT_TOKENS', '3000'))
+# Chunks retrieved per question beyond those that fit in the budget: they stand in for near-duplicates,
+# merged neighbours and a partly fitting last passage
+RAG_SPARE_CANDIDATES = 2
 
-    Please provide a comprehensive answer that incorporates insights from the book. If the context doesn't fully address the question, you may add general software development knowledge to provide a complete response."""
 
+def rag_candidates(chunk_tokens: int) -> int:
+    """Chunks to retrieve per question, from which the context is assembled; override with DUCKY_RAG_CANDIDATES."""
+    configured = int(os.getenv('DUCKY_RAG_CANDIDATES', '0'))
+    return configured or max(1, RAG_CONTEXT_TOKENS // chunk_tokens) + RAG_SPARE_CANDIDATES
 
-    await chat(messages, prompt)
-    st.session_state.page_number = relevant_chunks[0]['page_number']
+
+async def ask_book(messages: List[Dict], prompt: str, documents: Optional[List[str]] = None):
+    """Chat with RAG using the PDF library, optionally restricted to some documents"""
+    # The library is ingested and indexed once per server process, not per question
+    service = retrieval_service()
+    relevant_chunks = service.search(prompt, top_k=rag_candidates(service.searcher.chunk_size), documents=documents)
+
+    if not relevant_chunks:
+        await chat(messages, prompt)
+        return messages
+
+    # Render the cited pages while the answer streams, so showing them is a cache read
+    cited = relevant_chunks[0]
+    page_image_cache().prerender(os.path.join(LIBRARY_DIR, cited['document_name']),
+                                 range(cited['page_number'], cited['page_end'] + 1), urgent=True)
+
+    # Merge overlapping neighbours, drop near-duplicates and stop at the token budget
+    assembled = ContextAssembler(RAG_CONTEXT_TOKENS).assemble(relevant_chunks)
+    print(f"RAG context: {assembled['tokens']} tokens in {len(assembled['passages'])} passages "
+          f"({assembled['merged']} merged, {assembled['duplicates']} duplicates, {assembled['skipped']} skipped)")
+
+    # The model sees the excerpts; the conversation history keeps the plain question
+    request_messages = messages[:-1] + [{"role": "user", "content": prompts.rag_prompt(assembled['context'], prompt)}]
+    await chat(messages, prompt, request_messages)
+    st.session_state.page_document = cited['document_name']
+    st.session_state.page_number = cited['page_number']
     return messages
 
-import streamlit as st
-from pdf2image import convert_from_path
-from PIL import Image
-import os
-import tempfile
 
-def convert_pdf_to_image(pdf_path: str, page_number: int) -> Image.Image:
+def convert_pdf_to_image(pdf_path: str, page_number: int) -> bytes:
     """
     將 PDF 檔案的特定頁面轉換為圖片
-    
+
     Parameters:
         pdf_path (str): PDF 檔案的路徑
         page_number (int): 要轉換的頁數 (從 1 開始)
-        
+
     Returns:
-        Image.Image: 轉換後的圖片物件
+        bytes: WebP 圖片, 可以直接交給 st.image; 頁面已預先轉換時只需讀取快取
     """
     try:
         # 檢查輸入參數
         if not os.path.exists(pdf_path):
             raise FileNotFoundError("Cannot find PDF")
-            
-        # 使用 tempfile 來處理 Windows 中的問題
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # 將 PDF 轉換為圖片
-            # first_page 和 last_page 設定為相同數字來只轉換特定頁面
-            images = convert_from_path(
-                pdf_path,
-                first_page=page_number,
-                last_page=page_number,
-                poppler_path=None,  # 如果在 Windows 上需要設定 poppler 路徑
-                output_folder=temp_dir
-            )
-            
-            if not images:
-                raise ValueError(f"Cannot convert page {page_number}")
-                
-            return images[0]  # 返回轉換後的圖片
-            
+
+        return page_image_cache().get(pdf_path, page_number)
+
     except Exception as e:
-        raise Exception(f"Convert error: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Convert error: {str(e)}")
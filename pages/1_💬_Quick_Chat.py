@@ -11,6 +11,7 @@ st.set_page_config(
 
 import helpers.sidebar
 import asyncio
+import os
 
 helpers.sidebar.show()
 
@@ -27,11 +28,19 @@ if "messages" not in st.session_state:
 # Ensure the session state is initialized
 if "page_number" not in st.session_state:
     st.session_state.page_number = None
+    st.session_state.page_document = None
 
 
 
 # Create a checkbox
-ask_book = st.checkbox("Use *The Pragmatic Programmer* as context", value=False)
+ask_book = st.checkbox("Use the PDF library (*The Pragmatic Programmer* and any other PDF in `data/`) as context", value=False)
+book_documents = None
+if ask_book:
+    book_documents = st.multiselect("Only search these documents (leave empty for all):", util.library_documents())
+    health = util.retrieval_service().health()
+    if not health['ready']:
+        st.caption("The PDF library is still loading; the first question will wait for it."
+                   if health['last_error'] is None else f"The PDF library failed to load: {health['last_error']}")
 
 # Print all messages in the session state
 for message in [m for m in st.session_state.messages if m["role"] != "system"]:
@@ -42,12 +51,14 @@ for message in [m for m in st.session_state.messages if m["role"] != "system"]:
 if prompt := st.chat_input("Ask a software development or coding question..."):
     st.session_state.messages.append({"role": "user", "content": prompt})
     if ask_book:
-        asyncio.run(util.ask_book(st.session_state.messages, prompt))
+        asyncio.run(util.ask_book(st.session_state.messages, prompt, book_documents or None))
         if st.session_state.page_number:
-            image = util.convert_pdf_to_image("data/ThePragmaticProgrammer.pdf", st.session_state.page_number)
+            pdf_path = os.path.join(util.LIBRARY_DIR, st.session_state.page_document)
+            image = util.convert_pdf_to_image(pdf_path, st.session_state.page_number)
             if image:
                 # 創建一個可收合的區塊
-                with st.expander(f"Page - {st.session_state.page_number}", expanded=True):  # expanded=True 表示預設展開
+                with st.expander(f"{st.session_state.page_document} - Page {st.session_state.page_number}",
+                                 expanded=True):  # expanded=True 表示預設展開
                     # 在可收合區塊中顯示圖片
                     st.image(image, use_column_width=True)
     else:
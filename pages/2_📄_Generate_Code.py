@@ -102,6 +102,7 @@ with button_columns[4]:
             "content": prompts.general_ducky_code_starter_prompt()
         }]
         st.session_state.messages = initial_messages
+        st.session_state.pop("code_context", None)  # The model has seen no code in the new conversation
         st.rerun()  # Rerun to update the UI immediately
 
 # Display the code editor and the explanation
@@ -129,13 +130,12 @@ st.markdown(st.session_state.explanation)
 if st.session_state.show_input == "modify":
     # Use a form to better manage user input and resetting
     with st.form(key='input_form', clear_on_submit=True):
-        modify_system_prompt = prompts.modify_code_prompt(code)
-        st.session_state.messages.append({"role": "system", "content": modify_system_prompt})
         user_input_form = st.text_input("📝 How should I modify your code?", key='user_input')
         submit_form = st.form_submit_button(label='Submit')
 
         if submit_form and user_input_form.strip():
-            # Process the input as above
+            # Add the code only on submit, and only what changed since the model last saw it
+            util.add_code_prompt(st.session_state.messages, code, prompts.modify_code_prompt)
             st.session_state.messages.append({"role": "user", "content": user_input_form})
             with st.spinner("I'm thinking..."):
                 asyncio.run(util.generate_code(st.session_state.messages))
@@ -144,21 +144,19 @@ if st.session_state.show_input == "modify":
 if st.session_state.show_input == "debug":
     # Use a form to better manage user input and resetting
     with st.form(key='input_form', clear_on_submit=True):
-        debug_system_prompt = prompts.modify_code_prompt(code)
-        st.session_state.messages.append({"role": "system", "content": debug_system_prompt})
         user_input_form = st.text_input("🔥 Paste your error text here if any...", key='user_input')
         submit_form = st.form_submit_button(label='Submit')
 
         if submit_form and user_input_form.strip():
-            # Process the input as above
+            # Add the code only on submit, and only what changed since the model last saw it
+            util.add_code_prompt(st.session_state.messages, code, prompts.debug_prompt)
             st.session_state.messages.append({"role": "user", "content": user_input_form})
             with st.spinner("I'm thinking..."):
                 asyncio.run(util.generate_code(st.session_state.messages))
             st.rerun()
 
 if st.session_state.show_input == "review":
-    review_system_prompt = prompts.review_prompt(code)
-    st.session_state.messages.append({"role": "system", "content": review_system_prompt})
+    util.add_code_prompt(st.session_state.messages, code, prompts.review_prompt)
     with st.spinner("I'm thinking..."):
         asyncio.run(util.review_code(st.session_state.messages))
     st.session_state.show_input = None
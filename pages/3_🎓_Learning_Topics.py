@@ -2,6 +2,7 @@ import asyncio
 
 import streamlit as st
 import helpers.sidebar
+import helpers.streaming
 import helpers.util
 import services.prompts
 import services.llm
@@ -16,12 +17,17 @@ st.header("Learning Topics")
 
 helpers.sidebar.show()
 
+LEARNER_LEVELS = ["5 year old", "high school student", "college student", "adult", "retiree"]
+RESPONSE_FORMATS = ["set of bullet point notes", "article", "online course syllabus"]
+
 # Add a sidebar option to select a learner level
-learner_level = st.sidebar.selectbox("I'd like my answer as if I were a:",
-                                     ["5 year old", "high school student", "college student", "adult", "retiree"])
+learner_level = st.sidebar.selectbox("I'd like my answer as if I were a:", LEARNER_LEVELS)
+
+response_format = st.sidebar.selectbox("I'd like my answer as a:", RESPONSE_FORMATS)
 
-response_format = st.sidebar.selectbox("I'd like my answer as a:",
-                                       ["set of bullet point notes", "article", "online course syllabus"])
+# Speculative mode: after an answer, prepare the likely next levels and formats in the background
+prefetch = st.sidebar.toggle("Prepare other versions in advance", value=False)
+prefetcher = helpers.util.learning_prefetcher(LEARNER_LEVELS, RESPONSE_FORMATS)
 
 answer_button_sb = st.sidebar.button("Get Answer&nbsp;&nbsp;➠", type="primary", key="answer_button_sb")
 
@@ -32,8 +38,30 @@ answer_button = st.button("Get Answer&nbsp;&nbsp;➠", type="primary")
 
 if answer_button or answer_button_sb:
     advice = st.markdown("### Ducky...")
-    learning_prompt = services.prompts.learning_prompt(learner_level, response_format, topic)
-    messages = services.llm.create_conversation_starter(services.prompts.system_learning_prompt())
-    messages.append({"role": "user", "content": learning_prompt})
-    asyncio.run(helpers.util.run_conversation(messages, advice))
+    messages = helpers.util.learning_messages(learner_level, response_format, topic)
+    response = None
+    prefetched = prefetcher.get(topic, learner_level, response_format, st.session_state.get("learning_last")) \
+        if prefetch else None
+    if prefetched is not None:
+        try:
+            # Either ready, or still being generated in the background
+            response, tokens = prefetched.result(timeout=120)
+            helpers.streaming.StreamRenderer(advice).finish(response)
+            print(f"Served prefetched variant: {prefetcher.stats()}")
+        except Exception as e:
+            print(f"Prefetched variant unavailable: {type(e).__name__}")
+    if response is None:
+        # Answers are reused for similar topics asked at the same level and format
+        cache_fields = {"page": "learning_topics", "system": services.prompts.system_learning_prompt(),
+                        "level": learner_level, "format": response_format, "question": topic}
+        messages, response = asyncio.run(helpers.util.run_conversation(messages, advice, cache_fields=cache_fields))
+        tokens = helpers.util.learning_tokens(messages[:-1], response)
+    st.session_state.learning_last = (topic, learner_level, response_format)
+    if prefetch and response and response != helpers.util.ADVICE_ERROR:
+        prefetcher.prefetch(topic, learner_level, response_format, response, tokens)
+
+if prefetch:
+    stats = prefetcher.stats()
+    st.sidebar.caption(f"Prepared versions: {stats['hit_rate']:.0%} hit rate, "
+                       f"{stats['wasted_tokens']} tokens unused, {stats['running']} in progress")
 
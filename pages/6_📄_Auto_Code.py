@@ -31,6 +31,7 @@ if st.session_state.get("blueprint", None) is None:
 async def run_blueprint(seed: int = 42) -> str:
     await sleep(3)
     llm_config["seed"] = seed
+    # Each of the agents' LLM calls waits for a slot in the scheduler's blueprint class
     await st.session_state.blueprint.initiate_work(message=task)
     return st.session_state.blueprint.summary_result
 
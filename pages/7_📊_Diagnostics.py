@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+import helpers.sidebar
+from services.clients import get_registry
+from services.embedding_cache import get_embedding_cache
+from services.hedging import get_hedger
+from services.llm_cache import get_llm_cache
+from services.page_images import get_page_image_cache
+from services.routing import get_model_router
+from services.scheduler import get_scheduler
+from services.telemetry import PERCENTILES, get_telemetry
+
+st.set_page_config(
+    page_title="Diagnostics",
+    page_icon="📊",
+    layout="wide"
+)
+
+helpers.sidebar.show()
+
+st.header("Diagnostics")
+
+METRIC_LABELS = {
+    "ttft": "Time to first token (s)",
+    "duration": "Duration (s)",
+    "tokens_per_second": "Tokens per second",
+    "queue_wait": "Scheduler wait (s)",
+}
+
+telemetry = get_telemetry()
+samples = pd.DataFrame(telemetry.recent())
+
+tab_requests, tab_services = st.tabs(["Requests", "Services"])
+
+with tab_requests:
+    if samples.empty:
+        st.info("No requests recorded yet. Use the other pages and come back here.")
+    else:
+        col_kind, col_group, col_metric = st.columns(3)
+        with col_kind:
+            kind = st.selectbox("Requests", sorted(samples['kind'].unique()))
+        with col_group:
+            group = st.selectbox("Group by", ["page", "model", "endpoint"])
+        with col_metric:
+            metric = st.selectbox("Metric", list(METRIC_LABELS), format_func=METRIC_LABELS.get)
+
+        selected = samples[samples['kind'] == kind]
+        rows = pd.DataFrame(telemetry.summary((group,), kind=kind))
+
+        col_count, col_errors, col_p50, col_p95 = st.columns(4)
+        values = selected[metric].dropna() if metric in selected else pd.Series(dtype=float)
+        col_count.metric("Requests", len(selected))
+        col_errors.metric("Error rate", f"{(~selected['ok'].astype(bool)).mean():.1%}")
+        col_p50.metric(f"{METRIC_LABELS[metric]} p50", f"{values.quantile(0.5):.2f}" if len(values) else "–")
+        col_p95.metric(f"{METRIC_LABELS[metric]} p95", f"{values.quantile(0.95):.2f}" if len(values) else "–")
+
+        columns = [f"{metric}_p{q}" for q in PERCENTILES]
+        percentiles = rows.set_index(group)[columns].dropna(how='all')
+        if percentiles.empty:
+            st.caption(f"No {METRIC_LABELS[metric].lower()} recorded for these requests.")
+        else:
+            st.subheader(f"{METRIC_LABELS[metric]} by {group}")
+            st.bar_chart(percentiles.rename(columns=lambda column: column.rsplit('_', 1)[1]), stack=False)
+
+            col_time, col_histogram = st.columns(2)
+            with col_time:
+                st.caption("Over time")
+                timeline = selected.dropna(subset=[metric]).assign(time=lambda df: pd.to_datetime(df['time'], unit='s'))
+                st.scatter_chart(timeline, x='time', y=metric, color=group)
+            with col_histogram:
+                st.caption("Distribution")
+                counts, edges = np.histogram(values, bins=20)
+                st.bar_chart(pd.DataFrame({'requests': counts}, index=[f"{edge:.2f}" for edge in edges[:-1]]))
+
+        st.subheader("Summary")
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+        st.caption(f"The last {len(samples)} requests; samples are also written to {telemetry.stats()['file']}.")
+
+with tab_services:
+    col_left, col_right = st.columns(2)
+    with col_left:
+        st.subheader("Scheduler")
+        st.dataframe(pd.DataFrame(get_scheduler().stats()['classes']).T, use_container_width=True)
+        st.subheader("Model routing")
+        router = get_model_router().stats()
+        st.write(f"Routed: {router['routed']}")
+        st.dataframe(pd.DataFrame(router['models']), hide_index=True, use_container_width=True)
+        st.subheader("Hedging")
+        hedger = get_hedger().stats()
+        st.write(f"Hedge rate: {hedger['hedge_rate']:.1%}")
+        st.dataframe(pd.DataFrame(hedger['endpoints']).T, use_container_width=True)
+    with col_right:
+        st.subheader("Connections")
+        st.dataframe(pd.DataFrame(get_registry().stats()), hide_index=True, use_container_width=True)
+        st.subheader("Caches")
+        st.dataframe(pd.DataFrame({
+            "LLM responses": get_llm_cache().stats(),
+            "Query embeddings": get_embedding_cache().stats(),
+            "Page images": get_page_image_cache().stats(),
+        }), use_container_width=True)
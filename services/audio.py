@@ -5,16 +5,17 @@ import pyaudio
 import pygame
 from dotenv import load_dotenv
 from gtts import gTTS
-from openai import OpenAI
+
+from services.clients import get_client
+from services.llm import complete_sync
+from services.scheduler import VOICE, get_scheduler
+from services.telemetry import get_telemetry
 
 # Load .env file
 load_dotenv()
 
-# Initialize the OpenAI client with the modern API pattern
-client = OpenAI(
-    api_key=os.getenv('OPENAI_API_KEY'),
-    base_url=os.getenv('OPENAI_API_BASE_URL', 'https://api.openai.com/v1')
-)
+# The shared, pooled OpenAI client (see services.clients)
+client = get_client(os.getenv('OPENAI_API_BASE_URL', 'https://api.openai.com/v1'))
 
 # Initialize pygame speech mixer with explicit parameters for robustness
 pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=4096)
@@ -91,7 +92,8 @@ def transcribe_audio():
             raise FileNotFoundError(f"Audio file not found: {WAVE_OUTPUT_FILENAME}")
             
         # Open the audio file and send to Whisper API
-        with open(WAVE_OUTPUT_FILENAME, 'rb') as audio_file:
+        with open(WAVE_OUTPUT_FILENAME, 'rb') as audio_file, get_scheduler().slot(VOICE), \
+                get_telemetry().measure('transcription', 'voice', "whisper-1", client.base_url, priority=VOICE):
             transcription = client.audio.transcriptions.create(
                 model="whisper-1",
                 file=audio_file
@@ -127,14 +129,10 @@ def generate_gpt_response(prompt, messages=None):
             "content": prompt
         })
         
-        # Make the API call
-        response = client.chat.completions.create(
-            model="gpt-4",  # You can change this to other models as needed
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
-        )
-        
+        # Voice replies are short, so the router usually picks the fast model; without routing, gpt-4 as before.
+        # The request waits behind interactive requests but ahead of background work, see services.llm.complete
+        response = complete_sync(messages, {"page": "voice"}, VOICE, model="gpt-4", temperature=0.7, max_tokens=500)
+
         # Extract and return the response text
         if response.choices and len(response.choices) > 0:
             return response.choices[0].message.content.strip()
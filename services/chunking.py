@@ -0,0 +1,108 @@
+import functools
+import itertools
+import re
+from typing import Iterable, Iterator, List, Dict, Tuple
+
+import tiktoken as tkn
+
+# A segment ends after a blank line (paragraph) or after sentence-ending punctuation.
+# The separator stays with the segment before it, so joining segments restores the text.
+_SEGMENT_BOUNDARY = re.compile(r'\n\s*\n|(?<=[.!?])\s+')
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> tkn.Encoding:
+    """Load a tokenizer once per process."""
+    try:
+        return tkn.encoding_for_model(model)
+    except KeyError:
+        # Models served under custom names are counted with the GPT-3.5/4 tokenizer
+        return tkn.get_encoding("cl100k_base")
+
+
+def split_segments(text: str) -> List[str]:
+    """Split text into paragraph/sentence segments, dropping whitespace-only ones."""
+    segments = []
+    start = 0
+    for match in _SEGMENT_BOUNDARY.finditer(text):
+        segments.append(text[start:match.end()])
+        start = match.end()
+    segments.append(text[start:])
+    return [segment for segment in segments if segment.strip()]
+
+
+class Chunker:
+    """
+    Token-budgeted chunking on paragraph and sentence boundaries.
+
+    Chunks may run across page boundaries and record the span of pages they cover. Consecutive chunks
+    share up to `overlap` tokens of whole trailing sentences. A single sentence longer than `chunk_size`
+    is the only thing ever cut mid-text.
+    """
+
+    def __init__(self, chunk_size: int = 1500, overlap: int = 50, model: str = "gpt-3.5-turbo",
+                 pages_per_batch: int = 32, num_threads: int = 8):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.encoding = get_encoding(model)
+        self.pages_per_batch = pages_per_batch
+        self.num_threads = num_threads
+
+    def _segments(self, pages: Iterable[str]) -> Iterator[Tuple[int, str, int]]:
+        """Yield (page number, text, token count) per segment, tokenizing a batch of pages at a time."""
+        numbered = enumerate(pages, start=1)
+        while batch := list(itertools.islice(numbered, self.pages_per_batch)):
+            pieces = []
+            for page_number, text in batch:
+                segments = split_segments(text)
+                if segments and not segments[-1][-1].isspace():
+                    segments[-1] += '\n'
+                pieces.extend((page_number, segment) for segment in segments)
+
+            # tiktoken releases the GIL, so the batch is encoded on several threads at once
+            tokens = self.encoding.encode_ordinary_batch([segment for _, segment in pieces],
+                                                         num_threads=self.num_threads)
+            for (page_number, segment), segment_tokens in zip(pieces, tokens):
+                if len(segment_tokens) <= self.chunk_size:
+                    yield page_number, segment, len(segment_tokens)
+                    continue
+                for start in range(0, len(segment_tokens), self.chunk_size):
+                    window = segment_tokens[start:start + self.chunk_size]
+                    yield page_number, self.encoding.decode_bytes(window).decode('utf-8', errors='ignore'), len(window)
+
+    def chunk(self, pages: Iterable[str]) -> Iterator[Dict]:
+        """Yield chunks as dictionaries with `page_number`, `page_end` and `context`."""
+        current: List[Tuple[int, str, int]] = []
+        size = 0
+        fresh = 0  # segments in `current` that have not been emitted yet
+
+        for segment in self._segments(pages):
+            if current and fresh and size + segment[2] > self.chunk_size:
+                yield self._emit(current, fresh)
+                current, size = self._overlap_tail(current, self.chunk_size - segment[2])
+                fresh = 0
+            current.append(segment)
+            size += segment[2]
+            fresh += 1
+
+        if fresh:
+            yield self._emit(current, fresh)
+
+    def _overlap_tail(self, segments: List[Tuple[int, str, int]], room: int) -> Tuple[List, int]:
+        """Trailing whole segments worth at most `overlap` tokens, and never more than `room`."""
+        tail = []
+        size = 0
+        for segment in reversed(segments):
+            if size + segment[2] > min(self.overlap, room):
+                break
+            tail.insert(0, segment)
+            size += segment[2]
+        return tail, size
+
+    @staticmethod
+    def _emit(segments: List[Tuple[int, str, int]], fresh: int) -> Dict:
+        return {
+            'page_number': segments[-fresh][0],
+            'page_end': segments[-1][0],
+            'context': ''.join(text for _, text, _ in segments).strip(),
+        }
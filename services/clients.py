@@ -0,0 +1,197 @@
+import asyncio
+import os
+import threading
+from typing import Any, AsyncGenerator, AsyncIterator, Coroutine, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+# Connections per endpoint: enough for every session streaming at once, idle ones kept for reuse
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=32, keepalive_expiry=120)
+TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.responses = 0
+        self._lock = threading.Lock()
+
+    def add(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+
+def _pool_stats(http_client) -> Dict:
+    """Connection counts of an httpx client's pool; these are httpcore internals, so missing ones are skipped."""
+    pool = getattr(getattr(http_client, '_transport', None), '_pool', None)
+    connections = getattr(pool, 'connections', None)
+    if connections is None:
+        return {}
+    return {
+        'connections': len(connections),
+        'idle': sum(1 for connection in connections if connection.is_idle()),
+        'active': sum(1 for connection in connections if not connection.is_idle() and not connection.is_closed()),
+        'queued_requests': len(getattr(pool, '_requests', [])),
+    }
+
+
+class ClientRegistry:
+    """
+    Long-lived OpenAI clients, one sync and one async per (base_url, api_key), shared by every session.
+
+    Each client owns an httpx pool with keep-alive, so requests reuse warm TCP/TLS connections instead
+    of opening new ones. Async clients are bound to one event loop, and every Streamlit run makes its
+    own with `asyncio.run`, so the async clients live on a dedicated background loop: `run` and `stream`
+    execute coroutines and async generators there on behalf of any caller, sync or async.
+    """
+
+    def __init__(self, limits: httpx.Limits = POOL_LIMITS, timeout: httpx.Timeout = TIMEOUT):
+        self.limits = limits
+        self.timeout = timeout
+        self._sync: Dict[Tuple[str, str], OpenAI] = {}
+        self._async: Dict[Tuple[str, str], AsyncOpenAI] = {}
+        self._stats: Dict[Tuple[str, str, str], _EndpointStats] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    def _key(base_url: Optional[str], api_key: Optional[str]) -> Tuple[str, str]:
+        return (base_url or os.getenv('OPENAI_API_BASE_URL') or 'https://api.openai.com/v1',
+                api_key or os.getenv('OPENAI_API_KEY') or '')
+
+    def _endpoint_stats(self, kind: str, key: Tuple[str, str]) -> _EndpointStats:
+        """Caller holds the lock."""
+        if (kind, *key) not in self._stats:
+            self._stats[(kind, *key)] = _EndpointStats()
+        return self._stats[(kind, *key)]
+
+    def client(self, base_url: Optional[str] = None, api_key: Optional[str] = None) -> OpenAI:
+        """The shared sync client for an endpoint; defaults come from OPENAI_API_BASE_URL and OPENAI_API_KEY."""
+        key = self._key(base_url, api_key)
+        with self._lock:
+            client = self._sync.get(key)
+            if client is None:
+                stats = self._endpoint_stats('sync', key)
+                http_client = DefaultHttpxClient(limits=self.limits, timeout=self.timeout, event_hooks={
+                    'request': [lambda request: stats.add('requests')],
+                    'response': [lambda response: stats.add('responses')],
+                })
+                client = self._sync[key] = OpenAI(base_url=key[0], api_key=key[1], http_client=http_client)
+            return client
+
+    def async_client(self, base_url: Optional[str] = None, api_key: Optional[str] = None) -> AsyncOpenAI:
+        """The shared async client for an endpoint. Only use it on the registry's loop, i.e. inside `run`/`stream`."""
+        key = self._key(base_url, api_key)
+        with self._lock:
+            client = self._async.get(key)
+            if client is None:
+                stats = self._endpoint_stats('async', key)
+
+                async def on_request(request):
+                    stats.add('requests')
+
+                async def on_response(response):
+                    stats.add('responses')
+
+                http_client = DefaultAsyncHttpxClient(limits=self.limits, timeout=self.timeout, event_hooks={
+                    'request': [on_request], 'response': [on_response],
+                })
+                client = self._async[key] = AsyncOpenAI(base_url=key[0], api_key=key[1], http_client=http_client)
+            return client
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The background event loop the async clients live on, started on first use."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="openai-clients", daemon=True).start()
+            return self._loop
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        """Run a coroutine on the clients' loop and wait for its result (for sync callers)."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop()).result()
+
+    async def run_async(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        """Await a coroutine that runs on the clients' loop, from any other loop."""
+        loop = self.loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    async def stream(self, generator: AsyncIterator) -> AsyncGenerator:
+        """
+        Iterate an async generator on the clients' loop, yielding its items on the caller's loop.
+
+        If the caller stops early, the generator is cancelled on the clients' loop as well.
+        """
+        loop = self.loop()
+        caller = asyncio.get_running_loop()
+        if caller is loop:
+            async for item in generator:
+                yield item
+            return
+
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in generator:
+                    caller.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except Exception as e:
+                caller.call_soon_threadsafe(queue.put_nowait, (done, e))
+            else:
+                caller.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+        future = asyncio.run_coroutine_threadsafe(pump(), loop)
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is done:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            future.cancel()
+
+    def stats(self) -> List[Dict]:
+        """Request counts and connection pool state per endpoint and client kind."""
+        with self._lock:
+            clients = [('sync', key, client) for key, client in self._sync.items()]
+            clients += [('async', key, client) for key, client in self._async.items()]
+            stats = dict(self._stats)
+        rows = []
+        for kind, key, client in clients:
+            endpoint = stats[(kind, *key)]
+            rows.append({
+                'base_url': key[0],
+                'api_key': f"...{key[1][-4:]}" if key[1] else '',
+                'kind': kind,
+                'requests': endpoint.requests,
+                'responses': endpoint.responses,
+                **_pool_stats(client._client),
+            })
+        return rows
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ClientRegistry:
+    """The process-wide client registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
+
+
+def get_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> OpenAI:
+    return get_registry().client(base_url, api_key)
+
+
+def get_async_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> AsyncOpenAI:
+    return get_registry().async_client(base_url, api_key)
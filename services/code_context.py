@@ -0,0 +1,59 @@
+import difflib
+from typing import Callable, Dict, List, Optional
+
+
+def code_diff(old: str, new: str, context: int = 3) -> str:
+    """Unified diff between two versions of the editor buffer."""
+    return "".join(difflib.unified_diff(old.splitlines(keepends=True), new.splitlines(keepends=True),
+                                        "seen", "current", n=context))
+
+
+class CodeContext:
+    """
+    Remembers which version of the code the model has already seen in a conversation, so a new action
+    sends only what changed since then.
+
+    The version is tied to the message that carried it (a prompt we sent or a response the model wrote).
+    If that message is gone from the history, or is no longer part of what is sent to the model, the
+    full code is sent again. Diffs that would be nearly as large as the code are sent as full code too.
+    """
+
+    def __init__(self, max_diff_ratio: float = 0.6):
+        self.max_diff_ratio = max_diff_ratio
+        self.code: Optional[str] = None
+        self.index: Optional[int] = None
+        self._content: Optional[str] = None
+        self.full_sends = 0
+        self.diff_sends = 0
+        self.unchanged_sends = 0
+
+    def seen(self, code: str, messages: List[Dict[str, str]], index: int) -> None:
+        """Record that `messages[index]` showed the model this version of the code."""
+        self.code = code
+        self.index = index
+        self._content = messages[index]['content']
+
+    def _base(self, messages: List[Dict[str, str]], is_sent: Callable[[int], bool]) -> Optional[str]:
+        if self.code is None or self.index is None or self.index >= len(messages):
+            return None
+        if messages[self.index]['content'] != self._content or not is_sent(self.index):
+            return None
+        return self.code
+
+    def section(self, code: str, messages: List[Dict[str, str]], is_sent: Callable[[int], bool]) -> str:
+        """The code for the next prompt: in full, as a diff against the seen version, or a note that it is unchanged."""
+        base = self._base(messages, is_sent)
+        if base is not None and base == code:
+            self.unchanged_sends += 1
+            return "(The code is unchanged since its last version in this conversation.)"
+        if base is not None:
+            diff = code_diff(base, code)
+            if len(diff) < len(code) * self.max_diff_ratio:
+                self.diff_sends += 1
+                return ("(Changes since the last version of the code in this conversation, as a unified diff:)\n"
+                        f"```diff\n{diff}```")
+        self.full_sends += 1
+        return code
+
+    def stats(self) -> Dict:
+        return {'full': self.full_sends, 'diff': self.diff_sends, 'unchanged': self.unchanged_sends}
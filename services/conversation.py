@@ -0,0 +1,149 @@
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from services.chunking import get_encoding
+
+# Summaries are written on these threads, never on a request path
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+# Tokens a chat message costs beyond its content (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Tokens of a text, e.g. a streamed response whose usage the endpoint did not report."""
+    return len(get_encoding(model).encode_ordinary(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = "gpt-3.5-turbo") -> int:
+    """Approximate prompt tokens of chat messages."""
+    encoding = get_encoding(model)
+    return sum(len(encoding.encode_ordinary(message['content'])) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def _fingerprint(messages: List[Dict[str, str]]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        digest.update(f"{message['role']}\0{message['content']}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ConversationMemory:
+    """
+    Keeps the prompt sent for a conversation within a token budget.
+
+    The leading system messages are always sent. After them come a running summary of older turns
+    (if any) and then as many of the most recent messages as fit in `token_budget`; the newest message
+    is always sent. Messages that slide out of the window are folded into the summary by `summarize`
+    on a background thread after a turn completes, so no request ever waits for a summary; until one
+    is ready, the oldest messages are simply left out. Each fold keeps only `keep_ratio` of the budget
+    in recent messages, so the summary is rewritten every few turns rather than on every turn.
+
+    One instance per conversation (i.e. per session). The full history stays untouched for display.
+    """
+
+    def __init__(self, summarize: Callable[[str, List[Dict[str, str]]], str], token_budget: int = 3000,
+                 model: str = "gpt-3.5-turbo", keep_ratio: float = 0.6):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_ratio = keep_ratio
+        self.model = model
+        self.summary = ""
+        self.summarized = 0  # conversation messages (after the leading system ones) covered by the summary
+        self.summaries = 0
+        self.last_prompt_tokens = 0
+        self._summarized_fingerprint = _fingerprint([])
+        self._pending: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(messages: List[Dict[str, str]]):
+        pinned = 0
+        while pinned < len(messages) and messages[pinned]['role'] == 'system':
+            pinned += 1
+        return messages[:pinned], messages[pinned:]
+
+    def _summary_message(self) -> List[Dict[str, str]]:
+        if not self.summary:
+            return []
+        return [{"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"}]
+
+    def _window_start(self, pinned: List[Dict[str, str]], turns: List[Dict[str, str]], budget: int) -> int:
+        """Index of the oldest turn that fits in `budget` next to the pinned messages and the summary."""
+        room = budget - count_message_tokens(pinned + self._summary_message(), self.model)
+        start = len(turns)
+        while start > 0:
+            cost = count_message_tokens([turns[start - 1]], self.model)
+            if cost > room and start < len(turns):
+                break
+            room -= cost
+            start -= 1
+        return start
+
+    def _check_history(self, turns: List[Dict[str, str]]) -> None:
+        """Forget the summary if the conversation it describes was reset or rewritten; caller holds the lock."""
+        if self.summarized and (self.summarized > len(turns)
+                                or _fingerprint(turns[:self.summarized]) != self._summarized_fingerprint):
+            self.summary = ""
+            self.summarized = 0
+            self._summarized_fingerprint = _fingerprint([])
+
+    def request_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """The messages to send for the next response."""
+        pinned, turns = self._split(messages)
+        with self._lock:
+            self._check_history(turns)
+            start = max(self._window_start(pinned, turns, self.token_budget), min(self.summarized, len(turns) - 1))
+            request = pinned + self._summary_message() + turns[start:]
+        self.last_prompt_tokens = count_message_tokens(request, self.model)
+        return request
+
+    def sends(self, messages: List[Dict[str, str]], index: int) -> bool:
+        """Whether `messages[index]` is still sent to the model verbatim, rather than summarized or dropped."""
+        pinned, turns = self._split(messages)
+        if index < len(pinned):
+            return True
+        with self._lock:
+            self._check_history(turns)
+            # Judged against the window after a fold, so the message doesn't slide out right after being used
+            start = max(self._window_start(pinned, turns, int(self.token_budget * self.keep_ratio)), self.summarized)
+        return index - len(pinned) >= start
+
+    def update(self, messages: List[Dict[str, str]]) -> None:
+        """After a turn: fold the messages that no longer fit into the summary, in the background."""
+        pinned, turns = self._split(messages)
+        with self._lock:
+            self._check_history(turns)
+            if self._pending is not None and not self._pending.done():
+                return  # the next update picks up whatever this one misses
+            if self._window_start(pinned, turns, self.token_budget) <= self.summarized:
+                return
+            start = self._window_start(pinned, turns, int(self.token_budget * self.keep_ratio))
+            previous, folded = self.summary, turns[self.summarized:start]
+            self._pending = _summarizer.submit(self._fold, previous, folded, _fingerprint(turns[:start]), start)
+
+    def _fold(self, previous: str, folded: List[Dict[str, str]], fingerprint: str, covered: int) -> None:
+        try:
+            summary = self.summarize(previous, folded)
+        except Exception as e:
+            print(f"Summarizing {len(folded)} messages failed: {e}")
+            return
+        with self._lock:
+            # Only apply it if the summary it extends is still the current one
+            if self.summary == previous:
+                self.summary = summary
+                self.summarized = covered
+                self._summarized_fingerprint = fingerprint
+                self.summaries += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'summarized_messages': self.summarized,
+                'summaries': self.summaries,
+                'summary_tokens': count_message_tokens(self._summary_message(), self.model),
+                'last_prompt_tokens': self.last_prompt_tokens,
+                'summarizing': self._pending is not None and not self._pending.done(),
+            }
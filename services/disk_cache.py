@@ -0,0 +1,181 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Iterable, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+# A cache over its budget is trimmed to this fraction of it, so a full cache doesn't evict on every store
+TRIM_RATIO = 0.9
+
+
+def lru_victims(entries: Iterable[Tuple[T, int]], total: int, budget: int) -> Tuple[List[T], int]:
+    """
+    The entries to evict from a cache holding `total` of `budget` (bytes or entries), and how much that frees.
+
+    `entries` are (key, size) pairs, least recently used first. Nothing is evicted within the budget.
+    """
+    victims, freed = [], 0
+    if total <= budget:
+        return victims, freed
+    for key, size in entries:
+        if total - freed <= budget * TRIM_RATIO:
+            break
+        victims.append(key)
+        freed += size
+    return victims, freed
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Write under a temporary name and rename, so readers in any process never see a partial file."""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class FileLRU:
+    """
+    A directory of one file per entry, bounded by `max_bytes`, evicting the least recently read files.
+
+    File mtimes double as access times, so the order survives restarts. Only files ending in `suffix`
+    are entries. Safe to share between threads.
+    """
+
+    def __init__(self, path: str, suffix: str, max_bytes: int):
+        self.path = path
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        # Least recently used first
+        self._files: OrderedDict[str, int] = OrderedDict()
+        entries = [entry for entry in os.scandir(path) if entry.name.endswith(suffix)]
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            self._files[entry.name] = entry.stat().st_size
+        self._bytes = sum(self._files.values())
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._files
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._files)
+
+    @property
+    def bytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def read(self, name: str) -> Optional[bytes]:
+        """The contents of an entry, marking it as recently used; None if there is no such entry."""
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+        try:
+            with open(self.file(name), 'rb') as f:
+                data = f.read()
+            os.utime(self.file(name))
+        except FileNotFoundError:
+            # Removed behind our back, e.g. by another process sharing the directory
+            with self._lock:
+                self._bytes -= self._files.pop(name, 0)
+            return None
+        return data
+
+    def write(self, name: str, data: bytes) -> List[str]:
+        """Store an entry; returns the names of the entries evicted to make room."""
+        atomic_write(self.file(name), data)
+        with self._lock:
+            self._bytes += len(data) - self._files.pop(name, 0)
+            self._files[name] = len(data)
+            # The newest entry is never evicted, however large
+            victims, freed = lru_victims(itertools.islice(self._files.items(), len(self._files) - 1),
+                                         self._bytes, self.max_bytes)
+            for victim in victims:
+                del self._files[victim]
+            self._bytes -= freed
+            self.evictions += len(victims)
+        for victim in victims:
+            self._unlink(victim)
+        return victims
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._bytes -= self._files.pop(name, 0)
+        self._unlink(name)
+
+    def _unlink(self, name: str) -> None:
+        try:
+            os.remove(self.file(name))
+        except FileNotFoundError:
+            pass
+
+
+class MemoryLRU:
+    """
+    In-process LRU bounded by entry count and/or total `size` of the values. Not locked: callers
+    hold their own lock around it.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 size: Callable[[object], int] = len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = size
+        self.bytes = 0
+        self._entries: OrderedDict[Hashable, object] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        self.pop(key)
+        self._entries[key] = value
+        self.bytes += self.size(value)
+        # The newest entry always stays
+        while len(self._entries) > 1 and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= self.size(evicted)
+
+    def pop(self, key: Hashable) -> None:
+        if key in self._entries:
+            self.bytes -= self.size(self._entries.pop(key))
+
+
+class Shared(Generic[T]):
+    """
+    Holder of a process-wide instance, e.g. a cache shared by all sessions, created on first use.
+    `replace` swaps it, e.g. for one in a temporary directory in benchmarks.
+    """
+
+    def __init__(self):
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def get(self, create: Callable[[], T]) -> T:
+        with self._lock:
+            if self._instance is None:
+                self._instance = create()
+            return self._instance
+
+    def replace(self, instance: Optional[T]) -> None:
+        with self._lock:
+            self._instance = instance
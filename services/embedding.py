@@ -1,140 +1,267 @@
+import glob
+
 import numpy as np
 import openai
-import PyPDF2
-import pandas as pd
-from PyPDF2 import PdfFileReader
-from typing import List, Dict, Tuple
-import tiktoken as tkn
-from openai import OpenAI
-from sklearn.neighbors import NearestNeighbors
+from typing import List, Dict, Tuple, Optional, Sequence, Iterable, Iterator, Callable
 import os
-from pathlib import Path
-import json
+
+from services.embedding_store import EmbeddingStore, content_hash
+from services.vector_index import get_index
+from services.lexical_index import get_lexical_index
+from services.chunking import Chunker, get_encoding
+from services.pdf_text import iter_page_texts
+from services.embedding_cache import EmbeddingCache, get_embedding_cache
+from services.embedding_pipeline import embed_texts_async, MAX_TOKENS_PER_REQUEST, MAX_INPUTS_PER_REQUEST
+from services.clients import get_async_client, get_client, get_registry
+from services.scheduler import INTERACTIVE, get_scheduler
+from services.telemetry import get_telemetry
 
 class PDFSemanticSearch:
-    def __init__(self, base_url='http://aitools.cs.vt.edu:7860/openai/v1', api_key="aitools"):
-        """Initialize the semantic search system with OpenAI client."""
-        self.client = OpenAI(base_url=base_url, api_key=api_key)
+    def __init__(self, base_url='http://aitools.cs.vt.edu:7860/openai/v1', api_key="aitools",
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 embedding_function: Optional[Callable[[List[str]], Sequence]] = None):
+        """
+        Initialize the semantic search system with OpenAI client.
+
+        `embedding_function` replaces the embeddings endpoint with a local function mapping a list of
+        texts to a list of vectors (e.g. a deterministic fake for benchmarks). Give the searcher a
+        distinct `embedding_model` name along with it, so its vectors never mix with real ones.
+        """
+        self.embedding_function = embedding_function
+        self.base_url = base_url
+        self.api_key = api_key
+        self.client = get_client(base_url, api_key)
         self.embedding_model = "text-embedding-3-small"
         self.chunk_size = 1500
         self.overlap = 50
-        self.batch_size = 20
+        self.max_batch_tokens = MAX_TOKENS_PER_REQUEST
+        self.max_batch_inputs = MAX_INPUTS_PER_REQUEST
+        self.max_in_flight = 4
+        self.extraction_workers = os.cpu_count()
         self.n_neighbors = 5
+        # "hybrid" fuses vector and BM25 rankings, "vector" and "lexical" use one retriever only
+        self.retrieval_mode = "hybrid"
+        self.query_embedding_timeout = 3.0
+        self.candidates_per_retriever = 4
+        self.rrf_k = 60
+        # In-memory index layout, see services.vector_index: float32 (exact), float16 or int8,
+        # optionally reduced to fewer dimensions by truncation or PCA and rescored at full precision
+        self.index_storage = os.getenv('DUCKY_INDEX_STORAGE', 'float32')
+        self.index_dimensions = int(os.getenv('DUCKY_INDEX_DIMENSIONS', '0')) or None
+        self.index_reduction = os.getenv('DUCKY_INDEX_REDUCTION', 'truncate')
+        self.embedding_cache = embedding_cache or get_embedding_cache()
+
+    def extract_pages(self, pdf_path: str) -> Iterator[str]:
+        """Extract the text of every page in parallel, yielding pages in page order as they become available."""
+        return iter_page_texts(pdf_path, self.extraction_workers)
 
     def extract_text_and_pages(self, pdf_path: str) -> List[Dict[str, any]]:
         """Extract text from PDF with page numbers."""
-        documents = []
-        with open(pdf_path, 'rb') as file:
-            reader = PdfFileReader(file)
-            current_position = 0
-            
-            for page_num in range(reader.getNumPages()):
-                page_text = reader.getPage(page_num).extractText()
-                # Store page number with each chunk
-                chunks = self._chunk_text(page_text)
-                for chunk in chunks:
-                    documents.append({
-                        'document_name': os.path.basename(pdf_path),
-                        'page_number': page_num + 1,
-                        'context': chunk,
-                        'position': current_position
-                    })
-                    current_position += 1
-        return documents
-
-    def _chunk_text(self, text: str) -> List[str]:
-        """Split text into chunks using token-based approach."""
-        encoding = tkn.encoding_for_model("gpt-3.5-turbo")
-        tokens = list(encoding.encode(text))
-
-        if len(tokens) <= self.chunk_size:
-            return [text]
-
-        chunks = []
-        position = 0
-
-        while position < len(tokens):
-            start_pos = max(0, position - self.overlap)
-            end_pos = min(position + self.chunk_size, len(tokens))
-            chunk_tokens = tokens[start_pos:end_pos]
-            chunk_text = ''.join(encoding.decode_bytes(chunk_tokens).decode('utf-8', errors='ignore'))
-            chunks.append(chunk_text)
-            position += self.chunk_size
-
-        return chunks
-
-    def get_embedding(self, text: str) -> List[float]:
-        """Get embedding for a single text."""
-        response = self.client.embeddings.create(
-            model=self.embedding_model,
-            input=[text],
-            encoding_format="float"
-        )
-        return response.data[0].embedding
-
-    def process_embeddings(self, pdf_path: str, embedding_csv_path: str) -> pd.DataFrame:
-        """Process PDF and generate or load embeddings."""
-        if os.path.exists(embedding_csv_path):
-            print(f"Loading existing embeddings from {embedding_csv_path}")
-            df = pd.read_csv(embedding_csv_path)
-            df['embedding'] = df['embedding'].apply(eval)  # Convert string to list
-            return df
-
-        print(f"Generating new embeddings for {pdf_path}")
-        documents = self.extract_text_and_pages(pdf_path)
-        
-        # Process embeddings in batches
-        all_embeddings = []
-        for i in range(0, len(documents), self.batch_size):
-            batch = documents[i:i + self.batch_size]
-            batch_texts = [doc['context'] for doc in batch]
-            
-            response = self.client.embeddings.create(
+        return self._chunk_pages(os.path.basename(pdf_path), self.extract_pages(pdf_path))
+
+    def _chunk_pages(self, document_name: str, pages: Iterable[str]) -> List[Dict[str, any]]:
+        """Chunk page texts on sentence boundaries, storing the page span with each chunk."""
+        chunker = Chunker(self.chunk_size, self.overlap)
+        return [
+            {'document_name': document_name, 'position': position, **chunk}
+            for position, chunk in enumerate(chunker.chunk(pages))
+        ]
+
+    def get_embedding(self, text: str, timeout: Optional[float] = None, cache: bool = True) -> np.ndarray:
+        """
+        Get embedding for a single text, served from the query embedding cache when possible.
+        With `cache` False the endpoint is always asked and the result not stored, e.g. for a readiness probe.
+        """
+        cached = self.embedding_cache.get(self.embedding_model, text) if cache else None
+        if cached is not None:
+            return cached
+
+        if self.embedding_function is not None:
+            vector = self.embedding_function([text])[0]
+            return self.embedding_cache.put(self.embedding_model, text, vector) if cache else np.asarray(vector)
+
+        client = self.client if timeout is None else self.client.with_options(timeout=timeout, max_retries=0)
+        # Query embeddings are on the request path; ingestion batches wait in the background class
+        with get_scheduler().slot(INTERACTIVE, len(text) // 4 + 1), \
+                get_telemetry().measure('embedding', 'query', self.embedding_model, client.base_url) as sample:
+            response = client.embeddings.create(
                 model=self.embedding_model,
-                input=batch_texts,
+                input=[text],
                 encoding_format="float"
             )
-            
-            batch_embeddings = [e.embedding for e in response.data]
-            all_embeddings.extend(batch_embeddings)
-
-        # Create DataFrame with all required columns
-        df = pd.DataFrame(documents)
-        df['embedding'] = all_embeddings
-
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(embedding_csv_path), exist_ok=True)
-        
-        # Save to CSV
-        df.to_csv(embedding_csv_path, index=False)
-        print(f"Saved embeddings to {embedding_csv_path}")
-        
-        return df
-
-    def find_relevant_chunks(self, query: str, df: pd.DataFrame, top_k: int = 3) -> List[Dict]:
-        """Find the most relevant chunks for a given query."""
-        # Get query embedding
-        query_embedding = self.get_embedding(query)
-        
-        # Convert embeddings to numpy array
-        embeddings_array = np.array(df['embedding'].tolist())
-        
-        # Initialize and fit NearestNeighbors
-        nn = NearestNeighbors(n_neighbors=min(top_k, len(df)), metric='cosine')
-        nn.fit(embeddings_array)
-        
-        # Find nearest neighbors
-        distances, indices = nn.kneighbors([query_embedding])
-        
+            sample.update(prompt_tokens=response.usage.prompt_tokens if response.usage else None, inputs=1)
+        if not cache:
+            return np.asarray(response.data[0].embedding, dtype=np.float32)
+        return self.embedding_cache.put(self.embedding_model, text, response.data[0].embedding)
+
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in token-packed batches with several requests in flight, preserving order."""
+        if not texts:
+            return []
+        if self.embedding_function is not None:
+            return list(self.embedding_function(texts))
+        encoding = get_encoding(self.embedding_model)
+        token_counts = [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+        return get_registry().run(self._embed_texts_async(texts, token_counts))
+
+    async def _embed_texts_async(self, texts: List[str], token_counts: List[int]) -> List[List[float]]:
+        # Retries are handled by the pipeline, which honors Retry-After across all batches
+        client = get_async_client(self.base_url, self.api_key).with_options(max_retries=0)
+        return await embed_texts_async(client, self.embedding_model, texts, token_counts,
+                                       max_in_flight=self.max_in_flight,
+                                       max_tokens=self.max_batch_tokens,
+                                       max_inputs=self.max_batch_inputs,
+                                       scheduler=get_scheduler())
+
+    def process_embeddings(self, pdf_path: str, store_path: str) -> EmbeddingStore:
+        """Process a single PDF and generate or load embeddings."""
+        return self.ingest([pdf_path], store_path)
+
+    def process_directory(self, pdf_dir: str, store_path: str) -> EmbeddingStore:
+        """Process every PDF in a directory into one searchable store."""
+        return self.ingest(sorted(glob.glob(os.path.join(pdf_dir, '*.pdf'))), store_path)
+
+    def ingest(self, pdf_paths: Sequence[str], store_path: str) -> EmbeddingStore:
+        """
+        Build or incrementally refresh a multi-document store.
+
+        A document whose file and page-text hashes are unchanged keeps its rows as they are.
+        A new or changed document is re-chunked, and only chunks whose text is not already in
+        the store are embedded. Documents that are no longer listed are dropped.
+        Embeddings from the old per-document stores and `*.embeddings.csv` files are not reused: their chunks
+        were cut per page, so none of their texts match, and those books are embedded again.
+        """
+        existing = self._open_store(store_path)
+        names = [os.path.basename(pdf_path) for pdf_path in pdf_paths]
+        chunking = {'chunk_size': self.chunk_size, 'overlap': self.overlap}
+        rechunk = existing is not None and existing.header.get('chunking') != chunking
+        if rechunk:
+            # Chunk boundaries move: re-chunk every document, still reusing chunks whose text is unchanged
+            print(f"Chunking settings changed for {store_path}, re-chunking all documents")
+        known_sources = existing.sources if existing is not None and not rechunk else {}
+        changed = existing is None or rechunk or set(existing.documents) != set(names)
+        reusable = self._rows_by_hash(existing)
+
+        documents: List[Dict] = []
+        vectors: List[Optional[np.ndarray]] = []
+        sources: Dict[str, Dict] = {}
+        for name, pdf_path in zip(names, pdf_paths):
+            stat = os.stat(pdf_path)
+            known = known_sources.get(name)
+            if known and (known['size'], known['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                sources[name] = known
+                self._keep_rows(existing, existing.document_rows(name), documents, vectors)
+                continue
+
+            # Pages are hashed as they stream out of extraction and into chunking
+            page_hashes = []
+            chunks = self._chunk_pages(name, self._hash_pages(self.extract_pages(pdf_path), page_hashes))
+            sources[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'page_hashes': page_hashes}
+            if known and known['page_hashes'] == page_hashes:
+                # Touched but not edited: only the file stat needs refreshing
+                changed = True
+                self._keep_rows(existing, existing.document_rows(name), documents, vectors)
+                continue
+
+            changed = True
+            for doc in chunks:
+                store, row = reusable.get(content_hash(doc['context']), (None, None))
+                documents.append(doc)
+                vectors.append(store.vectors[row] if store is not None else None)
+
+        if not changed:
+            print(f"Loading existing embeddings from {store_path}")
+            return existing
+
+        pending = [i for i, vector in enumerate(vectors) if vector is None]
+        print(f"Embedding {len(pending)} of {len(documents)} chunks for {store_path}")
+        for i, embedding in zip(pending, self._embed_texts([documents[i]['context'] for i in pending])):
+            vectors[i] = np.asarray(embedding, dtype=np.float32)
+
+        matrix = np.vstack(vectors).astype(np.float32, copy=False) if vectors else np.empty((0, 0), np.float32)
+        store = EmbeddingStore.write(store_path, documents, matrix, self.embedding_model, sources, chunking)
+        print(f"Saved embeddings to {store_path}")
+
+        # Build the BM25 index alongside the vectors so the first query doesn't pay for it
+        get_lexical_index(store)
+        return store
+
+    def _open_store(self, store_path: str) -> Optional[EmbeddingStore]:
+        """Open the store at `store_path` if it exists and was built with the current embedding model."""
+        if not EmbeddingStore.exists(store_path):
+            return None
+        try:
+            store = EmbeddingStore.open(store_path)
+        except ValueError as e:
+            print(f"Ignoring embeddings in {store_path}: {e}")
+            return None
+        if store.model != self.embedding_model:
+            print(f"Embeddings in {store_path} were built with {store.model}, regenerating")
+            return None
+        return store
+
+    @staticmethod
+    def _hash_pages(pages: Iterable[str], page_hashes: List[str]) -> Iterator[str]:
+        for page in pages:
+            page_hashes.append(content_hash(page).hex())
+            yield page
+
+    @staticmethod
+    def _rows_by_hash(store: Optional[EmbeddingStore]) -> Dict[bytes, Tuple[EmbeddingStore, int]]:
+        if store is None:
+            return {}
+        return {h.tobytes(): (store, i) for i, h in enumerate(store.meta['content_hash'])}
+
+    @staticmethod
+    def _keep_rows(store: EmbeddingStore, rows, documents: List[Dict], vectors: List) -> None:
+        for row in rows:
+            documents.append(store.chunk(row))
+            vectors.append(store.vectors[row])
+
+    def find_relevant_chunks(self, query: str, store: EmbeddingStore, top_k: int = 3,
+                             documents: Optional[Sequence[str]] = None, mode: Optional[str] = None) -> List[Dict]:
+        """
+        Find the most relevant chunks for a given query, optionally only within the given documents.
+
+        In hybrid mode the BM25 and vector rankings are merged with reciprocal rank fusion. If the query
+        embedding cannot be had within `query_embedding_timeout`, hybrid mode answers from BM25 alone;
+        vector mode falls back to BM25 too if the embedding request fails.
+        """
+        mode = mode or self.retrieval_mode
+        mask = store.document_mask(documents) if documents else None
+        candidates = top_k * self.candidates_per_retriever if mode == "hybrid" else top_k
+        rankings = []
+
+        if mode in ("hybrid", "lexical"):
+            indices, scores = get_lexical_index(store).search(query, candidates, mask)
+            rankings.append(indices)
+
+        if mode in ("hybrid", "vector"):
+            try:
+                # Get query embedding, giving up quickly when a lexical ranking is available as fallback
+                query_embedding = self.get_embedding(query, self.query_embedding_timeout if rankings else None)
+            except openai.OpenAIError as e:
+                print(f"Query embedding failed ({type(e).__name__}), using lexical retrieval only")
+                if not rankings:
+                    # Vector mode: an empty result would pass for "nothing relevant in the library"
+                    indices, scores = get_lexical_index(store).search(query, candidates, mask)
+                    rankings.append(indices)
+            else:
+                # Search the shared index, built once per store
+                index = get_index(store, self.index_storage, self.index_dimensions, self.index_reduction)
+                indices, scores = index.search(query_embedding, candidates, mask)
+                rankings.append(indices)
+
         # Get relevant chunks with metadata
-        relevant_chunks = []
-        for idx in indices[0]:
-            chunk_data = df.iloc[idx]
-            relevant_chunks.append({
-                'document_name': chunk_data['document_name'],
-                'page_number': chunk_data['page_number'],
-                'context': chunk_data['context'],
-                'position': chunk_data['position']
-            })
-        
-        return relevant_chunks
\ No newline at end of file
+        return [store.chunk(idx) for idx in _fuse_rankings(rankings, top_k, self.rrf_k)]
+
+
+def _fuse_rankings(rankings: List[np.ndarray], top_k: int, k: int = 60) -> List[int]:
+    """Reciprocal rank fusion: each ranking adds 1 / (k + rank) to a row's score."""
+    if len(rankings) == 1:
+        return [int(i) for i in rankings[0][:top_k]]
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, index in enumerate(ranking):
+            fused[int(index)] = fused.get(int(index), 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)[:top_k]
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, Optional
+
+import numpy as np
+
+from services.disk_cache import MemoryLRU, Shared, lru_victims
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'data/cache/query_embeddings.sqlite')
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a query for caching: NFKC, trimmed, with runs of whitespace collapsed."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of embedding vectors keyed by (model, normalized text).
+
+    The first tier is an in-process LRU bounded by entry count; the second is a SQLite file
+    bounded by total vector bytes, evicting the least recently used rows. Both are safe to
+    share between threads, i.e. between Streamlit sessions.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_memory_entries: int = 1024,
+                 max_disk_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = MemoryLRU(max_entries=max_memory_entries)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+        self._db.commit()
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        """Return the cached vector, or None on a miss."""
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self.memory_hits += 1
+                return vector
+
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE embeddings SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            self._memory.put(key, vector)
+            self.disk_hits += 1
+            return vector
+
+    def put(self, model: str, text: str, vector) -> np.ndarray:
+        """Store a vector in both tiers and return it as a float32 array."""
+        key = cache_key(model, text)
+        vector = np.asarray(vector, dtype=np.float32)
+        blob = vector.tobytes()
+        with self._lock:
+            self._memory.put(key, vector)
+            previous = self._db.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO embeddings (key, model, vector, size, accessed) "
+                             "VALUES (?, ?, ?, ?, ?)", (key, model, blob, len(blob), time.time()))
+            self._disk_bytes += len(blob) - (previous[0] if previous else 0)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+            self._db.commit()
+        return vector
+
+    def _evict_disk(self) -> None:
+        rows = self._db.execute("SELECT key, size FROM embeddings ORDER BY accessed")
+        evicted, freed = lru_victims(rows, self._disk_bytes, self.max_disk_bytes)
+        self._db.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key in evicted])
+        self._disk_bytes -= freed
+        self.evictions += len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current sizes of both tiers."""
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk_bytes,
+            }
+
+
+_default_cache: Shared[EmbeddingCache] = Shared()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """The process-wide query embedding cache."""
+    return _default_cache.get(EmbeddingCache)
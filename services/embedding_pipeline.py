@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import random
+from typing import List, Sequence, Optional
+
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from services.scheduler import BACKGROUND, LLMScheduler
+from services.telemetry import get_telemetry
+
+# Limits of the OpenAI embeddings endpoint
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300_000
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+
+def pack_batches(token_counts: Sequence[int],
+                 max_tokens: int = MAX_TOKENS_PER_REQUEST,
+                 max_inputs: int = MAX_INPUTS_PER_REQUEST) -> List[range]:
+    """
+    Split consecutive inputs into batches that stay under both request limits.
+
+    Returns index ranges into the inputs, in order. An input larger than `max_tokens`
+    gets a batch of its own and is left for the endpoint to reject or truncate.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, count in enumerate(token_counts):
+        if i > start and (tokens + count > max_tokens or i - start >= max_inputs):
+            batches.append(range(start, i))
+            start = i
+            tokens = 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append(range(start, len(token_counts)))
+    return batches
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, if it said so."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+
+async def _embed_batch(client: AsyncOpenAI, model: str, texts: List[str], tokens: int, semaphore: asyncio.Semaphore,
+                       scheduler: Optional[LLMScheduler], max_retries: int, base_delay: float,
+                       max_delay: float) -> List[List[float]]:
+    attempt = 0
+    while True:
+        slot = scheduler.aslot(BACKGROUND, tokens) if scheduler is not None else contextlib.nullcontext()
+        async with semaphore, slot:
+            try:
+                with get_telemetry().measure('embedding', 'ingestion', model, client.base_url, priority=BACKGROUND,
+                                             inputs=len(texts), prompt_tokens=tokens):
+                    response = await client.embeddings.create(model=model, input=texts, encoding_format="float")
+                # The endpoint tags each vector with its input index; don't rely on response order
+                return [e.embedding for e in sorted(response.data, key=lambda e: e.index)]
+            except RETRYABLE_ERRORS as e:
+                if attempt >= max_retries:
+                    raise
+                error = e
+
+        # Back off outside the semaphore so other batches can use the slot
+        delay = _retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+        else:
+            delay += random.uniform(0, min(base_delay, delay))
+        attempt += 1
+        print(f"Embedding batch of {len(texts)} failed ({type(error).__name__}), retry {attempt} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+async def embed_texts_async(client: AsyncOpenAI, model: str, texts: Sequence[str], token_counts: Sequence[int],
+                            max_in_flight: int = 4,
+                            max_tokens: int = MAX_TOKENS_PER_REQUEST,
+                            max_inputs: int = MAX_INPUTS_PER_REQUEST,
+                            max_retries: int = 6,
+                            base_delay: float = 1.0,
+                            max_delay: float = 60.0,
+                            scheduler: Optional[LLMScheduler] = None) -> List[List[float]]:
+    """
+    Embed texts with up to `max_in_flight` concurrent requests, returning vectors in input order.
+
+    Batches are packed by token count. Rate limits, timeouts, connection and server errors are retried
+    with jittered exponential backoff, honoring Retry-After when the endpoint sends it. With a `scheduler`,
+    every request also waits for a background slot there.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+    batches = pack_batches(token_counts, max_tokens, max_inputs)
+    results = await asyncio.gather(*[
+        _embed_batch(client, model, [texts[i] for i in batch], sum(token_counts[i] for i in batch), semaphore,
+                     scheduler, max_retries, base_delay, max_delay)
+        for batch in batches
+    ])
+    return [embedding for batch in results for embedding in batch]
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import List, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+# A store is a directory with the following layout:
+#   header.json  - format version, embedding model, dimension, row count, chunking settings, the document
+#                  table and, per document, the source file size/mtime and hashes of its page texts
+#                  (for incremental ingestion)
+#   vectors.f32  - contiguous row-major float32 matrix of shape (count, dimension), opened with np.memmap
+#   meta.npy     - structured array with one row of metadata per vector (see META_DTYPE)
+#   texts.bin    - UTF-8 chunk texts concatenated back to back, addressed by (text_offset, text_length)
+FORMAT_VERSION = 3
+HEADER_FILE = "header.json"
+VECTORS_FILE = "vectors.f32"
+META_FILE = "meta.npy"
+TEXTS_FILE = "texts.bin"
+
+META_DTYPE = np.dtype([
+    ('document', '<u4'),
+    ('page_number', '<u4'),
+    ('page_end', '<u4'),
+    ('position', '<u8'),
+    ('text_offset', '<u8'),
+    ('text_length', '<u4'),
+    ('content_hash', 'u1', (16,)),
+])
+
+
+def content_hash(text: str) -> bytes:
+    """Digest used to recognise identical texts across ingestion runs."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class EmbeddingStore:
+    """Read-only view over an on-disk embedding store; vectors and texts are memory-mapped, not loaded."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE), 'r', encoding='utf-8') as f:
+            self.header = json.load(f)
+            stat = os.fstat(f.fileno())
+        self._signature = (stat.st_ino, stat.st_mtime_ns)
+
+        if self.header.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding store version {self.header.get('version')} in {path}")
+
+        self.model: str = self.header['model']
+        self.dimension: int = self.header['dimension']
+        self.count: int = self.header['count']
+        self.documents: List[str] = self.header['documents']
+        self.sources: Dict[str, Dict] = self.header.get('sources', {})
+
+        if self.count:
+            self.vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode='r',
+                                     shape=(self.count, self.dimension))
+        else:
+            self.vectors = np.empty((0, self.dimension), dtype=np.float32)
+        self.meta = np.load(os.path.join(path, META_FILE), mmap_mode='r')
+
+        texts_path = os.path.join(path, TEXTS_FILE)
+        if os.path.getsize(texts_path):
+            self._texts = np.memmap(texts_path, dtype=np.uint8, mode='r')
+        else:
+            self._texts = np.empty(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return self.count
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        """Check whether a complete store lives at the given path."""
+        return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+    @classmethod
+    def open(cls, path: str) -> 'EmbeddingStore':
+        """Open an existing store."""
+        return cls(path)
+
+    def signature(self) -> Tuple[int, int]:
+        """
+        Identity of the store contents this object was opened on.
+
+        Stores are swapped in atomically with a new header, so a changed signature means the contents changed.
+        """
+        return self._signature
+
+    def document_rows(self, name: str) -> np.ndarray:
+        """Indices of all rows belonging to one document."""
+        if name not in self.documents:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.meta['document'] == self.documents.index(name))
+
+    def document_mask(self, names: Sequence[str]) -> np.ndarray:
+        """Boolean row mask selecting the given documents; unknown names are ignored."""
+        wanted = set(names)
+        ids = [i for i, name in enumerate(self.documents) if name in wanted]
+        return np.isin(self.meta['document'], ids)
+
+    def text(self, index: int) -> str:
+        """Decode the chunk text of a single row."""
+        row = self.meta[index]
+        start = int(row['text_offset'])
+        return self._texts[start:start + int(row['text_length'])].tobytes().decode('utf-8')
+
+    def chunk(self, index: int) -> Dict:
+        """Return one row in the same shape the chunk dictionaries have during extraction."""
+        row = self.meta[index]
+        return {
+            'document_name': self.documents[int(row['document'])],
+            'page_number': int(row['page_number']),
+            'page_end': int(row['page_end']),
+            'context': self.text(index),
+            'position': int(row['position'])
+        }
+
+    @classmethod
+    def write(cls, path: str, documents: Sequence[Dict], embeddings, model: str,
+              sources: Optional[Dict[str, Dict]] = None,
+              chunking: Optional[Dict] = None) -> 'EmbeddingStore':
+        """
+        Write chunk dictionaries and their embeddings as a new store, replacing any store already at `path`.
+
+        `sources` maps document names to what ingestion knows about the source file:
+        `size`, `mtime_ns` and `page_hashes` (hex digests of the page texts, in page order).
+        `chunking` records the settings the chunks were produced with.
+
+        The store is assembled in a sibling temporary directory and swapped in at the end,
+        so readers never observe a half-written store.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if len(documents) != len(vectors):
+            raise ValueError(f"Got {len(documents)} chunks but {len(vectors)} embeddings")
+        dimension = int(vectors.shape[1]) if vectors.ndim == 2 and len(vectors) else 0
+
+        document_names: List[str] = []
+        document_ids: Dict[str, int] = {}
+        meta = np.zeros(len(documents), dtype=META_DTYPE)
+        encoded_texts = []
+        offset = 0
+        for i, doc in enumerate(documents):
+            name = doc['document_name']
+            if name not in document_ids:
+                document_ids[name] = len(document_names)
+                document_names.append(name)
+            encoded = doc['context'].encode('utf-8')
+            meta[i] = (document_ids[name], doc['page_number'], doc.get('page_end', doc['page_number']),
+                       doc['position'], offset, len(encoded),
+                       np.frombuffer(content_hash(doc['context']), dtype=np.uint8))
+            encoded_texts.append(encoded)
+            offset += len(encoded)
+
+        header = {
+            'version': FORMAT_VERSION,
+            'model': model,
+            'dimension': dimension,
+            'count': len(documents),
+            'chunking': chunking,
+            'documents': document_names,
+            'sources': sources or {},
+        }
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = path.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        vectors.tofile(os.path.join(tmp_path, VECTORS_FILE))
+        np.save(os.path.join(tmp_path, META_FILE), meta)
+        with open(os.path.join(tmp_path, TEXTS_FILE), 'wb') as f:
+            f.writelines(encoded_texts)
+        # The header goes last: a directory without one is never treated as a store
+        with open(os.path.join(tmp_path, HEADER_FILE), 'w', encoding='utf-8') as f:
+            json.dump(header, f, indent=2)
+
+        _swap_directory(tmp_path, path)
+        return cls(path)
+
+
+def _swap_directory(source: str, target: str) -> None:
+    """Move `source` into place at `target`, discarding whatever was there before."""
+    old_path: Optional[str] = None
+    if os.path.exists(target):
+        old_path = target.rstrip(os.sep) + '.old'
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(target, old_path)
+    os.replace(source, target)
+    if old_path:
+        shutil.rmtree(old_path, ignore_errors=True)
+
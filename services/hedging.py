@@ -0,0 +1,149 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.primary = 0
+        self.hedged = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.capped = 0
+
+
+class Hedger:
+    """
+    Races a duplicate request against a slow one.
+
+    `race` starts the primary request; if it has not produced its first output after `delay` seconds,
+    the same request goes to the backup endpoint and whichever answers first wins, the other is cancelled.
+    A primary that fails outright is replaced by the backup at once. Hedges are capped at `max_rate` of
+    the last `window` requests, so a slow endpoint cannot double the spend.
+
+    Delays normally come from a latency percentile of the primary endpoint (see `ModelRouter.percentile`);
+    `default_delay` is used until there are enough samples. Safe to share between threads and loops.
+    """
+
+    def __init__(self, max_rate: float = 0.1, window: int = 200, min_delay: float = 0.25,
+                 default_delay: float = 3.0):
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self._decisions: Deque[bool] = deque(maxlen=window)
+        self._endpoints: Dict[str, _EndpointStats] = {}
+        self._lock = threading.Lock()
+
+    def delay(self, percentile: Optional[float]) -> float:
+        return self.default_delay if percentile is None else max(self.min_delay, percentile)
+
+    def _stats(self, endpoint: str) -> _EndpointStats:
+        """Caller holds the lock."""
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = _EndpointStats()
+        return self._endpoints[endpoint]
+
+    def _allow(self, endpoint: str) -> bool:
+        with self._lock:
+            hedges = sum(self._decisions)
+            allowed = hedges + 1 <= self.max_rate * (len(self._decisions) + 1)
+            self._decisions.append(allowed)
+            if not allowed:
+                self._stats(endpoint).capped += 1
+            return allowed
+
+    async def race(self, primary: Callable[[], Awaitable[T]], backup: Callable[[], Awaitable[T]], delay: float,
+                   close: Callable[[T], Awaitable[None]], endpoints: Tuple[str, str]) -> Tuple[T, int]:
+        """
+        The result of whichever request answers first, and 0 for the primary or 1 for the backup.
+        `close` disposes of a losing result that completed anyway. Raises the last error if both fail.
+        """
+        with self._lock:
+            self._stats(endpoints[0]).primary += 1
+        first = asyncio.ensure_future(primary())
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            await self._discard(first, close)
+            raise
+        if done and first.exception() is None:
+            with self._lock:
+                self._decisions.append(False)
+            return first.result(), 0
+        if done:
+            # A failed primary is always retried on the backup, hedge or not
+            with self._lock:
+                self._decisions.append(False)
+            return await backup(), 1
+        if not self._allow(endpoints[0]):
+            try:
+                return await first, 0
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                return await backup(), 1
+
+        with self._lock:
+            self._stats(endpoints[0]).hedged += 1
+            self._stats(endpoints[1]).hedges_sent += 1
+        tasks = [first, asyncio.ensure_future(backup())]
+        winner = None
+        try:
+            pending = set(tasks)
+            error = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task in done and task.exception() is None and winner is None:
+                        winner = task
+                    elif task in done:
+                        error = task.exception() or error
+            if winner is None:
+                raise error
+            index = tasks.index(winner)
+            with self._lock:
+                if index:
+                    self._stats(endpoints[1]).hedge_wins += 1
+                else:
+                    self._stats(endpoints[0]).primary_wins += 1
+            return winner.result(), index
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    await self._discard(task, close)
+
+    @staticmethod
+    async def _discard(task: asyncio.Future, close: Callable[[T], Awaitable[None]]) -> None:
+        """Cancel a losing request; one that finished anyway holds resources that `close` releases."""
+        task.cancel()
+        try:
+            result = await task
+        except BaseException:
+            return
+        await close(result)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            decisions = len(self._decisions)
+            return {
+                'hedge_rate': round(sum(self._decisions) / decisions, 4) if decisions else 0.0,
+                'endpoints': {endpoint: dict(vars(stats)) for endpoint, stats in self._endpoints.items()},
+            }
+
+
+_default_hedger: Optional[Hedger] = None
+_default_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Hedger:
+    """The process-wide hedger; DUCKY_HEDGE_MAX_RATE caps the share of requests that get a hedge."""
+    global _default_hedger
+    with _default_hedger_lock:
+        if _default_hedger is None:
+            _default_hedger = Hedger(max_rate=float(os.getenv('DUCKY_HEDGE_MAX_RATE', '0.1')))
+        return _default_hedger
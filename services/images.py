@@ -1,3 +1,4 @@
+import asyncio
 import os
 from datetime import datetime
 from typing import Literal, Tuple
@@ -5,7 +6,10 @@ from urllib.parse import urlparse
 import httpx
 import pandas as pd
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from services.clients import get_client
+from services.scheduler import INTERACTIVE, get_scheduler
+from services.telemetry import get_telemetry
 
 # Load .env file
 load_dotenv()
@@ -84,20 +88,21 @@ async def generate_image(
         # 確保儲存資料夾存在
         os.makedirs(__IMAGES_BASE_FOLDER, exist_ok=True)
         
-        # 初始化 OpenAI 客戶端
-        client = OpenAI(
-        api_key=os.getenv('OPENAI_API_KEY'),
-        base_url=os.getenv('OPENAI_API_BASE_URL'))
+        # 共用的 OpenAI 客戶端（連線池）
+        client = get_client()
         
-        # 生成圖片 - 這裡使用同步調用
-        response = client.images.generate(
-            model=model,
-            prompt=prompt,
-            size=size,
-            quality=quality,
-            style=style,
-            n=1
-        )
+        # 生成圖片 - 經由排程器取得名額（等待時不阻塞事件迴圈），同步調用放在執行緒上，並記錄耗時
+        async with get_scheduler().aslot(INTERACTIVE):
+            with get_telemetry().measure('image', 'images', model, client.base_url, size=size, quality=quality):
+                response = await asyncio.to_thread(
+                    client.images.generate,
+                    model=model,
+                    prompt=prompt,
+                    size=size,
+                    quality=quality,
+                    style=style,
+                    n=1
+                )
         
         # 獲取圖片 URL
         image_url = response.data[0].url
@@ -0,0 +1,153 @@
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from services.embedding_store import EmbeddingStore
+
+LEXICAL_FILE = "lexical.npz"
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+_STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from has have how i if in into is it its me my of on or so
+    than that the their them then there these they this to was we were what when where which who why will
+    with you your
+""".split())
+
+
+def _stem(term: str) -> str:
+    """Very light plural folding so "bullets" matches "bullet"; acronyms like DRY are untouched."""
+    if len(term) > 3 and term.endswith('s') and not term.endswith('ss'):
+        return term[:-1]
+    return term
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word terms with stop words removed."""
+    return [_stem(term) for term in _TOKEN.findall(text.lower()) if term not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index.
+
+    Postings are stored CSR-style: the postings of term `t` are `doc_ids[offsets[t]:offsets[t + 1]]`,
+    with the per-posting BM25 weight (term frequency and length normalization, without IDF) precomputed.
+    """
+
+    def __init__(self, vocabulary: Dict[str, int], offsets: np.ndarray, doc_ids: np.ndarray,
+                 weights: np.ndarray, idf: np.ndarray, count: int):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75) -> 'BM25Index':
+        """Build the index over texts; the row order matches the embedding store."""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        count = len(lengths)
+        lengths = np.array(lengths, dtype=np.float32)
+        average_length = float(lengths.mean()) if count and lengths.mean() else 1.0
+
+        vocabulary = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        doc_ids = []
+        tfs = []
+        for term in sorted(postings):
+            term_postings = postings[term]
+            offsets[vocabulary[term] + 1] = len(term_postings)
+            doc_ids.extend(doc_id for doc_id, _ in term_postings)
+            tfs.extend(tf for _, tf in term_postings)
+        offsets = np.cumsum(offsets)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        tfs = np.array(tfs, dtype=np.float32)
+
+        norms = k1 * (1 - b + b * lengths[doc_ids] / average_length) if len(doc_ids) else tfs
+        weights = (tfs * (k1 + 1) / (tfs + norms)).astype(np.float32)
+        document_frequency = np.diff(offsets).astype(np.float32)
+        idf = np.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        return cls(vocabulary, offsets, doc_ids, weights, idf, count)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for a query."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term, query_tf in Counter(tokenize(query)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            # A term appears at most once per row in its postings, so plain fancy-index addition is safe
+            scores[self.doc_ids[start:stop]] += query_tf * self.idf[term_id] * self.weights[start:stop]
+        return scores
+
+    def search(self, query: str, top_k: int = 3, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the indices and BM25 scores of the best `top_k` rows with a positive score, best first."""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        order = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return order, scores[order]
+
+    def save(self, path: str) -> None:
+        terms = np.array(sorted(self.vocabulary, key=self.vocabulary.get), dtype=np.str_)
+        np.savez(path, terms=terms, offsets=self.offsets, doc_ids=self.doc_ids, weights=self.weights,
+                 idf=self.idf, count=np.array(self.count))
+
+    @classmethod
+    def load(cls, path: str) -> 'BM25Index':
+        with np.load(path) as data:
+            vocabulary = {str(term): i for i, term in enumerate(data['terms'])}
+            return cls(vocabulary, data['offsets'], data['doc_ids'], data['weights'], data['idf'],
+                       int(data['count']))
+
+
+# Shared by every session in the server process, like the vector indexes
+_indexes: Dict[str, Tuple[Tuple[int, int], BM25Index]] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(store: EmbeddingStore) -> BM25Index:
+    """
+    Return the process-wide BM25 index for a store.
+
+    The index is loaded from the store directory, or built from the chunk texts and saved there
+    if the store does not have one yet.
+    """
+    key = os.path.abspath(store.path)
+    signature = store.signature()
+
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        path = os.path.join(store.path, LEXICAL_FILE)
+        if os.path.exists(path):
+            index = BM25Index.load(path)
+        else:
+            index = BM25Index.build(store.text(i) for i in range(len(store)))
+            # Save under a temporary name first so other processes never load a partial file
+            tmp_path = os.path.join(store.path, "lexical.tmp.npz")
+            index.save(tmp_path)
+            os.replace(tmp_path, path)
+        _indexes[key] = (signature, index)
+        return index
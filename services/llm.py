@@ -1,23 +1,59 @@
+import asyncio
 import os
+import time
 import traceback
-from typing import List, Dict, AsyncGenerator, Tuple
+from typing import List, Dict, AsyncGenerator, Tuple, Optional
 
 import openai
-from openai import AsyncOpenAI
 
 from dotenv import load_dotenv
-from openai import OpenAIError, OpenAI
+from openai import OpenAIError, APIConnectionError, APITimeoutError, BadRequestError, InternalServerError, \
+    RateLimitError
+
+from aitools_autogen.config import config_list_openai
+from services import prompts
+from services.clients import get_async_client, get_client, get_registry
+from services.conversation import count_message_tokens, count_tokens
+from services.llm_cache import get_llm_cache, request_key
+from services.hedging import get_hedger
+from services.routing import get_model_router
+from services.scheduler import BACKGROUND, INTERACTIVE, VOICE, get_scheduler
+from services.telemetry import get_telemetry
 
 # Load .env file
 load_dotenv()
 
 
 openai_model = os.getenv('OPENAI_API_MODEL')
+# Identical requests are answered from data/cache/llm for DUCKY_LLM_CACHE_TTL seconds (default a day),
+# unless DUCKY_LLM_CACHE=0
+cache_enabled = os.getenv('DUCKY_LLM_CACHE', '1') != '0'
+# With DUCKY_MODEL_ROUTING=1, each request goes to DEFAULT_MODEL or FAST_MODEL on the endpoints of config_list_openai
+# (aitools_autogen/config.py), falling back along it; otherwise everything goes to OPENAI_API_MODEL at
+# OPENAI_API_BASE_URL
+routing_enabled = os.getenv('DUCKY_MODEL_ROUTING', '0') == '1'
+# With DUCKY_HEDGE=1, an interactive or voice request that is slower than this percentile of its endpoint's recent
+# time to first token is duplicated to the same model on another endpoint; the first to answer wins. The other
+# endpoint is taken from the replicas in DUCKY_HEDGE_BASE_URLS (comma-separated, same API key), then from the
+# entries of config_list_openai serving the model
+hedging_enabled = os.getenv('DUCKY_HEDGE', '0') == '1'
+HEDGE_PERCENTILE = float(os.getenv('DUCKY_HEDGE_PERCENTILE', '95'))
+hedge_base_urls = [url.strip() for url in os.getenv('DUCKY_HEDGE_BASE_URLS', '').split(',') if url.strip()]
+# Errors after which the next model is tried
+FALLBACK_ERRORS = (APITimeoutError, APIConnectionError, InternalServerError, RateLimitError)
+# Streams ask the endpoint for their token usage (stream_options); unless DUCKY_STREAM_USAGE=0, or the endpoint
+# rejects it, in which case the response is counted with tiktoken
+stream_usage_enabled = os.getenv('DUCKY_STREAM_USAGE', '1') != '0'
+_no_stream_usage = set()  # base URLs that rejected stream_options
+
+
+def _prompt_tokens(messages: List[Dict[str, str]], model: str = None) -> int:
+    return count_message_tokens(messages, model or openai_model or "gpt-3.5-turbo")
 
-def converse_sync(prompt: str, messages: List[Dict[str, str]], model="gpt-3.5-turbo") -> Tuple[str, List[Dict[str, str]]]:
-    client = OpenAI(
-        api_key=os.getenv('OPENAI_API_KEY'),
-        base_url=os.getenv('OPENAI_API_BASE_URL'))
+
+def converse_sync(prompt: str, messages: List[Dict[str, str]], model="gpt-3.5-turbo",
+                  cache: bool = True) -> Tuple[str, List[Dict[str, str]]]:
+    client = get_client()
 
     # Add the user's message to the list of messages
     if messages is None:
@@ -25,42 +61,394 @@ def converse_sync(prompt: str, messages: List[Dict[str, str]], model="gpt-3.5-tu
 
     messages.append({"role": "user", "content": prompt})
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-    ).choices[0].message.content
+    key = request_key(base_url=client.base_url, model=model, messages=messages)
+    cached = get_llm_cache().get(key) if cache and cache_enabled else None
+    if cached is not None:
+        response = "".join(cached)
+    else:
+        # No max_tokens is sent, so reserve about as much again as the prompt until the usage is known
+        estimate = 2 * _prompt_tokens(messages, model)
+        with get_scheduler().slot(INTERACTIVE, estimate) as lease, \
+                get_telemetry().measure('chat', model=model, endpoint=client.base_url, stream=False) as sample:
+            completion = client.chat.completions.create(
+                model=model,
+                messages=messages,
+            )
+            lease.used(completion.usage.total_tokens if completion.usage else estimate)
+            if completion.usage:
+                sample.update(prompt_tokens=completion.usage.prompt_tokens,
+                              completion_tokens=completion.usage.completion_tokens, usage='api')
+        response = completion.choices[0].message.content
+        if cache and cache_enabled and response:
+            get_llm_cache().put(key, [response], model)
 
     # Add the assistant's message to the list of messages
     messages.append({"role": "assistant", "content": response})
 
     return response, messages
 
-async def converse(messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+async def converse(messages: List[Dict[str, str]], cache: bool = True, priority: str = INTERACTIVE,
+                   hints: Optional[Dict[str, str]] = None,
+                   answered: Optional[Dict[str, str]] = None,
+                   candidates: Optional[List[Dict]] = None) -> AsyncGenerator[str, None]:
     """
     Given a conversation history, generate an iterative response of strings from the OpenAI API.
 
     :param messages: a conversation history with the following format:
     `[ { "role": "user", "content": "Hello, how are you?" },
        { "role": "assistant", "content": "I am doing well, how can I help you today?" } ]`
+    :param cache: replay an identical earlier request from the response cache, and store this one;
+    pass False when a fresh completion is wanted
+    :param priority: the scheduler class the request waits in, see services.scheduler
+    :param hints: what the request is for (page, learner level, format), used to pick the model
+    :param answered: if given, its `model` is set to the model that answered, once one has
+    :param candidates: the result of `route` for this request, if the caller already has it
 
     :return: a generator of delta string responses
     """
-    aclient = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'),
-                          base_url=os.getenv('OPENAI_API_BASE_URL'))
+    candidates = candidates or route(messages, hints)
+    max_tokens = 1600
+    cache = cache and cache_enabled
+    aclient = get_async_client(candidates[0]['base_url'], candidates[0]['api_key'])
+    key = request_key(base_url=aclient.base_url, model=candidates[0]['model'], messages=messages,
+                      max_tokens=max_tokens)
+    page = (hints or {}).get('page')
+    cached = get_llm_cache().get(key) if cache else None
+    if cached is not None:
+        get_telemetry().record('chat', page, candidates[0]['model'], aclient.base_url, priority=priority, cached=True)
+        if answered is not None:
+            answered['model'] = candidates[0]['model']
+        for chunk in cached:
+            yield chunk
+        return
+
+    _count(candidates[0])
+    # What the completion learns about itself, for the telemetry sample
+    outcome = {}
+
+    async def completion():
+        attempt, index = await _first_attempt(candidates, messages, priority, _prompt_tokens(messages) + max_tokens,
+                                              stream=True, max_tokens=max_tokens)
+        outcome.update(candidate=attempt.candidate, fallback=index > 0, queue_wait=attempt.queue_wait,
+                       model_ttft=attempt.first_token)
+        if answered is not None:
+            answered['model'] = attempt.candidate['model']
+        try:
+            usage = attempt.usage
+            text = []
+            if attempt.first:
+                text.append(attempt.first)
+                yield attempt.first
+            try:
+                async for chunk in attempt.chunks:
+                    # With stream_options, the last chunk has no choices and carries the usage
+                    usage = chunk.usage or usage
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        text.append(content)
+                        yield content
+            except StopAsyncIteration:
+                pass
+            except Exception:
+                _record(attempt.candidate, ok=False)
+                raise
+            _record(attempt.candidate, ok=True, first_token=attempt.first_token,
+                    total=time.monotonic() - attempt.started, fallback=index > 0)
+            if usage is not None:
+                outcome.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+                               usage='api')
+            else:
+                outcome.update(prompt_tokens=attempt.prompt_tokens, usage='estimate',
+                               completion_tokens=_completion_tokens("".join(text), attempt.candidate))
+            attempt.lease.used(outcome['prompt_tokens'] + outcome['completion_tokens'])
+        finally:
+            await attempt.close()
+
+    chunks = []
+    started = time.monotonic()
+    first_token = None
+    error = None
     try:
-        async for chunk in await aclient.chat.completions.create(model=openai_model,
-                                                                 messages=messages,
-                                                                 max_tokens=1600,
-                                                                 stream=True):
-            content = chunk.choices[0].delta.content
-            if content:
-                yield content
+        # The request runs on the shared clients' loop so it reuses pooled connections
+        async for content in get_registry().stream(completion()):
+            if first_token is None:
+                first_token = time.monotonic() - started
+            chunks.append(content)
+            yield content
 
     except OpenAIError as e:
+        error = e
         traceback.print_exc()
         yield f"oaiEXCEPTION {str(e)}"
+        return
     except Exception as e:
+        error = e
         yield f"EXCEPTION {str(e)}"
+        return
+    finally:
+        _report_stream(page, priority, candidates, messages, outcome, chunks, started, first_token, error)
+
+    # Only complete responses from the first choice are stored; a consumer that stops early never gets here
+    if cache and chunks and outcome.get('fallback') is False:
+        get_llm_cache().put(key, chunks, candidates[0]['model'])
+
+
+def _completion_tokens(text: str, candidate: Dict) -> int:
+    """Tokens of a response whose usage the endpoint did not report."""
+    return count_tokens(text, candidate['model'] or openai_model or "gpt-3.5-turbo")
+
+
+def _report_stream(page: Optional[str], priority: str, candidates: List[Dict], messages: List[Dict[str, str]],
+                   outcome: Dict, chunks: List[str], started: float, first_token: Optional[float],
+                   error: Optional[Exception]) -> None:
+    """Record the telemetry sample of a streamed response that finished, failed or was abandoned by its reader."""
+    outcome = dict(outcome)
+    candidate = outcome.pop('candidate', candidates[0])
+    finished = 'usage' in outcome
+    if not finished:
+        # Only what arrived can be counted
+        outcome.update(prompt_tokens=_prompt_tokens(messages), usage='estimate',
+                       completion_tokens=_completion_tokens("".join(chunks), candidate))
+    get_telemetry().record('chat', page, candidate['model'], _base_url(candidate), priority=priority, stream=True,
+                           ok=error is None, error=type(error).__name__ if error else None, finished=finished,
+                           ttft=first_token, duration=time.monotonic() - started, **outcome)
+
+
+def route(messages: List[Dict[str, str]], hints: Optional[Dict[str, str]] = None,
+          model: Optional[str] = None) -> List[Dict]:
+    """
+    Endpoints and models to try for a request, best first. Has no side effects, so a caller can look the
+    request up in a cache under the first model and then pass the same list to `converse`.
+    """
+    if not routing_enabled:
+        return [{'base_url': os.getenv('OPENAI_API_BASE_URL'), 'api_key': os.getenv('OPENAI_API_KEY'),
+                 'model': model or openai_model}]
+    return get_model_router().route(messages, hints)
+
+
+def _count(candidate: Dict) -> None:
+    """Count a request that is about to be sent, i.e. not answered from a cache."""
+    if routing_enabled:
+        get_model_router().count(candidate)
+
+
+def _record(candidate: Dict, **outcome) -> None:
+    # Kept with routing off too: hedging delays come from the same latency percentiles
+    get_model_router().record(candidate, **outcome)
+
+
+def _same_url(a: Optional[str], b: Optional[str]) -> bool:
+    return (a or '').rstrip('/') == (b or '').rstrip('/')
+
+
+def _hedge_backup(candidate: Dict) -> Optional[Dict]:
+    """The same model on another endpoint, to hedge a slow request to `candidate` with; None if there is none."""
+    for base_url in hedge_base_urls:
+        if not _same_url(base_url, candidate['base_url']):
+            return {**candidate, 'base_url': base_url}
+    for entry in config_list_openai:
+        if entry['model'] == candidate['model'] and not _same_url(entry.get('base_url'), candidate['base_url']):
+            return entry
+    return None
+
+
+def _check_hedging() -> None:
+    """Hedging to the same endpoint would only double the load on it, so it needs another one."""
+    endpoints = config_list_openai if routing_enabled else route([])
+    if hedging_enabled and not any(_hedge_backup(candidate) for candidate in endpoints):
+        print("DUCKY_HEDGE=1, but no other endpoint serves the same model; requests will not be hedged. "
+              "List replicas in DUCKY_HEDGE_BASE_URLS.")
+
+
+_check_hedging()
+
+
+class _Attempt:
+    """A request to one candidate that has started answering, holding its scheduler slot until closed."""
+
+    def __init__(self, candidate: Dict, slot, lease, prompt_tokens: int):
+        self.candidate = candidate
+        self.prompt_tokens = prompt_tokens
+        self.lease = lease
+        self.started = time.monotonic()
+        self.queue_wait = 0.0
+        self.first_token = None
+        self.usage = None
+        self.stream = None
+        self.chunks = None
+        self.first = None
+        self.response = None
+        self._slot = slot
+
+    async def close(self) -> None:
+        if self._slot is None:
+            return
+        slot, self._slot = self._slot, None
+        try:
+            if self.stream is not None:
+                await self.stream.close()
+        finally:
+            await slot.__aexit__(None, None, None)
+
+
+async def _open(candidate: Dict, messages: List[Dict[str, str]], priority: str, tokens: int,
+                timeout: Optional[float], stream: bool, **params) -> _Attempt:
+    """
+    Send a request and wait for its first content (the whole response if not streaming), at most `timeout`
+    seconds. Failures and timeouts are recorded for the router and raised.
+    """
+    client = get_async_client(candidate['base_url'], candidate['api_key'])
+    if timeout is not None:
+        # The next model is a better retry than the same one
+        client = client.with_options(max_retries=0)
+    base_url = str(client.base_url)
+    if stream and stream_usage_enabled and base_url not in _no_stream_usage:
+        params = {**params, 'stream_options': {'include_usage': True}}
+
+    def send(request_params: Dict):
+        return asyncio.wait_for(client.chat.completions.create(model=candidate['model'], messages=messages,
+                                                               stream=stream, **request_params), timeout)
+
+    requested = time.monotonic()
+    slot = get_scheduler().aslot(priority, tokens)
+    attempt = _Attempt(candidate, slot, await slot.__aenter__(), tokens - params.get('max_tokens', 0))
+    attempt.started = time.monotonic()
+    attempt.queue_wait = attempt.started - requested
+    try:
+        try:
+            response = await send(params)
+        except BadRequestError as e:
+            if 'stream_options' not in params or 'stream_options' not in str(e):
+                raise
+            print(f"{base_url} does not report usage on streams; counting tokens locally")
+            _no_stream_usage.add(base_url)
+            response = await send({key: value for key, value in params.items() if key != 'stream_options'})
+        if not stream:
+            attempt.response = response
+        else:
+            attempt.stream = response
+            attempt.chunks = attempt.stream.__aiter__()
+            try:
+                while not attempt.first:
+                    remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - attempt.started))
+                    chunk = await asyncio.wait_for(attempt.chunks.__anext__(), remaining)
+                    attempt.usage = chunk.usage or attempt.usage
+                    attempt.first = chunk.choices[0].delta.content if chunk.choices else None
+            except StopAsyncIteration:
+                # The stream ended without any content
+                pass
+        attempt.first_token = time.monotonic() - attempt.started
+    except BaseException as e:
+        await attempt.close()
+        if isinstance(e, (asyncio.TimeoutError, *FALLBACK_ERRORS)):
+            _record(candidate, ok=False, timeout=isinstance(e, (asyncio.TimeoutError, APITimeoutError)))
+        raise
+    return attempt
+
+
+def _base_url(candidate: Dict) -> str:
+    return str(get_async_client(candidate['base_url'], candidate['api_key']).base_url)
+
+
+def _endpoint(candidate: Dict) -> str:
+    return f"{candidate['model']}@{candidate['base_url']}"
+
+
+async def _first_attempt(candidates: List[Dict], messages: List[Dict[str, str]], priority: str, tokens: int,
+                         stream: bool, **params) -> Tuple[_Attempt, int]:
+    """
+    Open the request on the first candidate that answers, and return it with that candidate's index.
+
+    A candidate that fails or does not start answering within its first-token timeout is replaced by the
+    next one. With hedging on, a slow interactive or voice request is also duplicated to the same model on
+    another endpoint (`_hedge_backup`) and the first to answer wins; the winner is returned as the candidate.
+    """
+    index = 0
+    while True:
+        candidate = candidates[index]
+        last = index == len(candidates) - 1
+
+        def timeout(endpoint: Dict) -> Optional[float]:
+            # The last candidate left gets the client's own timeout
+            if not routing_enabled or last:
+                return None
+            return get_model_router().first_token_timeout(endpoint, stream)
+
+        try:
+            backup = _hedge_backup(candidate) if hedging_enabled and priority in (INTERACTIVE, VOICE) else None
+            if backup is not None:
+                delay = get_hedger().delay(get_model_router().percentile(candidate, HEDGE_PERCENTILE, stream))
+                attempt, _ = await get_hedger().race(
+                    lambda: _open(candidate, messages, priority, tokens, timeout(candidate), stream, **params),
+                    lambda: _open(backup, messages, priority, tokens, timeout(backup), stream, **params),
+                    delay, lambda result: result.close(), (_endpoint(candidate), _endpoint(backup)))
+                return attempt, index
+            return await _open(candidate, messages, priority, tokens, timeout(candidate), stream, **params), index
+        except (asyncio.TimeoutError, *FALLBACK_ERRORS) as e:
+            if last:
+                raise
+            print(f"{candidate['model']} at {candidate['base_url']} failed ({type(e).__name__}), "
+                  f"falling back to {candidates[index + 1]['model']}")
+            index += 1
+
+
+async def complete(messages: List[Dict[str, str]], hints: Optional[Dict[str, str]] = None,
+                   priority: str = INTERACTIVE, model: Optional[str] = None, **params):
+    """
+    A non-streaming chat completion, routed, rate limited, and with fallback and hedging like `converse`.
+
+    :param model: the model to use when routing is off; OPENAI_API_MODEL if not given
+    :param params: further request parameters such as `max_tokens` and `temperature`
+    :return: the ChatCompletion
+    """
+    candidates = route(messages, hints, model)
+    _count(candidates[0])
+    tokens = _prompt_tokens(messages) + params.get('max_tokens', 1000)
+    page = (hints or {}).get('page')
+    started = time.monotonic()
+    try:
+        attempt, index = await _first_attempt(candidates, messages, priority, tokens, stream=False, **params)
+    except Exception as e:
+        get_telemetry().record('chat', page, candidates[0]['model'], _base_url(candidates[0]), priority=priority,
+                               stream=False, ok=False, error=type(e).__name__, duration=time.monotonic() - started)
+        raise
+    try:
+        response = attempt.response
+        _record(attempt.candidate, ok=True, total=attempt.first_token, fallback=index > 0)
+        usage = response.usage
+        if usage is None:
+            content = response.choices[0].message.content if response.choices else None
+            usage = {'prompt_tokens': attempt.prompt_tokens, 'usage': 'estimate',
+                     'completion_tokens': _completion_tokens(content or "", attempt.candidate)}
+        else:
+            usage = {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens, 'usage': 'api'}
+        attempt.lease.used(usage['prompt_tokens'] + usage['completion_tokens'])
+        get_telemetry().record('chat', page, attempt.candidate['model'], _base_url(attempt.candidate),
+                               priority=priority, stream=False, fallback=index > 0, queue_wait=attempt.queue_wait,
+                               duration=time.monotonic() - started, **usage)
+        return response
+    finally:
+        await attempt.close()
+
+
+def complete_sync(messages: List[Dict[str, str]], hints: Optional[Dict[str, str]] = None,
+                  priority: str = INTERACTIVE, model: Optional[str] = None, **params):
+    """`complete` for blocking callers; runs on the shared clients' loop."""
+    return get_registry().run(complete(messages, hints, priority, model, **params))
+
+
+def summarize_conversation(previous_summary: str, messages: List[Dict[str, str]], max_tokens: int = 400) -> str:
+    """
+    Fold older conversation messages into a running summary. Blocking; meant to run off the request path.
+
+    :param previous_summary: the summary so far, possibly empty
+    :param messages: the messages to fold in, oldest first
+    :return: the updated summary
+    """
+    transcript = "\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    request = [{"role": "user", "content": prompts.conversation_summary_prompt(previous_summary, transcript)}]
+    response = complete_sync(request, {"page": "summary"}, BACKGROUND, max_tokens=max_tokens)
+    return response.choices[0].message.content.strip()
 
 
 def create_conversation_starter(user_prompt: str) -> List[Dict[str, str]]:
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from services.disk_cache import FileLRU, Shared
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data/cache/llm')
+
+
+def request_key(**request) -> str:
+    """
+    Canonical hash of a completion request: model, messages and every parameter that affects the output.
+
+    Keys are sorted and separators fixed, so equal requests hash equally whatever order they were built in.
+    """
+    canonical = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Content-addressed store of completed LLM responses, one JSON file per request hash.
+
+    A response is stored as the list of chunks it streamed in, so a hit can be replayed through the same
+    generator interface. The directory is bounded by `max_bytes`, evicting the least recently read
+    files (see services.disk_cache.FileLRU). A response older than `ttl` seconds is a miss and is
+    deleted, so a model updated behind the same name isn't answered for by its old responses for long.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_DIR, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._files = FileLRU(path, '.json', max_bytes)
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """The chunks of a stored response, or None."""
+        name = f"{key}.json"
+        data = self._files.read(name)
+        chunks, expired = None, False
+        if data is not None:
+            try:
+                entry = json.loads(data)
+                chunks = entry['chunks']
+                expired = entry.get('created', 0) < time.time() - self.ttl
+            except (ValueError, KeyError):
+                pass
+            if chunks is None or expired:
+                self._files.remove(name)
+        with self._lock:
+            if chunks is None or expired:
+                self.misses += 1
+                self.expirations += expired
+                return None
+            self.hits += 1
+        return chunks
+
+    def put(self, key: str, chunks: List[str], model: Optional[str] = None) -> None:
+        data = json.dumps({'key': key, 'model': model, 'created': time.time(), 'chunks': chunks},
+                          ensure_ascii=False).encode('utf-8')
+        self._files.write(f"{key}.json", data)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self._files.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._files),
+                'bytes': self._files.bytes,
+            }
+
+
+_default_cache: Shared[LLMResponseCache] = Shared()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """The process-wide LLM response cache; responses expire after DUCKY_LLM_CACHE_TTL seconds (default a day)."""
+    return _default_cache.get(lambda: LLMResponseCache(ttl=float(os.getenv('DUCKY_LLM_CACHE_TTL', str(24 * 3600)))))
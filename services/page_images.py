@@ -0,0 +1,221 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from services.disk_cache import FileLRU, MemoryLRU, Shared
+from services.pdf_text import page_count
+
+DEFAULT_IMAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data/cache/pages')
+
+
+def _render_pages(pdf_path: str, first_page: int, last_page: int, dpi: int) -> List[Image.Image]:
+    """Rasterize a range of pages with poppler, one process for the whole range."""
+    from pdf2image import convert_from_path
+
+    return convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+
+
+class PageImageCache:
+    """
+    Rendered PDF pages as WebP bytes, keyed by (PDF content hash, page, dpi).
+
+    Pages live in a directory bounded by `max_disk_bytes`, evicting the least recently read files
+    (see services.disk_cache.FileLRU), with the most recent ones also kept in memory up to
+    `max_memory_bytes`. `prerender` fills the cache on a background thread, so showing a page is
+    usually a dictionary or file read rather than a poppler run. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_IMAGE_DIR, dpi: int = 110, quality: int = 80,
+                 max_disk_bytes: int = 256 * 1024 * 1024, max_memory_bytes: int = 32 * 1024 * 1024,
+                 pages_per_render: int = 8,
+                 render: Callable[[str, int, int, int], List[Image.Image]] = _render_pages):
+        self.path = path
+        self.dpi = dpi
+        self.quality = quality
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.pages_per_render = pages_per_render
+        self.render = render
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+
+        self._memory = MemoryLRU(max_bytes=max_memory_bytes)
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        self._pending: Dict[Tuple[str, int], Future] = {}
+        self._lock = threading.Lock()
+        # One background renderer: poppler is CPU heavy and shouldn't compete with the sessions.
+        # A second one serves urgent pages (just cited by an answer) ahead of the background queue.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-render")
+        self._urgent_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-render-urgent")
+        self._files = FileLRU(path, '.webp', max_disk_bytes)
+
+    def pdf_hash(self, pdf_path: str) -> str:
+        """Content hash of a PDF, recomputed only when its size or mtime changes."""
+        stat = os.stat(pdf_path)
+        key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(key)
+        if cached is not None:
+            return cached
+        digest = hashlib.blake2b(digest_size=16)
+        with open(pdf_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        with self._lock:
+            self._hashes[key] = digest.hexdigest()
+        return digest.hexdigest()
+
+    def _name(self, pdf_hash: str, page_number: int) -> str:
+        return f"{pdf_hash}-{page_number}-{self.dpi}.webp"
+
+    def _lookup(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(name)
+            if data is not None:
+                self.memory_hits += 1
+                return data
+        data = self._files.read(name)
+        if data is None:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._memory.put(name, data)
+        return data
+
+    def _store(self, name: str, image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format='WEBP', quality=self.quality, method=4)
+        data = buffer.getvalue()
+
+        evicted = self._files.write(name, data)
+        with self._lock:
+            self._memory.put(name, data)
+            for stale in evicted:
+                self._memory.pop(stale)
+        return data
+
+    def _render_range(self, pdf_path: str, pdf_hash: str, first_page: int, last_page: int) -> None:
+        with self._lock:
+            # Pages may have been rendered on demand while this range waited in the queue
+            missing = [page for page in range(first_page, last_page + 1)
+                       if self._name(pdf_hash, page) not in self._files]
+        if not missing:
+            return
+        first_page, last_page = missing[0], missing[-1]
+        started = time.perf_counter()
+        images = self.render(pdf_path, first_page, last_page, self.dpi)
+        for page_number, image in enumerate(images, start=first_page):
+            self._store(self._name(pdf_hash, page_number), image)
+        with self._lock:
+            self.renders += len(images)
+        print(f"Rendered pages {first_page}-{last_page} of {os.path.basename(pdf_path)} "
+              f"in {time.perf_counter() - started:.2f}s")
+
+    def _render_task(self, pdf_path: str, pdf_hash: str, first_page: int, last_page: int) -> None:
+        try:
+            self._render_range(pdf_path, pdf_hash, first_page, last_page)
+        except Exception as e:
+            print(f"Rendering pages {first_page}-{last_page} of {pdf_path} failed: {e}")
+            raise
+
+    def _release(self, future: Future, keys: List[Tuple[str, int]]) -> None:
+        with self._lock:
+            for key in keys:
+                # An urgent render may have taken over some of the pages
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+
+    def _submit(self, pdf_path: str, pdf_hash: str, first_page: int, last_page: int, urgent: bool = False) -> None:
+        """Queue a render of the pages in the range that are neither cached nor already queued."""
+        with self._lock:
+            missing = []
+            for page in range(first_page, last_page + 1):
+                pending = self._pending.get((pdf_hash, page))
+                # Urgent renders don't wait behind pages that are only queued in the background
+                queued = pending is not None and (not urgent or pending.running())
+                if self._name(pdf_hash, page) not in self._files and not queued:
+                    missing.append(page)
+            if not missing:
+                return
+            executor = self._urgent_executor if urgent else self._executor
+            future = executor.submit(self._render_task, pdf_path, pdf_hash, missing[0], missing[-1])
+            keys = [(pdf_hash, page_number) for page_number in range(missing[0], missing[-1] + 1)]
+            for key in keys:
+                self._pending[key] = future
+        future.add_done_callback(lambda done: self._release(done, keys))
+
+    def get(self, pdf_path: str, page_number: int) -> bytes:
+        """WebP bytes of one page (1-based), rendering it now if it isn't cached yet."""
+        pdf_hash = self.pdf_hash(pdf_path)
+        name = self._name(pdf_hash, page_number)
+        data = self._lookup(name)
+        if data is not None:
+            return data
+
+        with self._lock:
+            pending = self._pending.get((pdf_hash, page_number))
+        if pending is not None and pending.running():
+            # Being rendered in the background right now, possibly as part of a longer range.
+            # A page still waiting in the queue is rendered on its own instead.
+            try:
+                pending.result()
+            except Exception:
+                pass  # render it on its own below
+            data = self._lookup(name)
+            if data is not None:
+                return data
+
+        images = self.render(pdf_path, page_number, page_number, self.dpi)
+        if not images:
+            raise ValueError(f"Cannot convert page {page_number} of {pdf_path}")
+        with self._lock:
+            self.renders += 1
+        return self._store(name, images[0])
+
+    def prerender(self, pdf_path: str, pages: Optional[Iterable[int]] = None, urgent: bool = False) -> None:
+        """
+        Render pages in the background, in batches of `pages_per_render` consecutive pages.
+
+        Without `pages` the whole document is queued. Pages already cached or queued are skipped.
+        `urgent` pages go ahead of everything queued without it.
+        """
+        pdf_hash = self.pdf_hash(pdf_path)
+        if pages is None:
+            pages = range(1, page_count(pdf_path) + 1)
+        pages = sorted(set(pages))
+        batch: List[int] = []
+        for page_number in pages:
+            if batch and (page_number != batch[-1] + 1 or len(batch) == self.pages_per_render):
+                self._submit(pdf_path, pdf_hash, batch[0], batch[-1], urgent)
+                batch = []
+            batch.append(page_number)
+        if batch:
+            self._submit(pdf_path, pdf_hash, batch[0], batch[-1], urgent)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'renders': self.renders,
+                'evictions': self._files.evictions,
+                'pending_pages': len(self._pending),
+                'memory_bytes': self._memory.bytes,
+                'disk_bytes': self._files.bytes,
+                'files': len(self._files),
+            }
+
+
+_default_cache: Shared[PageImageCache] = Shared()
+
+
+def get_page_image_cache() -> PageImageCache:
+    """The process-wide page image cache."""
+    return _default_cache.get(PageImageCache)
@@ -0,0 +1,49 @@
+import concurrent.futures
+import multiprocessing
+import os
+from typing import Iterator, List, Optional
+
+from PyPDF2 import PdfReader
+
+# Kept free of heavy imports: every extraction worker process imports this module on start-up.
+
+
+def page_count(pdf_path: str) -> int:
+    """Number of pages in a PDF."""
+    with open(pdf_path, 'rb') as file:
+        return len(PdfReader(file).pages)
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) (zero-based). Runs inside a worker process."""
+    with open(pdf_path, 'rb') as file:
+        reader = PdfReader(file)
+        return [reader.pages[i].extract_text() or '' for i in range(start, stop)]
+
+
+def iter_page_texts(pdf_path: str, max_workers: Optional[int] = None,
+                    pages_per_shard: int = 16) -> Iterator[str]:
+    """
+    Yield the text of every page of a PDF, in page order.
+
+    Page ranges are extracted in parallel by a pool of worker processes, each opening the file itself.
+    Pages are yielded as soon as the shard holding them (and every shard before it) is done, so callers
+    can start chunking while later pages are still being extracted. Small documents are extracted inline.
+    """
+    total = page_count(pdf_path)
+    max_workers = min(max_workers or os.cpu_count() or 1, -(-total // pages_per_shard))
+    if max_workers <= 1:
+        yield from _extract_page_range(pdf_path, 0, total)
+        return
+
+    # Spawn rather than fork: the Streamlit server process is multi-threaded
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        shards = [pool.submit(_extract_page_range, pdf_path, start, min(start + pages_per_shard, total))
+                  for start in range(0, total, pages_per_shard)]
+        try:
+            for shard in shards:
+                yield from shard.result()
+        finally:
+            for shard in shards:
+                shard.cancel()
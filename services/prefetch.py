@@ -0,0 +1,250 @@
+import asyncio
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from services.clients import get_registry
+from services.embedding_cache import normalize_text
+
+# (learner level, response format)
+Variant = Tuple[str, str]
+
+
+class _Entry:
+    def __init__(self, expected_tokens: int):
+        self.future: Future = Future()
+        self.created = time.time()
+        self.reserved = expected_tokens
+        self.tokens = 0
+        self.served = False
+
+
+class VariantPrefetcher:
+    """
+    Generates the likely next variants of an answer (the same topic at another level or in another format)
+    in the background, so that switching to one of them renders at once.
+
+    After an answer, `prefetch` queues up to `variants` neighbouring variants, ranked by how often users
+    actually switched that way and otherwise by closeness (an adjacent level, or the same level in another
+    format). At most `max_concurrency` run at a time on the shared clients' loop, and they are only started
+    while the tokens spent on prefetching in the last hour, plus those expected for queued work, stay within
+    `tokens_per_hour`. Results are kept per topic for `ttl` seconds, for at most `max_topics` topics.
+
+    `stats()` reports the hit rate and the tokens spent on variants nobody asked for. Safe to share
+    between threads.
+    """
+
+    def __init__(self, levels: Sequence[str], formats: Sequence[str],
+                 generate: Callable[[str, str, str], Awaitable[Tuple[str, int]]],
+                 variants: int = 3, max_concurrency: int = 2, tokens_per_hour: int = 50000,
+                 ttl: float = 1800, max_topics: int = 200, max_queued: int = 6):
+        self.levels = list(levels)
+        self.formats = list(formats)
+        self.generate = generate
+        self.variants = variants
+        self.max_concurrency = max_concurrency
+        self.tokens_per_hour = tokens_per_hour
+        self.ttl = ttl
+        self.max_topics = max_topics
+        self.max_queued = max_queued
+
+        self.lookups = 0
+        self.hits = 0
+        self.late_hits = 0
+        self.queued = 0
+        self.completed = 0
+        self.dropped = 0
+        self.skipped_budget = 0
+        self.errors = 0
+        self.spent_tokens = 0
+        self.served_tokens = 0
+        self.wasted_tokens = 0
+
+        self._topics: OrderedDict[str, Dict[Variant, _Entry]] = OrderedDict()  # least recently used first
+        self._queue: Deque[Tuple[str, str, Variant, _Entry]] = deque()
+        self._running = 0
+        self._spent: Deque[Tuple[float, int]] = deque()  # (finished, tokens) of the last hour
+        self._switches: Counter = Counter()  # (from variant, to variant) -> times users switched that way
+        self._lock = threading.Lock()
+
+    def neighbours(self, level: str, response_format: str) -> List[Variant]:
+        """The other variants, most likely next first."""
+        level_index = self.levels.index(level) if level in self.levels else 0
+        current = (level, response_format)
+
+        def rank(variant: Variant):
+            distance = abs(self.levels.index(variant[0]) - level_index) + (variant[1] != response_format)
+            return -self._switches[(current, variant)], distance, variant[1] != response_format
+
+        others = [(other_level, other_format) for other_level in self.levels for other_format in self.formats
+                  if (other_level, other_format) != current]
+        return sorted(others, key=rank)
+
+    def get(self, topic: str, level: str, response_format: str,
+            previous: Optional[Tuple[str, str, str]] = None) -> Optional[Future]:
+        """
+        The prefetched answer for a variant: a future of (text, tokens) that is done, or still running.
+        None if it was never prefetched. `previous` is the (topic, level, format) the user saw last,
+        which teaches the ranking which switches are common.
+        """
+        key = normalize_text(topic).lower()
+        variant = (level, response_format)
+        with self._lock:
+            if previous is not None and normalize_text(previous[0]).lower() == key \
+                    and (previous[1], previous[2]) != variant:
+                self._switches[((previous[1], previous[2]), variant)] += 1
+            self.lookups += 1
+            self._expire()
+            entry = self._topics.get(key, {}).get(variant)
+            if entry is None or entry.future.cancelled():
+                return None
+            if entry.future.done() and entry.future.exception() is not None:
+                return None
+            self._topics.move_to_end(key)
+            if entry.future.done():
+                self.hits += 1
+                if not entry.served:
+                    self.served_tokens += entry.tokens
+            else:
+                self.late_hits += 1
+            entry.served = True
+            return entry.future
+
+    def prefetch(self, topic: str, level: str, response_format: str, response: str, tokens: int) -> int:
+        """
+        Keep an answer the user just got (`tokens` is what it cost) and queue its likely neighbours,
+        expecting each to cost about as much; returns how many were queued.
+        """
+        key = normalize_text(topic).lower()
+        queued = 0
+        with self._lock:
+            self._expire()
+            entries = self._topics.setdefault(key, {})
+            self._topics.move_to_end(key)
+            # Switching back to the answer on screen is served from here too
+            if (level, response_format) not in entries:
+                shown = entries[(level, response_format)] = _Entry(0)
+                shown.tokens = tokens
+                shown.served = True
+                shown.future.set_result((response, tokens))
+            for variant in self.neighbours(level, response_format):
+                if queued >= self.variants:
+                    break
+                if variant in entries:
+                    continue
+                if self._budget_used() + tokens > self.tokens_per_hour:
+                    self.skipped_budget += 1
+                    break
+                entry = entries[variant] = _Entry(tokens)
+                self._queue.append((key, topic, variant, entry))
+                queued += 1
+            self.queued += queued
+            # Older topics' unstarted work is dropped first when the queue is full
+            while len(self._queue) > self.max_queued:
+                old_key, _, old_variant, old_entry = self._queue.popleft()
+                old_entry.future.cancel()
+                self._topics.get(old_key, {}).pop(old_variant, None)
+                self.dropped += 1
+            while len(self._topics) > self.max_topics:
+                _, evicted = self._topics.popitem(last=False)
+                self._waste(evicted.values())
+            self._start()
+        return queued
+
+    def _budget_used(self) -> int:
+        """Tokens spent in the last hour plus those reserved by queued and running work; caller holds the lock."""
+        while self._spent and self._spent[0][0] < time.time() - 3600:
+            self._spent.popleft()
+        reserved = sum(entry.reserved for entries in self._topics.values() for entry in entries.values())
+        return sum(tokens for _, tokens in self._spent) + reserved
+
+    def _expire(self) -> None:
+        """Drop finished results older than `ttl`; caller holds the lock."""
+        cutoff = time.time() - self.ttl
+        for key in list(self._topics):
+            entries = self._topics[key]
+            expired = [variant for variant, entry in entries.items() if entry.created < cutoff and entry.future.done()]
+            self._waste(entries.pop(variant) for variant in expired)
+            if not entries:
+                del self._topics[key]
+
+    def _waste(self, entries) -> None:
+        for entry in entries:
+            if not entry.served:
+                self.wasted_tokens += entry.tokens
+            entry.future.cancel()
+
+    def _start(self) -> None:
+        """Start queued work up to the concurrency limit; caller holds the lock."""
+        loop = get_registry().loop()
+        while self._queue and self._running < self.max_concurrency:
+            key, topic, variant, entry = self._queue.popleft()
+            if not entry.future.set_running_or_notify_cancel():
+                continue
+            self._running += 1
+            asyncio.run_coroutine_threadsafe(self._run(topic, variant, entry), loop)
+
+    async def _run(self, topic: str, variant: Variant, entry: _Entry) -> None:
+        try:
+            text, tokens = await self.generate(variant[0], variant[1], topic)
+        except Exception as e:
+            print(f"Prefetching {variant} failed: {type(e).__name__}: {e}")
+            with self._lock:
+                self.errors += 1
+                entry.reserved = 0
+            entry.future.set_exception(e)
+        else:
+            with self._lock:
+                self.completed += 1
+                self.spent_tokens += tokens
+                self._spent.append((time.time(), tokens))
+                entry.reserved = 0
+                entry.tokens = tokens
+                # A user already waiting on this variant gets it, so it counts as served
+                if entry.served:
+                    self.served_tokens += tokens
+            entry.future.set_result((text, tokens))
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._start()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            found = self.hits + self.late_hits
+            return {
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'late_hits': self.late_hits,
+                'hit_rate': round(found / self.lookups, 4) if self.lookups else 0.0,
+                'queued': self.queued,
+                'completed': self.completed,
+                'dropped': self.dropped,
+                'skipped_budget': self.skipped_budget,
+                'errors': self.errors,
+                'running': self._running,
+                'spent_tokens': self.spent_tokens,
+                'served_tokens': self.served_tokens,
+                'wasted_tokens': self.wasted_tokens,
+                # Ready but not asked for yet; wasted if they expire that way
+                'unused_tokens': sum(entry.tokens for entries in self._topics.values()
+                                     for entry in entries.values() if not entry.served),
+                'topics': len(self._topics),
+            }
+
+
+_default_prefetcher: Optional[VariantPrefetcher] = None
+_default_prefetcher_lock = threading.Lock()
+
+
+def get_variant_prefetcher(levels: Sequence[str], formats: Sequence[str],
+                           generate: Callable[[str, str, str], Awaitable[Tuple[str, int]]],
+                           **kwargs) -> VariantPrefetcher:
+    """The process-wide prefetcher; the arguments are only used when it is first created."""
+    global _default_prefetcher
+    with _default_prefetcher_lock:
+        if _default_prefetcher is None:
+            _default_prefetcher = VariantPrefetcher(levels, formats, generate, **kwargs)
+        return _default_prefetcher
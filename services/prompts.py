@@ -55,7 +55,34 @@ def system_learning_prompt():
         Politely decline any requests to discuss topics outside these areas and guide the user back to relevant subjects.
         """
 
-def learning_prompt():
-    return """
+def learning_prompt(learner_level, answer_type, topic):
+    return f"""
         Please provide details of programming topic or concept to assist effectively.
-        """
\ No newline at end of file
+        Explain it as if I were a {learner_level}, and give the answer as a {answer_type}.
+        Topic: {topic}
+        """
+
+
+def rag_prompt(context, question):
+    return f"""Based on the following excerpts from our library, answer the user's question:
+
+    Context from the library:
+    {context}
+
+    User's question: {question}
+
+    Please provide a comprehensive answer that incorporates insights from the library. If the context doesn't fully address the question, you may add general software development knowledge to provide a complete response."""
+
+
+def conversation_summary_prompt(previous_summary, transcript):
+    return f"""
+        Update the running summary of a conversation between a user and Ducky, a software development assistant.
+        Keep every fact, decision, requirement, name, code identifier and open question the user may refer back to.
+        Drop greetings and repetition. Answer with the updated summary only, in at most 250 words.
+
+        Summary so far:
+        {previous_summary or "(empty)"}
+
+        New messages to fold in:
+        {transcript}
+        """
@@ -0,0 +1,144 @@
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from services.chunking import get_encoding, split_segments
+
+_WORD = re.compile(r'\w+')
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    """Word n-grams of a text, lowercased, for near-duplicate detection."""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def merge_overlap(first: str, second: str, max_overlap_chars: int = 2000, min_overlap_chars: int = 20) -> str:
+    """Join two consecutive chunks, writing the text they share (the chunker's overlap) only once."""
+    limit = min(len(first), len(second), max_overlap_chars)
+    for size in range(limit, min_overlap_chars - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+class ContextAssembler:
+    """
+    Packs retrieved chunks into a token budget for a RAG prompt.
+
+    Chunks are taken in relevance order. A chunk that directly precedes or follows one already taken
+    from the same document is merged into it, sharing its header and dropping the overlapping text.
+    A chunk whose word trigrams are mostly already in the context is dropped as a near-duplicate.
+    Passages that no longer fit are cut at a sentence boundary if enough room is left, otherwise skipped.
+    """
+
+    def __init__(self, token_budget: int = 3000, model: str = "gpt-3.5-turbo",
+                 duplicate_threshold: float = 0.8, min_fragment_tokens: int = 200):
+        self.token_budget = token_budget
+        self.encoding = get_encoding(model)
+        self.duplicate_threshold = duplicate_threshold
+        self.min_fragment_tokens = min_fragment_tokens
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode_ordinary(text))
+
+    @staticmethod
+    def _header(passage: Dict) -> str:
+        pages = (f"page {passage['page_number']}" if passage['page_end'] == passage['page_number']
+                 else f"pages {passage['page_number']}-{passage['page_end']}")
+        return f"From {passage['document_name']}, {pages}:\n"
+
+    def _render(self, passage: Dict) -> str:
+        return self._header(passage) + passage['text']
+
+    def _fit(self, passage: Dict, room: int) -> Optional[Dict]:
+        """The passage cut to its leading sentences that fit in `room` tokens, or None."""
+        if room < self.min_fragment_tokens:
+            return None
+        kept = ""
+        for segment in split_segments(passage['text']):
+            if self.count(self._header(passage) + kept + segment) > room:
+                break
+            kept += segment
+        if not kept.strip():
+            return None
+        return {**passage, 'text': kept.strip(), 'truncated': True}
+
+    def assemble(self, chunks: List[Dict]) -> Dict:
+        """
+        Build the context from chunks ordered best first.
+
+        Returns a dictionary with the `context` text, its `tokens`, the `passages` it is made of
+        (each with document_name, page_number, page_end, text and positions) and how many chunks
+        were `merged`, `duplicates` or `skipped`.
+        """
+        passages: List[Dict] = []
+        seen: Set[Tuple[str, ...]] = set()
+        merged = duplicates = skipped = 0
+
+        for chunk in chunks:
+            text = chunk['context'].strip()
+            shingles = _shingles(text)
+            if shingles and len(shingles & seen) / len(shingles) >= self.duplicate_threshold:
+                duplicates += 1
+                continue
+
+            position = chunk.get('position')
+            neighbour = None
+            if position is not None:
+                # A truncated passage has lost its tail, so it can't be joined seamlessly
+                neighbour = next((p for p in passages if p['document_name'] == chunk['document_name']
+                                  and not p.get('truncated')
+                                  and (position == p['positions'][0] - 1 or position == p['positions'][-1] + 1)),
+                                 None)
+            if neighbour is not None:
+                before = position < neighbour['positions'][0]
+                first, second = (text, neighbour['text']) if before else (neighbour['text'], text)
+                positions = [position] + neighbour['positions'] if before else neighbour['positions'] + [position]
+                candidate = {
+                    **neighbour,
+                    'text': merge_overlap(first, second),
+                    'page_number': min(neighbour['page_number'], chunk['page_number']),
+                    'page_end': max(neighbour['page_end'], chunk.get('page_end', chunk['page_number'])),
+                    'positions': positions,
+                }
+                others = sum(p['tokens'] for p in passages if p is not neighbour)
+                tokens = self.count(self._render(candidate))
+                if others + tokens <= self.token_budget:
+                    candidate['tokens'] = tokens
+                    passages[passages.index(neighbour)] = candidate
+                    seen |= shingles
+                    merged += 1
+                else:
+                    skipped += 1
+                continue
+
+            passage = {
+                'document_name': chunk['document_name'],
+                'page_number': chunk['page_number'],
+                'page_end': chunk.get('page_end', chunk['page_number']),
+                'text': text,
+                'positions': [position] if position is not None else [],
+            }
+            room = self.token_budget - sum(p['tokens'] for p in passages)
+            tokens = self.count(self._render(passage))
+            if tokens > room:
+                passage = self._fit(passage, room)
+                if passage is None:
+                    skipped += 1
+                    continue
+                tokens = self.count(self._render(passage))
+            passage['tokens'] = tokens
+            passages.append(passage)
+            seen |= shingles
+
+        context = "\n\n".join(self._render(passage) for passage in passages)
+        return {
+            'context': context,
+            'tokens': self.count(context) if passages else 0,
+            'passages': passages,
+            'merged': merged,
+            'duplicates': duplicates,
+            'skipped': skipped,
+        }
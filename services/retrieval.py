@@ -0,0 +1,183 @@
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from services.chunking import get_encoding
+from services.embedding import PDFSemanticSearch
+from services.embedding_store import EmbeddingStore
+from services.lexical_index import get_lexical_index
+from services.vector_index import get_index
+
+
+class RetrievalService:
+    """
+    Long-lived retrieval over a directory of PDFs, shared by every session in the server process.
+
+    `warm()` does everything a question should not pay for: ingesting the library (incrementally),
+    loading the vector and BM25 indexes, loading the tokenizer and opening a connection to the
+    embeddings endpoint. After that a search costs one query embedding plus the index lookups.
+    The library directory is re-checked at most every `refresh_interval` seconds, and only re-ingested
+    when a PDF was added, removed or modified.
+    """
+
+    def __init__(self, library_dir: str, store_path: str, searcher: Optional[PDFSemanticSearch] = None,
+                 refresh_interval: float = 30.0):
+        self.library_dir = library_dir
+        self.store_path = store_path
+        self.searcher = searcher or PDFSemanticSearch()
+        self.refresh_interval = refresh_interval
+        self.store: Optional[EmbeddingStore] = None
+        self.last_error: Optional[str] = None
+        self.warm_seconds: Optional[float] = None
+        self.endpoint_ok: Optional[bool] = None
+        self.searches = 0
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def _pdf_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.library_dir, '*.pdf')))
+
+    def _stale(self) -> bool:
+        """Whether the PDFs on disk differ from the ones the store was built from; costs one stat per PDF."""
+        if self.store is None:
+            return True
+        sources = self.store.sources
+        paths = self._pdf_paths()
+        if set(sources) != {os.path.basename(path) for path in paths}:
+            return True
+        for path in paths:
+            stat = os.stat(path)
+            known = sources[os.path.basename(path)]
+            if (known['size'], known['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+                return True
+        return False
+
+    def _load(self) -> EmbeddingStore:
+        """Ingest the library and build the indexes; the caller holds the lock."""
+        store = self.searcher.process_directory(self.library_dir, self.store_path)
+        get_index(store, self.searcher.index_storage, self.searcher.index_dimensions, self.searcher.index_reduction)
+        get_lexical_index(store)
+        self.store = store
+        self._checked = time.monotonic()
+        return store
+
+    def warm(self) -> 'RetrievalService':
+        """Load everything a search needs. Safe to call from several threads; only the first does the work."""
+        with self._lock:
+            if self._ready.is_set():
+                return self
+            started = time.perf_counter()
+            try:
+                get_encoding(self.searcher.embedding_model)
+                self._load()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Warming the retrieval service failed: {self.last_error}")
+                raise
+            self.warm_seconds = time.perf_counter() - started
+            self._ready.set()
+
+        # Open a keep-alive connection to the embeddings endpoint, past the query embedding cache so the
+        # probe really reaches it; search still works without it
+        try:
+            self.searcher.get_embedding("warm up", timeout=self.searcher.query_embedding_timeout, cache=False)
+            self.endpoint_ok = True
+        except Exception as e:
+            self.endpoint_ok = False
+            print(f"Embeddings endpoint is not reachable yet ({type(e).__name__})")
+        print(f"Retrieval service ready in {self.warm_seconds:.2f}s with {len(self.store)} chunks")
+        return self
+
+    def warm_in_background(self) -> None:
+        """Start warming on a daemon thread, once per service."""
+        with self._lock:
+            if self._thread is not None or self._ready.is_set():
+                return
+            self._thread = threading.Thread(target=self._warm_quietly, name="retrieval-warmup", daemon=True)
+            self._thread.start()
+
+    def _warm_quietly(self) -> None:
+        try:
+            self.warm()
+        except Exception:
+            pass  # recorded in last_error and retried by the next search
+
+    def current_store(self) -> EmbeddingStore:
+        """The store to search, re-ingesting first if the library changed since the last check."""
+        if not self._ready.is_set():
+            self.warm()
+        if time.monotonic() - self._checked < self.refresh_interval:
+            return self.store
+        with self._lock:
+            if time.monotonic() - self._checked >= self.refresh_interval:
+                if self._stale():
+                    print(f"Library in {self.library_dir} changed, refreshing {self.store_path}")
+                    self._load()
+                self._checked = time.monotonic()
+            return self.store
+
+    def search(self, query: str, top_k: int = 3, documents: Optional[Sequence[str]] = None) -> List[Dict]:
+        """Find the chunks most relevant to `query`, optionally only within some documents."""
+        chunks = self.searcher.find_relevant_chunks(query, self.current_store(), top_k, documents=documents)
+        self.searches += 1
+        return chunks
+
+    def documents(self) -> List[str]:
+        return list(self.current_store().documents)
+
+    def health(self) -> Dict:
+        """Readiness and basic facts about the loaded library, for status displays and probes."""
+        store = self.store
+        return {
+            'ready': self.ready,
+            'warming': not self.ready and self._thread is not None and self._thread.is_alive(),
+            'warm_seconds': None if self.warm_seconds is None else round(self.warm_seconds, 3),
+            'store_path': self.store_path,
+            'documents': list(store.documents) if store is not None else [],
+            'chunks': len(store) if store is not None else 0,
+            'embedding_model': self.searcher.embedding_model,
+            'index': {
+                'storage': self.searcher.index_storage,
+                'dimensions': self.searcher.index_dimensions,
+                'reduction': self.searcher.index_reduction,
+            },
+            'embeddings_endpoint': self.endpoint_ok,
+            'searches': self.searches,
+            'last_error': self.last_error,
+        }
+
+
+_services: Dict[str, RetrievalService] = {}
+_services_lock = threading.Lock()
+
+
+def get_retrieval_service(library_dir: str, store_path: str) -> RetrievalService:
+    """The process-wide retrieval service for a library, created on first use."""
+    key = os.path.abspath(store_path)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = _services[key] = RetrievalService(library_dir, store_path)
+        return service
+
+
+if __name__ == '__main__':
+    # Readiness probe: python -m services.retrieval [library dir] [store path]
+    service = get_retrieval_service(sys.argv[1] if len(sys.argv) > 1 else 'data',
+                                    sys.argv[2] if len(sys.argv) > 2 else 'data/library.embeddings')
+    try:
+        service.warm()
+    finally:
+        print(json.dumps(service.health(), indent=2))
+    sys.exit(0 if service.ready else 1)
@@ -0,0 +1,197 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from aitools_autogen.config import DEFAULT_MODEL, FAST_MODEL, config_list_openai
+
+# Questions that usually need the large model
+REASONING_WORDS = re.compile(r"\b(why|compare|design|architecture|optimi[sz]e|prove|trade-?offs?|debug|refactor|"
+                             r"complexity|concurrency|algorithm)\b", re.IGNORECASE)
+CODE_PATTERN = re.compile(r"```|^\s*(def|class|import|from|function|public|private|#include)\b|[;{}]\s*$",
+                          re.MULTILINE)
+SIMPLE_LEVELS = {"5 year old", "high school student"}
+DETAILED_FORMATS = {"article", "online course syllabus"}
+LARGE_MODEL_PAGES = {"generate_code", "auto_code"}
+FAST_MODEL_PAGES = {"voice", "summary"}
+
+
+class _ModelStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.first_token: Deque[float] = deque(maxlen=200)
+        self.total: Deque[float] = deque(maxlen=200)
+
+
+def _percentile(samples, q: float) -> Optional[float]:
+    return float(np.percentile(np.array(samples), q)) if samples else None
+
+
+class ModelRouter:
+    """
+    Picks the model for each request and the order to fall back in.
+
+    A cheap local classifier scores the request: code in the prompt, a long or reasoning-heavy question,
+    a long conversation, the page and the learner level or format all count. Requests that score high go
+    to `default_model`, the rest to `fast_model`. Live statistics then adjust the choice: a fast model
+    that is currently slower than the default one is not preferred, and a model that failed
+    `max_failures` times in a row is skipped for `cooldown` seconds. The remaining entries of
+    `config_list` follow as fallbacks, in their configured order.
+
+    `first_token_timeout` gives how long to wait for a model's first token before falling back, from its
+    recent time-to-first-token. Safe to share between threads.
+    """
+
+    def __init__(self, config_list: List[Dict], default_model: str = DEFAULT_MODEL, fast_model: str = FAST_MODEL,
+                 max_first_token_seconds: float = 20.0, min_samples: int = 5, max_failures: int = 3,
+                 cooldown: float = 30.0):
+        self.config_list = config_list
+        self.default_model = default_model
+        self.fast_model = fast_model
+        self.max_first_token_seconds = max_first_token_seconds
+        self.min_samples = min_samples
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.routed = {default_model: 0, fast_model: 0}
+        self._stats: Dict[Tuple[str, str], _ModelStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(candidate: Dict) -> Tuple[str, str]:
+        return candidate.get('base_url') or '', candidate['model']
+
+    def _model_stats(self, candidate: Dict) -> _ModelStats:
+        """Caller holds the lock."""
+        key = self._key(candidate)
+        if key not in self._stats:
+            self._stats[key] = _ModelStats()
+        return self._stats[key]
+
+    def classify(self, messages: List[Dict[str, str]], hints: Optional[Dict[str, str]] = None) -> Tuple[str, int]:
+        """The model a request needs by its content alone, and the score that decided it."""
+        hints = hints or {}
+        question = next((message['content'] for message in reversed(messages) if message['role'] == 'user'), '')
+        score = 0
+        if CODE_PATTERN.search(question) or any(CODE_PATTERN.search(message['content']) for message in messages
+                                                if message['role'] == 'system'):
+            score += 2
+        if len(question.split()) > 80:
+            score += 1
+        if REASONING_WORDS.search(question):
+            score += 1
+        if sum(message['role'] != 'system' for message in messages) > 6:
+            score += 1
+        if hints.get('page') in LARGE_MODEL_PAGES:
+            score += 2
+        if hints.get('page') in FAST_MODEL_PAGES or hints.get('level') in SIMPLE_LEVELS:
+            score -= 1
+        if hints.get('format') in DETAILED_FORMATS:
+            score += 1
+        return (self.default_model if score >= 2 else self.fast_model), score
+
+    def route(self, messages: List[Dict[str, str]], hints: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """
+        The `config_list` entries to try for a request, best first. Only looks: the request is counted
+        with `count` once it is actually sent, so one answered from a cache is not.
+        """
+        model, score = self.classify(messages, hints)
+        now = time.time()
+        with self._lock:
+            if model == self.fast_model:
+                fast = self._p50(self.fast_model)
+                default = self._p50(self.default_model)
+                # The fast model is only worth it while it is actually faster
+                if fast is not None and default is not None and fast > default:
+                    model = self.default_model
+            available = [c for c in self.config_list if self._model_stats(c).open_until <= now]
+            # Models in cooldown are only tried when everything else failed
+            cooling = [c for c in self.config_list if self._model_stats(c).open_until > now]
+        ordered = [c for c in available if c['model'] == model] + [c for c in available if c['model'] != model]
+        return ordered + cooling
+
+    def count(self, candidate: Dict) -> None:
+        """Count a request sent to the model it was routed to."""
+        with self._lock:
+            self.routed[candidate['model']] = self.routed.get(candidate['model'], 0) + 1
+
+    def _p50(self, model: str) -> Optional[float]:
+        """Median time to first token of a model over its endpoints, with enough samples; caller holds the lock."""
+        samples = [sample for (_, name), stats in self._stats.items() if name == model for sample in stats.first_token]
+        return _percentile(samples, 50) if len(samples) >= self.min_samples else None
+
+    def percentile(self, candidate: Dict, q: float, first_token: bool = True) -> Optional[float]:
+        """A percentile of a model's recent time to first token (or total time), once there are enough samples."""
+        with self._lock:
+            stats = self._model_stats(candidate)
+            samples = stats.first_token if first_token else stats.total
+            return _percentile(samples, q) if len(samples) >= self.min_samples else None
+
+    def first_token_timeout(self, candidate: Dict, first_token: bool = True) -> float:
+        """
+        Seconds to wait for a model's first token before giving up on it: 3x its recent p95, within limits.
+        With `first_token` False, the same for a whole non-streamed response, allowing three times as long.
+        """
+        limit = self.max_first_token_seconds if first_token else 3 * self.max_first_token_seconds
+        p95 = self.percentile(candidate, 95, first_token)
+        return limit if p95 is None else min(limit, max(5.0, 3 * p95))
+
+    def record(self, candidate: Dict, ok: bool, first_token: Optional[float] = None, total: Optional[float] = None,
+               timeout: bool = False, fallback: bool = False) -> None:
+        """Add the outcome of a request; `fallback` marks one that was served after another model failed."""
+        with self._lock:
+            stats = self._model_stats(candidate)
+            stats.requests += 1
+            stats.fallbacks += fallback
+            if ok:
+                stats.consecutive_failures = 0
+                if first_token is not None:
+                    stats.first_token.append(first_token)
+                if total is not None:
+                    stats.total.append(total)
+                return
+            stats.errors += 1
+            stats.timeouts += timeout
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.max_failures:
+                stats.open_until = time.time() + self.cooldown
+
+    def stats(self) -> Dict:
+        with self._lock:
+            models = []
+            for (base_url, model), stats in self._stats.items():
+                models.append({
+                    'base_url': base_url,
+                    'model': model,
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'timeouts': stats.timeouts,
+                    'fallbacks': stats.fallbacks,
+                    'cooling_down': stats.open_until > time.time(),
+                    'first_token_p50': _percentile(stats.first_token, 50),
+                    'first_token_p95': _percentile(stats.first_token, 95),
+                    'total_p50': _percentile(stats.total, 50),
+                })
+            return {'routed': dict(self.routed), 'models': models}
+
+
+_default_router: Optional[ModelRouter] = None
+_default_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    """The process-wide router over `config_list_openai`."""
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = ModelRouter(config_list_openai, DEFAULT_MODEL, FAST_MODEL,
+                                          float(os.getenv('DUCKY_FIRST_TOKEN_TIMEOUT', '20')))
+        return _default_router
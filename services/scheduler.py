@@ -0,0 +1,262 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Deque, Dict, List, Optional
+
+import numpy as np
+
+# Priority classes, most urgent first
+INTERACTIVE = "interactive"
+VOICE = "voice"
+BACKGROUND = "background"
+# The LLM calls of Auto Code agents: capped on their own so long blueprint runs can't fill the background class
+BLUEPRINT = "blueprint"
+PRIORITIES = {INTERACTIVE: 0, VOICE: 1, BACKGROUND: 2, BLUEPRINT: 3}
+
+DEFAULT_CONCURRENCY = {INTERACTIVE: 32, VOICE: 4, BACKGROUND: 4, BLUEPRINT: 2}
+# Share of each rate bucket a class must leave free for more urgent ones
+DEFAULT_RESERVE = {INTERACTIVE: 0.0, VOICE: 0.1, BACKGROUND: 0.3, BLUEPRINT: 0.4}
+
+
+class TokenBucket:
+    """Allows `rate` units per minute with bursts of up to one minute's worth. Not thread-safe by itself."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = rate
+        self.level = rate
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate / 60)
+        self._updated = now
+
+    def charge(self, amount: float, reserve: float = 0.0) -> float:
+        """What taking `amount` costs: a request larger than the share above `reserve` is charged that share."""
+        return min(amount, self.capacity * (1 - reserve)) if self.rate else 0.0
+
+    def wait_time(self, amount: float, reserve: float = 0.0) -> float:
+        """Seconds until `amount` can be taken while leaving `reserve` of the capacity; 0 if it can now."""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        needed = self.charge(amount, reserve) + reserve * self.capacity
+        return max(0.0, needed - self.level) * 60 / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.rate:
+            self._refill()
+            self.level -= amount
+
+    def give(self, amount: float) -> None:
+        """Return over-estimated units, or take more (a negative amount) once the real cost is known."""
+        if self.rate:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    def __init__(self, priority: str, tokens: int, wake: Callable[[], None]):
+        self.priority = priority
+        self.tokens = tokens
+        self.charged = 0.0
+        self.wake = wake
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.abandoned = False
+
+
+class Lease:
+    """A granted slot. Call `used` with the real token count when known, so the estimate can be corrected."""
+
+    def __init__(self, scheduler: "LLMScheduler", waiter: _Waiter):
+        self.scheduler = scheduler
+        self.priority = waiter.priority
+        self._waiter = waiter
+
+    def used(self, tokens: int) -> None:
+        self.scheduler._correct(self._waiter, tokens)
+
+
+class LLMScheduler:
+    """
+    Admission control for every request to the LLM endpoint, shared by all sessions and services.
+
+    A request asks for a slot in a priority class (interactive > voice > background > blueprint) with an estimate
+    of its tokens. Slots are granted in priority order, within each class's concurrency cap and within
+    two token buckets, requests per minute and tokens per minute. Less urgent classes must leave a share
+    of each bucket free (`reserve`), so background work can use the spare capacity without delaying
+    interactive requests. A blocked class does not hold up another class that still has slots.
+
+    Usable from threads (`slot`) and from any event loop (`aslot`): grants are made by a dispatcher thread.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 concurrency: Optional[Dict[str, int]] = None, reserve: Optional[Dict[str, float]] = None):
+        self.concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        self.reserve = {**DEFAULT_RESERVE, **(reserve or {})}
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._running = {priority: 0 for priority in PRIORITIES}
+        self._granted = {priority: 0 for priority in PRIORITIES}
+        self._waits: Dict[str, Deque[float]] = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+        self._queue: List = []  # heap of (priority rank, sequence, waiter)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        threading.Thread(target=self._dispatch, name="llm-scheduler", daemon=True).start()
+
+    def _enqueue(self, priority: str, tokens: int, wake: Callable[[], None]) -> _Waiter:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {priority}")
+        waiter = _Waiter(priority, tokens, wake)
+        with self._condition:
+            heapq.heappush(self._queue, (PRIORITIES[priority], next(self._sequence), waiter))
+            self._condition.notify()
+        return waiter
+
+    def _release(self, waiter: _Waiter) -> None:
+        with self._condition:
+            self._running[waiter.priority] -= 1
+            self._condition.notify()
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """A caller stopped waiting; give its slot back if it was granted meanwhile."""
+        with self._condition:
+            waiter.abandoned = True
+            if waiter.granted:
+                self._running[waiter.priority] -= 1
+                self.requests.give(1)
+                self.tokens.give(waiter.charged)
+                self._condition.notify()
+
+    def _correct(self, waiter: _Waiter, tokens: int) -> None:
+        with self._condition:
+            self.tokens.give(waiter.charged - tokens)
+            waiter.charged = tokens
+            self._condition.notify()
+
+    def _dispatch(self) -> None:
+        with self._condition:
+            while True:
+                timeout = self._grant()
+                self._condition.wait(timeout)
+
+    def _grant(self) -> Optional[float]:
+        """Grant every slot that can be granted now; returns when to look again. Caller holds the lock."""
+        retry = None
+        blocked_rank = None
+        waiting = []
+        while self._queue:
+            rank, sequence, waiter = heapq.heappop(self._queue)
+            if waiter.abandoned:
+                continue
+            if blocked_rank is not None and rank > blocked_rank:
+                # A more urgent class is waiting for rate capacity; don't let this one take it
+                waiting.append((rank, sequence, waiter))
+                continue
+            if self._running[waiter.priority] >= self.concurrency[waiter.priority]:
+                waiting.append((rank, sequence, waiter))
+                continue
+            reserve = self.reserve[waiter.priority]
+            wait = max(self.requests.wait_time(1, reserve), self.tokens.wait_time(waiter.tokens, reserve))
+            if wait > 0:
+                waiting.append((rank, sequence, waiter))
+                blocked_rank = rank if blocked_rank is None else blocked_rank
+                retry = wait if retry is None else min(retry, wait)
+                continue
+            waiter.charged = self.tokens.charge(waiter.tokens, reserve)
+            self.requests.take(1)
+            self.tokens.take(waiter.charged)
+            self._running[waiter.priority] += 1
+            self._granted[waiter.priority] += 1
+            self._waits[waiter.priority].append(time.monotonic() - waiter.enqueued)
+            waiter.granted = True
+            waiter.wake()
+        for item in waiting:
+            heapq.heappush(self._queue, item)
+        return min(retry, 5.0) if retry is not None else None
+
+    @contextmanager
+    def slot(self, priority: str = INTERACTIVE, tokens: int = 0):
+        """Hold a slot for a blocking request, waiting for it on the calling thread."""
+        granted = threading.Event()
+        waiter = self._enqueue(priority, tokens, granted.set)
+        try:
+            granted.wait()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        try:
+            yield Lease(self, waiter)
+        finally:
+            self._release(waiter)
+
+    @asynccontextmanager
+    async def aslot(self, priority: str = INTERACTIVE, tokens: int = 0):
+        """Hold a slot for a request made on the running event loop, without blocking the loop while waiting."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enqueue(priority, tokens, wake)
+        try:
+            await granted
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        try:
+            yield Lease(self, waiter)
+        finally:
+            self._release(waiter)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            queued = {priority: 0 for priority in PRIORITIES}
+            for _, _, waiter in self._queue:
+                if not waiter.abandoned and not waiter.granted:
+                    queued[waiter.priority] += 1
+            classes = {}
+            for priority in PRIORITIES:
+                waits = np.array(self._waits[priority]) * 1000 if self._waits[priority] else np.zeros(1)
+                classes[priority] = {
+                    'running': self._running[priority],
+                    'queued': queued[priority],
+                    'granted': self._granted[priority],
+                    'wait_ms_p50': round(float(np.percentile(waits, 50)), 1),
+                    'wait_ms_p95': round(float(np.percentile(waits, 95)), 1),
+                    'wait_ms_p99': round(float(np.percentile(waits, 99)), 1),
+                    'wait_ms_max': round(float(waits.max()), 1),
+                }
+            self.requests.wait_time(0)
+            self.tokens.wait_time(0)
+            return {
+                'classes': classes,
+                'requests_available': round(self.requests.level) if self.requests.rate else None,
+                'tokens_available': round(self.tokens.level) if self.tokens.rate else None,
+            }
+
+
+_default_scheduler: Optional[LLMScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """
+    The process-wide scheduler. Rate limits come from DUCKY_LLM_REQUESTS_PER_MINUTE and
+    DUCKY_LLM_TOKENS_PER_MINUTE, set to the endpoint's limits; unset or 0 means unlimited.
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = LLMScheduler(
+                requests_per_minute=float(os.getenv('DUCKY_LLM_REQUESTS_PER_MINUTE', '0')),
+                tokens_per_minute=float(os.getenv('DUCKY_LLM_TOKENS_PER_MINUTE', '0')))
+        return _default_scheduler
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import AsyncGenerator, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from services.disk_cache import TRIM_RATIO, Shared
+from services.embedding_cache import normalize_text
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'data/cache/semantic_responses.sqlite')
+
+
+def namespace_key(fields: Dict[str, str]) -> str:
+    """Hash of the request fields that must match exactly (model, system prompt, level, format, ...)."""
+    canonical = json.dumps({key: normalize_text(str(value)) for key, value in fields.items()}, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+async def replay_stream(text: str, chunk_chars: int = 24) -> AsyncGenerator[str, None]:
+    """Yield a stored response in small pieces, like a streamed completion, without waiting between them."""
+    start = 0
+    while start < len(text):
+        # Cut after a space where possible so pieces look like token deltas
+        stop = min(len(text), start + chunk_chars)
+        space = text.rfind(' ', start + 1, stop)
+        if stop < len(text) and space > start:
+            stop = space + 1
+        yield text[start:stop]
+        start = stop
+
+
+class SemanticResponseCache:
+    """
+    Stores answers and serves them again for questions that mean the same thing.
+
+    A request is split into exact fields (the namespace: model, system prompt, learner level, format...)
+    and a free-text question. The question is normalized and embedded; a lookup returns the stored
+    answer of the most similar question in the same namespace if its cosine similarity is at least
+    `threshold` and it is younger than `ttl` seconds. Entries live in SQLite, bounded by `max_entries`
+    with least-recently-used eviction, and the vectors of each namespace are kept in memory for lookups.
+    After a question could not be embedded, the cache is bypassed for `error_cooldown` seconds, so a
+    slow or failing embeddings endpoint doesn't delay every request. Safe to share between threads.
+    """
+
+    def __init__(self, embed: Callable[[str], np.ndarray], path: str = DEFAULT_CACHE_PATH, threshold: float = 0.93,
+                 ttl: float = 7 * 24 * 3600, max_entries: int = 5000, error_cooldown: float = 60.0):
+        self.embed = embed
+        self.error_cooldown = error_cooldown
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lookups = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.errors = 0
+        self.bypassed = 0
+        self.saved_chars = 0
+        self._bypass_until = 0.0
+        self._namespaces: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}  # namespace -> (ids, unit vectors)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                namespace TEXT NOT NULL,
+                question TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_namespace ON responses (namespace)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    def _vectors(self, namespace: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids and vectors of a namespace's live entries; the caller holds the lock."""
+        cached = self._namespaces.get(namespace)
+        if cached is None:
+            rows = self._db.execute("SELECT id, vector FROM responses WHERE namespace = ? AND created >= ?",
+                                    (namespace, time.time() - self.ttl)).fetchall()
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            vectors = (np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows
+                       else np.empty((0, 0), dtype=np.float32))
+            cached = self._namespaces[namespace] = (ids, vectors)
+        return cached
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        with self._lock:
+            if time.monotonic() < self._bypass_until:
+                self.bypassed += 1
+                return None
+        try:
+            vector = np.asarray(self.embed(normalize_text(question).lower()), dtype=np.float32)
+        except Exception as e:
+            # The cache is an optimization; without an embedding the request simply goes to the model
+            print(f"Semantic cache could not embed the question ({type(e).__name__}), "
+                  f"bypassing it for {self.error_cooldown:.0f}s")
+            with self._lock:
+                self.errors += 1
+                self._bypass_until = time.monotonic() + self.error_cooldown
+            return None
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, fields: Dict[str, str], question: str) -> Optional[Dict]:
+        """Return {'response', 'similarity', 'question'} for a close enough stored question, or None."""
+        namespace = namespace_key(fields)
+        vector = self._embed(question)
+        with self._lock:
+            self.lookups += 1
+            if vector is None:
+                self.misses += 1
+                return None
+            ids, vectors = self._vectors(namespace)
+            if len(ids) == 0 or vectors.shape[1] != len(vector):
+                self.misses += 1
+                return None
+            similarities = vectors @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            row = self._db.execute("SELECT question, response, created FROM responses WHERE id = ?",
+                                   (int(ids[best]),)).fetchone()
+            if row is None or row[2] < time.time() - self.ttl:
+                self.expired += row is not None
+                self.misses += 1
+                self._namespaces.pop(namespace, None)
+                return None
+            self._db.execute("UPDATE responses SET accessed = ?, hits = hits + 1 WHERE id = ?",
+                             (time.time(), int(ids[best])))
+            self._db.commit()
+            self.hits += 1
+            self.saved_chars += len(row[1])
+            return {'question': row[0], 'response': row[1], 'similarity': float(similarities[best])}
+
+    def store(self, fields: Dict[str, str], question: str, response: str) -> None:
+        """Remember the answer to a question."""
+        vector = self._embed(question)
+        if vector is None:
+            return
+        namespace = namespace_key(fields)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT INTO responses (namespace, question, vector, response, created, accessed) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (namespace, normalize_text(question), vector.tobytes(), response, now, now))
+            self._evict(now)
+            self._db.commit()
+            self._namespaces.pop(namespace, None)
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used beyond `max_entries`; the caller holds the lock."""
+        expired = self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+        count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        evicted = 0
+        if count > self.max_entries:
+            evicted = self._db.execute(
+                "DELETE FROM responses WHERE id IN (SELECT id FROM responses ORDER BY accessed LIMIT ?)",
+                (count - int(self.max_entries * TRIM_RATIO),)).rowcount
+        if expired or evicted:
+            self.expired += expired
+            self.evictions += evicted
+            self._namespaces.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'errors': self.errors,
+                'bypassed': self.bypassed,
+                'saved_chars': self.saved_chars,
+                'entries': entries,
+            }
+
+
+_default_cache: Shared[SemanticResponseCache] = Shared()
+
+
+def get_semantic_cache(embed: Callable[[str], np.ndarray]) -> SemanticResponseCache:
+    """The process-wide semantic response cache; `embed` is only used when it is first created."""
+    return _default_cache.get(lambda: SemanticResponseCache(embed))
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_TELEMETRY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data/telemetry')
+
+# Fields of a sample that are reported as distributions
+METRICS = ('ttft', 'duration', 'tokens_per_second', 'queue_wait')
+PERCENTILES = (50, 95, 99)
+
+
+class Telemetry:
+    """
+    Performance samples of every OpenAI request: time to first token, duration, generation speed and
+    token usage, tagged with the kind of request (chat, embedding, image, transcription), page, model
+    and endpoint.
+
+    Each sample is appended to `requests.jsonl` in `path`, which is rotated at `max_bytes` keeping
+    `backups` older files, and kept in memory among the last `window` samples, from which `summary`
+    computes percentiles. The current file is read back on start, so a restart keeps recent history.
+    With `path` None nothing is written. Safe to share between threads; recording never raises.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_TELEMETRY_DIR, max_bytes: int = 5 * 1024 * 1024,
+                 backups: int = 3, window: int = 5000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.write_errors = 0
+        self._recent: Deque[Dict] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._file = os.path.join(path, 'requests.jsonl') if path else None
+        self._bytes = 0
+        if self._file:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self._file, 'rb') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        self._bytes = sum(len(line) for line in lines)
+        for line in lines[-self._recent.maxlen:]:
+            try:
+                self._recent.append(json.loads(line))
+            except ValueError:
+                # A line cut short by a crash
+                continue
+
+    def record(self, kind: str, page: Optional[str] = None, model: Optional[str] = None,
+               endpoint: Optional[str] = None, **fields) -> Dict:
+        """
+        Add a sample. Seconds go in `ttft`, `duration` and `queue_wait`, token counts in `prompt_tokens`
+        and `completion_tokens`; `tokens_per_second` is derived from them when not given.
+        """
+        sample = {'time': round(time.time(), 3), 'kind': kind, 'page': page or 'other', 'model': model or '',
+                  'endpoint': str(endpoint or '').rstrip('/'), 'ok': True, **fields}
+        if sample.get('tokens_per_second') is None and sample.get('completion_tokens') and sample.get('duration'):
+            # Generation speed: the tokens after the first over the time spent streaming them
+            generating = sample['duration'] - (sample.get('ttft') or 0)
+            tokens = sample['completion_tokens'] - (1 if sample.get('ttft') is not None else 0)
+            if generating > 0 and tokens > 0:
+                sample['tokens_per_second'] = tokens / generating
+        for key, value in sample.items():
+            if isinstance(value, float):
+                sample[key] = round(value, 4)
+        line = (json.dumps(sample, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        with self._lock:
+            self._recent.append(sample)
+            if self._file:
+                self._write(line)
+        return sample
+
+    def _write(self, line: bytes) -> None:
+        """Caller holds the lock."""
+        try:
+            if self._bytes + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self._file, 'ab') as f:
+                f.write(line)
+            self._bytes += len(line)
+        except OSError as e:
+            self.write_errors += 1
+            if self.write_errors == 1:
+                print(f"Telemetry could not be written to {self._file}: {e}")
+
+    def _rotate(self) -> None:
+        """requests.jsonl becomes requests.jsonl.1, .1 becomes .2 and so on; caller holds the lock."""
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self._file}.{index}"):
+                os.replace(f"{self._file}.{index}", f"{self._file}.{index + 1}")
+        if self.backups and os.path.exists(self._file):
+            os.replace(self._file, f"{self._file}.1")
+        elif os.path.exists(self._file):
+            os.remove(self._file)
+        self._bytes = 0
+
+    @contextmanager
+    def measure(self, kind: str, page: Optional[str] = None, model: Optional[str] = None,
+                endpoint: Optional[str] = None, **fields):
+        """
+        Record the duration of a blocking request and whether it raised. The caller may add fields,
+        e.g. the usage once known, to the yielded dict.
+        """
+        sample = dict(fields)
+        started = time.monotonic()
+        try:
+            yield sample
+        except Exception as e:
+            sample.update(ok=False, error=type(e).__name__)
+            raise
+        finally:
+            sample.setdefault('duration', time.monotonic() - started)
+            self.record(kind, page, model, endpoint, **sample)
+
+    def recent(self, **filters) -> List[Dict]:
+        """The samples in memory, oldest first, that match every field=value in `filters`."""
+        with self._lock:
+            samples = list(self._recent)
+        return [sample for sample in samples if all(sample.get(key) == value for key, value in filters.items())]
+
+    def summary(self, group_by: Sequence[str] = ('kind', 'page', 'model', 'endpoint'), **filters) -> List[Dict]:
+        """Request and error counts, token totals and p50/p95/p99 of each metric, per group of recent samples."""
+        groups: Dict[tuple, List[Dict]] = {}
+        for sample in self.recent(**filters):
+            groups.setdefault(tuple(sample.get(field, '') for field in group_by), []).append(sample)
+        rows = []
+        for key, samples in sorted(groups.items(), key=lambda item: -len(item[1])):
+            errors = sum(not sample.get('ok', True) for sample in samples)
+            row = {
+                **dict(zip(group_by, key)),
+                'requests': len(samples),
+                'errors': errors,
+                'error_rate': round(errors / len(samples), 4),
+                'cached': sum(bool(sample.get('cached')) for sample in samples),
+                'prompt_tokens': sum(sample.get('prompt_tokens') or 0 for sample in samples),
+                'completion_tokens': sum(sample.get('completion_tokens') or 0 for sample in samples),
+                # Usage counted locally because the endpoint did not report it
+                'estimated_usage': sum(sample.get('usage') == 'estimate' for sample in samples),
+            }
+            for metric in METRICS:
+                values = np.array([sample[metric] for sample in samples
+                                   if sample.get(metric) is not None and not sample.get('cached')], dtype=float)
+                for q in PERCENTILES:
+                    row[f"{metric}_p{q}"] = round(float(np.percentile(values, q)), 4) if len(values) else None
+            rows.append(row)
+        return rows
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'samples': len(self._recent),
+                'file': self._file,
+                'bytes': self._bytes,
+                'write_errors': self.write_errors,
+            }
+
+
+_default_telemetry: Optional[Telemetry] = None
+_default_telemetry_lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """
+    The process-wide telemetry. Samples are written to DUCKY_TELEMETRY_DIR (default data/telemetry);
+    DUCKY_TELEMETRY=0 keeps them in memory only.
+    """
+    global _default_telemetry
+    with _default_telemetry_lock:
+        if _default_telemetry is None:
+            path = os.getenv('DUCKY_TELEMETRY_DIR', DEFAULT_TELEMETRY_DIR)
+            _default_telemetry = Telemetry(path if os.getenv('DUCKY_TELEMETRY', '1') != '0' else None)
+        return _default_telemetry
@@ -0,0 +1,228 @@
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.embedding_store import EmbeddingStore
+
+# How the index keeps its copy of the vectors in memory
+STORAGE_MODES = ('float32', 'float16', 'int8')
+# How `dimensions` are reduced: keep the leading dimensions (text-embedding-3 vectors are trained
+# to stay meaningful when truncated) or project onto the top principal directions of the corpus
+REDUCTIONS = ('truncate', 'pca')
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorIndex:
+    """
+    Cosine-similarity index over an embedding matrix.
+
+    Rows are L2-normalized once at build time, so a query costs a single matrix-vector
+    product followed by an argpartition for the top-k rows.
+
+    With `storage='float32'` and no `dimensions` the search is exact. Otherwise the index keeps a
+    compressed copy (float16, or int8 with one scale per row, optionally reduced to `dimensions`)
+    and rescores the best `top_k * rescore` candidates against the full-precision source vectors,
+    which are only read for those rows. Memory then scales with the compressed copy.
+    """
+
+    def __init__(self, vectors: np.ndarray, storage: str = 'float32', dimensions: Optional[int] = None,
+                 reduction: str = 'truncate', rescore: int = 10, block_rows: int = 4096):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {storage!r}, expected one of {STORAGE_MODES}")
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction {reduction!r}, expected one of {REDUCTIONS}")
+
+        count, full_dimensions = vectors.shape
+        if not dimensions or dimensions >= full_dimensions:
+            dimensions = None
+        self.storage = storage
+        self.dimensions = dimensions
+        self.reduction = reduction
+        self.rescore = rescore
+        self.block_rows = block_rows
+        self.exact = storage == 'float32' and dimensions is None
+        # Full-precision rows for rescoring; usually a read-only memmap, so this costs no memory
+        self.source = None if self.exact else vectors
+        self.projection = None
+        if dimensions is not None and reduction == 'pca':
+            self.projection = _fit_projection(vectors, dimensions)
+
+        dtype = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}[storage]
+        self.matrix = np.empty((count, dimensions or full_dimensions), dtype=dtype)
+        self.scales = np.empty(count, dtype=np.float32) if storage == 'int8' else None
+        # Encode block by block so we never hold a full float32 copy next to the compressed one
+        for start in range(0, count, block_rows):
+            block = self._reduce(_normalize(np.asarray(vectors[start:start + block_rows], dtype=np.float32)))
+            if storage == 'int8':
+                scales = np.abs(block).max(axis=1) / 127
+                scales[scales == 0] = 1.0
+                self.scales[start:start + len(block)] = scales
+                block = np.round(block / scales[:, None])
+            self.matrix[start:start + len(block)] = block
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the index itself (the memory-mapped source vectors are not counted)."""
+        return sum(a.nbytes for a in (self.matrix, self.scales, self.projection) if a is not None)
+
+    def _reduce(self, matrix: np.ndarray) -> np.ndarray:
+        if self.dimensions is None:
+            return matrix
+        if self.projection is not None:
+            return _normalize(matrix @ self.projection)
+        return _normalize(matrix[..., :self.dimensions])
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every row, approximate unless the index is exact."""
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ query
+        # numpy has no BLAS kernel for float16/int8, so widen one block at a time
+        scores = np.empty(len(self.matrix), dtype=np.float32)
+        for start in range(0, len(self.matrix), self.block_rows):
+            block = self.matrix[start:start + self.block_rows]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, query, top_k: int = 3, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the indices and cosine similarities of the `top_k` closest rows, best first.
+
+        `mask` is an optional boolean array; rows where it is False are never returned.
+        """
+        if len(self.matrix) == 0 or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        q = _normalize(np.asarray(query, dtype=np.float32))
+        scores = self._scores(self._reduce(q))
+        allowed = len(scores)
+        if mask is not None:
+            scores[~mask] = -np.inf
+            allowed = int(np.count_nonzero(mask))
+        top_k = min(top_k, allowed)
+        if top_k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        candidates = _top(scores, top_k if self.exact else min(top_k * self.rescore, allowed))
+        if not self.exact:
+            # Rescore at full precision; sorted indices keep memmap reads sequential
+            candidates = np.sort(candidates)
+            scores = np.full(len(self.matrix), -np.inf, dtype=np.float32)
+            scores[candidates] = _normalize(np.asarray(self.source[candidates], dtype=np.float32)) @ q
+            candidates = _top(scores, top_k)
+
+        order = candidates[np.argsort(-scores[candidates])]
+        return order, scores[order]
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Unordered indices of the `k` highest scores."""
+    if k >= len(scores):
+        return np.arange(len(scores))
+    return np.argpartition(-scores, k - 1)[:k]
+
+
+def _fit_projection(vectors: np.ndarray, dimensions: int, sample_size: int = 5000) -> np.ndarray:
+    """Top right-singular vectors of a sample of normalized rows, as a (full, reduced) projection matrix."""
+    rows = np.random.default_rng(0).choice(len(vectors), min(sample_size, len(vectors)), replace=False)
+    sample = _normalize(np.asarray(vectors[np.sort(rows)], dtype=np.float32))
+    _, _, vt = np.linalg.svd(sample, full_matrices=False)
+    return np.ascontiguousarray(vt[:dimensions].T)
+
+
+# Indexes are shared by every session in the server process, keyed by store path and index options.
+# Each entry remembers the signature of the store it was built from.
+_indexes: Dict[Tuple, Tuple[Tuple[int, int], VectorIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(store: EmbeddingStore, storage: str = 'float32', dimensions: Optional[int] = None,
+              reduction: str = 'truncate') -> VectorIndex:
+    """Return the process-wide index for a store, building it only when the store on disk has changed."""
+    key = (os.path.abspath(store.path), storage, dimensions, reduction)
+    signature = store.signature()
+
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        index = VectorIndex(store.vectors, storage, dimensions, reduction)
+        _indexes[key] = (signature, index)
+        return index
+
+
+def recall_at_k(expected: List[np.ndarray], found: List[np.ndarray], k: int) -> float:
+    """Fraction of the expected top-k rows that were found, averaged over queries."""
+    if not expected:
+        return 1.0
+    hits = sum(len(set(e[:k].tolist()) & set(f[:k].tolist())) for e, f in zip(expected, found))
+    return hits / sum(min(k, len(e)) or 1 for e in expected)
+
+
+DEFAULT_REPORT_CONFIGS = [
+    {'storage': 'float32'},
+    {'storage': 'float16'},
+    {'storage': 'int8'},
+    {'storage': 'float32', 'dimensions': 512},
+    {'storage': 'int8', 'dimensions': 512},
+    {'storage': 'int8', 'dimensions': 256, 'reduction': 'pca'},
+]
+
+
+def storage_report(vectors: np.ndarray, queries: Optional[np.ndarray] = None, k: int = 10,
+                   configs: Optional[List[Dict]] = None) -> List[Dict]:
+    """
+    Compare index configurations against the exact float32 index: memory, build time,
+    mean query latency and recall@k.
+
+    Without `queries`, perturbed copies of up to 200 random rows are used.
+    """
+    if queries is None:
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(200, len(vectors)), replace=False))])
+        queries = _normalize(sample + rng.normal(0, 0.5 / np.sqrt(vectors.shape[1]), sample.shape))
+
+    exact = VectorIndex(vectors)
+    expected = [exact.search(query, k)[0] for query in queries]
+    rows = []
+    for config in configs or DEFAULT_REPORT_CONFIGS:
+        started = time.perf_counter()
+        index = VectorIndex(vectors, **config)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        found = [index.search(query, k)[0] for query in queries]
+        query_ms = (time.perf_counter() - started) / max(len(queries), 1) * 1000
+
+        rows.append({
+            'storage': index.storage,
+            'dimensions': index.dimensions or vectors.shape[1],
+            'reduction': index.reduction if index.dimensions else '-',
+            'index_mb': round(index.nbytes / 2 ** 20, 2),
+            'build_s': round(build_seconds, 3),
+            'query_ms': round(query_ms, 3),
+            f'recall@{k}': round(recall_at_k(expected, found, k), 4),
+        })
+    return rows
+
+
+if __name__ == '__main__':
+    # python -m services.vector_index [store path]
+    from tabulate import tabulate
+
+    store = EmbeddingStore.open(sys.argv[1] if len(sys.argv) > 1 else 'data/library.embeddings')
+    print(tabulate(storage_report(store.vectors), headers='keys'))
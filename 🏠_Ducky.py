@@ -1,6 +1,7 @@
 import streamlit as st
 
 import helpers.sidebar
+from helpers import util
 
 st.set_page_config(
     page_title="Ducky",
@@ -10,6 +11,9 @@ st.set_page_config(
 
 helpers.sidebar.show()
 
+# Load the PDF library and its indexes while the user is still on the home page
+util.warm_library()
+
 st.toast("Welcome to Ducky!", icon="🐥")
 
 st.markdown("Welcome to Ducky, your AI-powered software developer assistant!")